@@ -1,12 +1,30 @@
-from ipaddress import ip_network, IPv4Network
 import requests
 import os
-import json
+import sys
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.prefixes import coverage_gaps
 
 RUNZERO_ORG_TOKEN = os.environ["RUNZERO_ORG_TOKEN"]
 HEADERS = {"Authorization": f"Bearer {RUNZERO_ORG_TOKEN}"}
 BASE_URL = "https://console.runZero.com/api/v1.0"
 
+RFC_RANGES = ["10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16"]
+# IPv6 unique local addresses - the closest thing IPv6 has to RFC1918
+ULA_RANGES = ["fc00::/7"]
+
+# Command line args
+parser = argparse.ArgumentParser(
+    prog="RFC1918 Coverage",
+    description="Lists the private ranges that none of your Sites cover",
+)
+parser.add_argument(
+    "--ula",
+    action="store_true",
+    help="check IPv6 unique local addresses (fc00::/7) instead of RFC1918",
+)
+
 
 def get_sites():
     url = BASE_URL + "/org/sites"
@@ -14,60 +32,17 @@ def get_sites():
     return sites.json()
 
 
-def get_missing(subnet_networks: list, rfc_range: IPv4Network):
-    missing = []
-    new_prefix = 8
-    has_subnets = False
-
-    for current_subnet in subnet_networks:
-        if current_subnet.overlaps(rfc_range):
-            has_subnets = True
-
-    if has_subnets:
-        for current_subnet in subnet_networks:
-            if int(current_subnet.prefixlen) > new_prefix and current_subnet.overlaps(rfc_range):
-                new_prefix = current_subnet.prefixlen
-
-        for r in rfc_range.subnets(new_prefix=new_prefix):
-            add = True
-            if r in subnet_networks:
-                add = False
-
-            for current_subnet in subnet_networks:
-                if r.subnet_of(current_subnet):
-                    add = False
-
-            if add:
-                missing.append(r)
-
-    else:
-        missing.append(rfc_range)
-
-    final_missing = []
-    for sub in missing:
-        if sub not in final_missing:
-            final_missing.append(sub)
-
-    return final_missing
-
-
-def create_subnet_diff(subnets: list):
-
-    rfc_ranges = [IPv4Network("10.0.0.0/8"),
-                  IPv4Network("172.16.0.0/12"),
-                  IPv4Network("192.168.0.0/16")]
-    total_missing = []
-    subnet_networks = [IPv4Network(x) for x in subnets]
-
-    for range in rfc_ranges:
-        missing = get_missing(
-            subnet_networks=subnet_networks, rfc_range=range)
-        total_missing.extend(missing)
+def create_subnet_diff(subnets: list, ranges: list = RFC_RANGES):
+    """Returns the fewest CIDRs that cover every part of ranges missing from subnets.
 
-    return total_missing
+    The site subnets are merged into sorted integer intervals and subtracted
+    from each range, so small subnets (even /32s) don't slow it down.
+    """
+    return coverage_gaps(ranges, subnets)
 
 
 def main():
+    args = parser.parse_args()
     sites = get_sites()
     coverage = []
 
@@ -75,7 +50,7 @@ def main():
         for subnet in list(site["subnets"].keys()):
             coverage.append(subnet)
 
-    diff = create_subnet_diff(coverage)
+    diff = create_subnet_diff(coverage, ULA_RANGES if args.ula else RFC_RANGES)
     for x in diff:
         print(x)
 
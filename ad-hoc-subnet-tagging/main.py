@@ -4,6 +4,9 @@ import requests
 import sys
 import logging
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.prefixes import PrefixTrie, to_network
+
 RUNZERO_ORG_TOKEN = os.environ.get("RUNZERO_ORG_TOKEN")
 if not RUNZERO_ORG_TOKEN:
     print("❌ RUNZERO_ORG_TOKEN not set in environment.")
@@ -24,6 +27,9 @@ def main():
     sites = resp.json()
     print(f"✅ Found {len(sites)} sites. Processing each one...\n")
 
+    # collect every tagged subnet first so they can be applied broadest first
+    jobs = []
+    tagged = PrefixTrie()
     for site in sites:
         site_name = site.get("name", "Unnamed Site")
         subnets = site.get("subnets", {})
@@ -40,27 +46,48 @@ def main():
                 print(f"  ⚠️  Subnet {subnet} has no tags. Skipping.")
                 continue
 
-            # Convert dict to string of "key=value" pairs separated by spaces
-            tags_str = " ".join(f"{k}={v}" if v else k for k, v in tags_dict.items())
+            try:
+                network = to_network(subnet)
+            except ValueError:
+                print(f"  ⚠️  Subnet {subnet} is not a valid CIDR. Skipping.")
+                continue
 
-            payload = {"search": f"net:{subnet}", "tags": tags_str}
+            tagged.insert(network, tags_dict, replace=False)
+            jobs.append((network, subnet, tags_dict))
 
-            print(f"  🌐 Applying tags '{tags_str}' to subnet {subnet}...")
+        print(f"--- Finished site: {site_name} ---\n")
 
-            response = requests.patch(
-                f"{BASE_URL}/org/assets/bulk/tags", headers=HEADERS, json=payload
-            )
+    # a bulk tag on a larger subnet also lands on every asset inside it, so apply
+    # the larger subnets first (the more specific tags win) and skip subnets whose
+    # tags are all inherited from the subnets around them
+    for network, subnet, tags_dict in sorted(jobs, key=lambda j: j[0].prefixlen):
+        inherited = {}
+        for parent, parent_tags in tagged.covering(network):
+            if parent.prefixlen < network.prefixlen:
+                inherited.update(parent_tags)
+        if all(k in inherited and inherited[k] == v for k, v in tags_dict.items()):
+            print(f"  ⏭  Subnet {subnet} already gets its tags from a larger subnet. Skipping.")
+            continue
 
-            if response.ok:
-                print(
-                    f"  ✅ Successfully initiated bulk tag update for subnet {subnet}"
-                )
-            else:
-                print(
-                    f"  ❌ Failed to tag subnet {subnet}: {response.status_code} {response.text}"
-                )
+        # Convert dict to string of "key=value" pairs separated by spaces
+        tags_str = " ".join(f"{k}={v}" if v else k for k, v in tags_dict.items())
 
-        print(f"--- Finished site: {site_name} ---\n")
+        payload = {"search": f"net:{subnet}", "tags": tags_str}
+
+        print(f"  🌐 Applying tags '{tags_str}' to subnet {subnet}...")
+
+        response = requests.patch(
+            f"{BASE_URL}/org/assets/bulk/tags", headers=HEADERS, json=payload
+        )
+
+        if response.ok:
+            print(
+                f"  ✅ Successfully initiated bulk tag update for subnet {subnet}"
+            )
+        else:
+            print(
+                f"  ❌ Failed to tag subnet {subnet}: {response.status_code} {response.text}"
+            )
 
     print("🎉 Site subnet tag propagation completed.")
 
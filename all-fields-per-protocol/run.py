@@ -1,9 +1,11 @@
-import requests
 import os
+import sys
 import csv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.cache import cached_export
+
 RUNZERO_EXPORT_TOKEN = os.environ["RUNZERO_EXPORT_TOKEN"]
-HEADERS = {"Authorization": f"Bearer {RUNZERO_EXPORT_TOKEN}"}
 BASE_URL = "https://console.runZero.com/api/v1.0"
 
 
@@ -20,9 +22,7 @@ def write_to_csv(output: dict, filename: str, fieldnames: list):
 
 def main():
     tracker = {}
-    url = BASE_URL + "/export/org/assets.json?"
-    data = requests.get(url, headers=HEADERS)
-    assets = data.json()
+    assets = cached_export(None, RUNZERO_EXPORT_TOKEN, "assets", base_url=BASE_URL)
     for a in assets:
         services = a["services"]
         for s in services.keys():
@@ -1,14 +1,23 @@
 import requests
 import os
+import sys
 import csv
-import ipaddress
 import json
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.cache import cached_export
+from common.sync import sync_assets, read_snapshot
+from common.subnets import aggregate_assets
+from common.prefixes import site_subnet_index
+
 # auth - navigate here to create an account token: https://console.runzero.com/account
 RUNZERO_ACCOUNT_TOKEN = os.environ["RUNZERO_DEMO_ACCOUNT_TOKEN"]
 HEADERS = {"Authorization": f"Bearer {RUNZERO_ACCOUNT_TOKEN}"}
 BASE_URL = "https://demo.runZero.com/api/v1.0"
 
+# SET TO READ FROM A LOCAL SNAPSHOT THAT ONLY PULLS CHANGED ASSETS - see incremental-sync/README.md
+SNAPSHOT_DIR = os.environ.get("RUNZERO_SNAPSHOT_DIR")
+
 def write_to_csv(output: list, filename: str, fieldnames: list):
     """Writes a list of dictionaries to a CSV file."""
     with open(filename, "w", newline="") as f:
@@ -16,14 +25,18 @@ def write_to_csv(output: list, filename: str, fieldnames: list):
         writer.writeheader()
         writer.writerows(output)
 
-def get_assets(token: str):
-    """Gets all assets for a given organization."""
-    url = f"{BASE_URL}/export/org/assets.json"
-    params = {"search": "alive:t", "fields": "id,site_name,addresses"}
-    headers = {"Authorization": f"Bearer {token}"}
-    response = requests.get(url, headers=headers, params=params)
-    response.raise_for_status()
-    return response.json()
+def get_assets(token: str, org_id: str):
+    """Streams all alive assets for a given organization."""
+    search = "alive:t"
+    fields = "id,site_name,addresses"
+    if SNAPSHOT_DIR:
+        snapshot_path, stats = sync_assets(
+            org_id, token, SNAPSHOT_DIR, search=search, fields=fields, base_url=BASE_URL
+        )
+        print(f"{stats['mode']} sync: {stats['changed']} changed, {stats['removed']} removed")
+        return read_snapshot(snapshot_path)
+
+    return cached_export(org_id, token, "assets", search=search, fields=fields, base_url=BASE_URL)
 
 def get_sites(org_id: str):
     """Gets all sites for a given organization."""
@@ -52,45 +65,25 @@ def main():
 
         print(f"Processing organization: {org_name}")
 
-        assets = get_assets(export_token)
-        subnet_counts = {}
-
-        for asset in assets:
-            site = asset.get("site_name")
-            if not site:
-                continue
-
-            addresses = asset.get("addresses", [])
-            for address in addresses:
-                try:
-                    ip = ipaddress.ip_address(address)
-                    if ip.version == 4:
-                        subnet = ".".join(address.split(".")[:3]) + ".0/24"
-                        key = (site, subnet)
-                        subnet_counts[key] = subnet_counts.get(key, 0) + 1
-                except ValueError:
-                    # a small number of addresses are not valid IPs
-                    pass
+        assets = get_assets(export_token, id)
+        # /24 per site for every IPv4 address - assets without a site are skipped
+        subnet_counts = {
+            (row["group"], row["subnet"]): row["count"]
+            for row in aggregate_assets(assets, group_field="site_name")
+        }
+
+        # longest-prefix match against the subnets defined on the asset's own site
+        site_subnets = site_subnet_index(sites, by_site=True)
 
         for (site, subnet), count in subnet_counts.items():
             subnet_tags = ""
             subnet_descriptions = ""
-            found_match = False
-            for s in sites:
-                if s.get('name') == site:
-                    for defined_subnet, details in s.get('subnets', {}).items():
-                        try:
-                            if ipaddress.ip_network(subnet).subnet_of(ipaddress.ip_network(defined_subnet)):
-                                tags = details.get('tags', {})
-                                subnet_tags = ' '.join([f'{k}={v}' for k,v in tags.items()])
-                                subnet_descriptions = details.get('description', '')
-                                found_match = True
-                                break
-                        except ValueError:
-                            pass
-                    if found_match:
-                        break
-            
+            match = site_subnets[site].longest_match(subnet) if site in site_subnets else None
+            if match:
+                details = match[1]
+                subnet_tags = ' '.join([f'{k}={v}' for k,v in details["tags"].items()])
+                subnet_descriptions = details["description"]
+
             output.append({
                 "name": site,
                 "description": "",
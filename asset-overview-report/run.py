@@ -1,5 +1,6 @@
 import requests
 import os
+import sys
 import csv
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -7,6 +8,10 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Tabl
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import getSampleStyleSheet
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.cache import cached_export
+from common.search import LocalInventory, UnsupportedSearch, search_fields
+
 
 RUNZERO_ACCOUNT_TOKEN = os.environ["RUNZERO_DEMO_ACCOUNT_TOKEN"]
 HEADERS = {"Authorization": f"Bearer {RUNZERO_ACCOUNT_TOKEN}"}
@@ -228,21 +233,69 @@ def write_to_csv(output: list, filename: str):
     print(f"Successfully wrote {len(output)} rows to {filename}")
 
 
-def get_runzero_data(token: str, search: str, fields: str = "id"):
-    """Fetches data from the runZero API."""
-    headers = {"Authorization": f"Bearer {token}"}
-    url = BASE_URL + "/export/org/assets.json"
+def get_runzero_data(token: str, search: str, fields: str = "id", org_id: str = None):
+    """Fetches data from the runZero API (or the shared cache if RUNZERO_CACHE_PATH is set)."""
+    try:
+        return list(
+            cached_export(
+                org_id, token, "assets", search=search, fields=fields, base_url=BASE_URL
+            )
+        )
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching data from runZero: {e}")
+        return None
+
+
+def count_runzero_data(token: str, search: str, org_id: str = None):
+    """Counts matching assets from the streamed export without holding them in memory."""
     try:
-        response = requests.get(
-            url, headers=headers, params={"search": search, "fields": fields}
+        return sum(
+            1
+            for _ in cached_export(
+                org_id, token, "assets", search=search, fields="id", base_url=BASE_URL
+            )
         )
-        response.raise_for_status()  # Raise an exception for bad status codes
-        return response.json()
     except requests.exceptions.RequestException as e:
         print(f"Error fetching data from runZero: {e}")
         return None
 
 
+def count_fields():
+    """Fields needed to answer the count reports from one local snapshot.
+
+    Searches the local parser rejects are left out - count_report sends those
+    to the API anyway.
+    """
+    searches = []
+    for report in REPORTS:
+        if report["type"] != "count":
+            continue
+        try:
+            search_fields(report["search"])
+        except UnsupportedSearch:
+            continue
+        searches.append(report["search"])
+    return search_fields(*searches)
+
+
+def load_inventory(token: str, org_id: str = None):
+    """Downloads one snapshot of the org that the count reports are evaluated against locally."""
+    data = get_runzero_data(token, None, count_fields(), org_id)
+    if data is None:
+        return None
+    return LocalInventory(data)
+
+
+def count_report(inventory: LocalInventory, token: str, search: str, org_id: str = None):
+    """Counts a search from the local snapshot, asking the API when the search isn't supported locally."""
+    if inventory is not None:
+        try:
+            return inventory.count(search)
+        except UnsupportedSearch as e:
+            print(f"Counting via the API instead - {e}")
+    return count_runzero_data(token, search, org_id)
+
+
 def main():
     """Main function to generate reports for all organizations."""
     try:
@@ -273,19 +326,22 @@ def main():
 
         # A list to hold the results of the count reports for this org
         count_summary = []
+        inventory = load_inventory(token, org.get("id"))
 
         # Process each report defined in the REPORTS list
         for report in REPORTS:
             print(f"Running report: {report['name']}...")
             if report["type"] == "count":
-                data = get_runzero_data(token, report["search"])
-                if data is not None:
+                count = count_report(inventory, token, report["search"], org.get("id"))
+                if count is not None:
                     count_summary.append(
-                        {"report_name": report["name"], "count": len(data)}
+                        {"report_name": report["name"], "count": count}
                     )
 
             elif report["type"] == "dump":
-                data = get_runzero_data(token, report["search"], report["fields"])
+                data = get_runzero_data(
+                    token, report["search"], report["fields"], org.get("id")
+                )
                 if data:
                     # Clean up the data for CSV writing
                     for row in data:
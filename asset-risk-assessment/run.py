@@ -1,13 +1,47 @@
 import requests
 import os
+import sys
 import csv
 import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.cache import cached_export
+from common.http import RunZeroClient
+
+# Command line args
+parser = argparse.ArgumentParser(
+    prog="Asset Risk Assessment",
+    description="Runs the searches in queries.csv against every organization and builds risk reports",
+)
+parser.add_argument(
+    "--queries", type=str, default="queries.csv", help="CSV of searches to run"
+)
+parser.add_argument(
+    "--concurrency",
+    type=int,
+    default=4,
+    help="how many searches to run at the same time for each organization",
+)
+parser.add_argument(
+    "--org-workers",
+    type=int,
+    default=1,
+    help="how many organizations to process at the same time",
+)
 
 # auth - navigate here to create an account token: https://console.runzero.com/account
 RUNZERO_ACCOUNT_TOKEN = os.environ["RUNZERO_ACCOUNT_TOKEN"]
 HEADERS = {"Authorization": f"Bearer {RUNZERO_ACCOUNT_TOKEN}"}
 BASE_URL = "https://console.runZero.com/api/v1.0"
 
+SEARCH_TYPES = ["assets", "services", "wireless", "users", "groups"]
+SEARCH_FIELDS = "id,addresses,addresses_extra,names"
+
+# pooled connections + retries on 429/5xx, shared by all the workers
+CLIENT = RunZeroClient(base_url=BASE_URL, pool_size=32)
+
 
 def write_to_csv(output: dict, filename: str, fieldnames: list):
     file = open(filename, "w")
@@ -20,85 +54,142 @@ def write_to_csv(output: dict, filename: str, fieldnames: list):
     file.close()
 
 
-def handle_org(token: str, name: str):
+def load_queries(filename: str):
+    """Reads the queries CSV once, keeping the file order for the reports."""
+    queries = []
+    with open(filename, "r") as f:
+        reader = csv.reader(f, delimiter=",")
+        for row in reader:
+            # skip headers
+            if row[0] == "name":
+                continue
+            queries.append({
+                "search_name": row[0],
+                "description": row[1],
+                "search_type": row[2],
+                "severity": row[4],
+                "query": row[5],
+            })
+    return queries
+
+
+def plan_queries(queries: list):
+    """Groups the queries by export endpoint and drops duplicates.
+
+    Returns {search_type: [query, ...]} with each distinct search listed once,
+    so a search that appears on several rows is only exported once per org.
+    """
+    plan = {t: [] for t in SEARCH_TYPES}
+    for q in queries:
+        if q["search_type"] not in plan:
+            print(f"non supported search type {q['search_type']}")
+            continue
+        if q["query"] not in plan[q["search_type"]]:
+            plan[q["search_type"]].append(q["query"])
+    return plan
+
+
+def run_query(token: str, org_id: str, search_type: str, query: str):
+    """Runs one search and returns (matching ids, {id: asset details}), or None if it failed.
+
+    Records are reduced to what the reports use as they stream in, so a
+    finished search holds its ids and one details dict per asset rather than
+    the full result list.
+    """
+    ids = []
+    details = {}
+    try:
+        for asset in cached_export(
+                org_id, token, search_type, search=query,
+                fields=SEARCH_FIELDS, base_url=BASE_URL, session=CLIENT):
+            ids.append(asset["id"])
+            if asset["id"] not in details:
+                details[asset["id"]] = {
+                    "id": asset.get("id", ""),
+                    "addresses": asset.get("addresses", ""),
+                    "addresses_extra": asset.get("addresses_extra", ""),
+                    "names": asset.get("names", ""),
+                }
+    except requests.exceptions.RequestException:
+        return None
+    return ids, details
+
+
+def handle_org(token: str, name: str, queries: list, org_id: str = None, concurrency: int = 4):
     print(f"handling {name}...")
     # check for folder or create
     if not os.path.exists(name):
         os.mkdir(name)
 
-    # create export headers
-    headers = {"Authorization": f"Bearer {token}"}
-
     # dicts for tracking counts and data
     executive_report = []
     asset_report = {}
     risk_report = []
 
-    # queries to run
-    queries = open("queries.csv", "r")
-    reader = csv.reader(queries, delimiter=",")
-
-    for row in reader:
-
-        # skip headers
-        if row[0] != "name":
-            search_name = row[0]
-            description = row[1]
-            search_type = row[2]
-            severity = row[4]
-            query = row[5]
-
-            if search_type == "assets":
-                url = BASE_URL + "/export/org/assets.json?"
-            elif search_type == "services":
-                url = BASE_URL + "/export/org/services.json?"
-            elif search_type == "wireless":
-                url = BASE_URL + "/export/org/wireless.json?"
-            else:
-                print(f"non supported search type {search_type}")
-
-            data = requests.get(url, headers=headers, params={
-                                "search": query, "fields": "id,addresses,addresses_extra,names"})
-
-            if data.status_code == 200:
-                results = data.json()
-
-                if len(results) > 0:
-                    executive_report.append({
-                        "org_name": name,
-                        "search_name": search_name,
-                        "search_description": description,
-                        "search_type": search_type,
-                        "severity": severity,
-                        "count": len(results)
-                    })
-
-                    risk_report.append({
-                        "org_name": name,
-                        "search_name": search_name,
-                        "search_description": description,
-                        "search_type": search_type,
-                        "severity": severity,
-                        "count": len(results),
-                        "asset_ids": [x["id"] for x in results]
-                    })
-
-                    for asset in results:
-                        if asset["id"] in asset_report.keys():
-                            asset_report[asset["id"]]["risks"].append(
-                                search_name)
-                        else:
-                            asset_report[asset["id"]] = {
-                                "org_name": name,
-                                "id": asset.get("id", ""),
-                                "addresses": asset.get("addresses", ""),
-                                "addresses_extra": asset.get("addresses_extra", ""),
-                                "names": asset.get("names", ""),
-                                "risks": [search_name]
-                            }
-
-            else:
-                print(f"{search_name} caused a non-200")
+    # run every distinct search concurrently, capped per org - each one is
+    # folded into the ids per search and the details per asset as it finishes
+    plan = plan_queries(queries)
+    ids_by_search = {}
+    asset_details = {}
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        future_map = {
+            executor.submit(run_query, token, org_id, search_type, query): (search_type, query)
+            for search_type, searches in plan.items()
+            for query in searches
+        }
+        for future in as_completed(future_map):
+            result = future.result()
+            if result is None:
+                ids_by_search[future_map[future]] = None
+                continue
+            ids, details = result
+            ids_by_search[future_map[future]] = ids
+            for asset_id, detail in details.items():
+                asset_details.setdefault(asset_id, detail)
+
+    # build the reports in queries.csv order so the output matches a serial run
+    for q in queries:
+        key = (q["search_type"], q["query"])
+        if key not in ids_by_search:
+            continue
+        search_name = q["search_name"]
+        ids = ids_by_search[key]
+
+        if ids is not None:
+
+            if len(ids) > 0:
+                executive_report.append({
+                    "org_name": name,
+                    "search_name": search_name,
+                    "search_description": q["description"],
+                    "search_type": q["search_type"],
+                    "severity": q["severity"],
+                    "count": len(ids)
+                })
+
+                risk_report.append({
+                    "org_name": name,
+                    "search_name": search_name,
+                    "search_description": q["description"],
+                    "search_type": q["search_type"],
+                    "severity": q["severity"],
+                    "count": len(ids),
+                    "asset_ids": ids
+                })
+
+                for asset_id in ids:
+                    if asset_id in asset_report.keys():
+                        asset_report[asset_id]["risks"].append(
+                            search_name)
+                    else:
+                        asset_report[asset_id] = {
+                            "org_name": name,
+                            **asset_details[asset_id],
+                            "risks": [search_name]
+                        }
+
+        else:
+            print(f"{search_name} caused a non-200")
 
     write_to_csv(
         output=executive_report,
@@ -151,14 +242,18 @@ def handle_org(token: str, name: str):
 
 
 def main():
-    orgs = requests.get(BASE_URL + "/account/orgs", headers=HEADERS)
+    args = parser.parse_args()
+    queries = load_queries(args.queries)
+
+    orgs = CLIENT.get("/account/orgs", headers=HEADERS)
+    to_run = []
     for o in orgs.json():
         token = o.get("export_token", "")
         name = o.get("name").replace(" ", "_").replace("-", "").lower()
         asset_count = o.get("asset_count")
         max_assets = 100000
         if token and asset_count < max_assets:
-            handle_org(token=token, name=name)
+            to_run.append((token, name, o.get("id")))
         if not token:
             print(
                 f"skipping {name} - you need to enable the export token in the UI to run the report")
@@ -166,6 +261,21 @@ def main():
             print(
                 f"skipping {name} - you need to increase the max_assets value to be above {max_assets} to run")
 
+    with ThreadPoolExecutor(max_workers=max(1, args.org_workers)) as executor:
+        future_map = {
+            executor.submit(
+                handle_org, token=token, name=name, queries=queries,
+                org_id=org_id, concurrency=args.concurrency): name
+            for token, name, org_id in to_run
+        }
+        for future in as_completed(future_map):
+            try:
+                future.result()
+            except Exception as exc:
+                print(f"FAILED - {future_map[future]} with error {exc}")
+
+    CLIENT.stats.print()
+
 
 if __name__ == "__main__":
     main()
@@ -1,18 +1,28 @@
 import os
+import sys
 import requests
 import json
 import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from rich.console import Console
 from rich.prompt import Prompt
 from rich.table import Table
 from itertools import groupby
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.hostnames import group_hostnames
+from common.http import RunZeroClient, AdaptiveRateLimiter, STATS
+
 # --- Configuration ---
 # Ensure you have RUNZERO_ORG_TOKEN set in your environment variables
 # This uses the ORG_TOKEN, which has more permissions than an EXPORT_TOKEN
 RUNZERO_TOKEN = os.environ.get("RUNZERO_ORG_TOKEN")
 HEADERS = {"Authorization": f"Bearer {RUNZERO_TOKEN}"}
 BASE_URL = "https://console.runZero.com/api/v1.0"
+# --mode execute stops if this many operations in a row come back 404 before
+# anything succeeds - that's a wrong org or token, not assets already gone
+GONE_ABORT_AFTER = 25
 
 
 def get_source_map_from_api(base_url, headers, console):
@@ -114,26 +124,14 @@ def analyze_assets(assets, source_map):
             parsed_data[asset_id][key] = sources
 
         if hostname_identifiers:
-            # Sort hosts by length to ensure 'TYLER-MAC' is processed before 'TYLER-MAC.local'
+            # Group names by their short, lowercased form so 'TYLER-MAC', 'tyler-mac.local'
+            # and 'TYLER-MAC.corp.example' merge in one pass. Sorting by length first
+            # makes the shortest name the base of each group.
             sorted_hosts = sorted(hostname_identifiers.keys(), key=len)
-            processed_hosts = set()
-
-            for base_host in sorted_hosts:
-                if base_host in processed_hosts:
-                    continue
-
-                processed_hosts.add(base_host)
-                variants = []
+            for base_host, *variants in group_hostnames(sorted_hosts).values():
                 combined_sources = set(hostname_identifiers[base_host])
-
-                # Find other FQDNs that contain this base hostname
-                for other_host in sorted_hosts:
-                    if other_host in processed_hosts:
-                        continue
-                    if base_host in other_host:
-                        variants.append(other_host)
-                        processed_hosts.add(other_host)
-                        combined_sources.update(hostname_identifiers[other_host])
+                for other_host in variants:
+                    combined_sources.update(hostname_identifiers[other_host])
 
                 # Create the new merged display value
                 if variants:
@@ -335,6 +333,225 @@ def run_cleanup_mode(
     console.print("\n[bold green]Cleanup complete![/bold green]")
 
 
+def build_cleanup_plan(assets, assets_with_orphans_map, source_map_reversed):
+    """Turns the orphaned sources into a list of API operations per asset.
+
+    Same decisions as the interactive cleanup: an orphaned 'rumble' source means
+    the whole asset is deleted (nothing else is done to it), a 'custom' source
+    is only removed when the asset has exactly one custom integration, and
+    other sources need a known source ID. Anything that can't be done is kept
+    in the entry's 'skipped' list with the reason.
+    """
+    asset_data_map = {asset["id"]: asset for asset in assets}
+    plan = []
+    for asset_id, orphan_sources in sorted(assets_with_orphans_map.items()):
+        operations = []
+        skipped = []
+        if "rumble" in orphan_sources:
+            operations.append(
+                {"action": "delete_asset", "source": "rumble", "path": f"/org/assets/{asset_id}"}
+            )
+        else:
+            for source_name in sorted(orphan_sources):
+                if source_name == "custom":
+                    custom_ids = asset_data_map.get(asset_id, {}).get("custom_integration_ids", [])
+                    if len(custom_ids) == 1:
+                        operations.append(
+                            {
+                                "action": "remove_custom",
+                                "source": source_name,
+                                "path": f"/org/assets/{asset_id}/custom-integrations/{custom_ids[0]}/remove",
+                            }
+                        )
+                    else:
+                        skipped.append({"source": source_name, "reason": "multiple or zero custom IDs"})
+                    continue
+                source_id = source_map_reversed.get(source_name)
+                if source_id:
+                    operations.append(
+                        {
+                            "action": "remove_source",
+                            "source": source_name,
+                            "path": f"/org/assets/{asset_id}/sources/{source_id}/remove",
+                        }
+                    )
+                else:
+                    skipped.append({"source": source_name, "reason": "no source ID"})
+        for operation in operations:
+            operation["id"] = f"{asset_id}/{operation['action']}/{operation['source']}"
+        plan.append(
+            {
+                "asset_id": asset_id,
+                "orphan_sources": sorted(orphan_sources),
+                "operations": operations,
+                "skipped": skipped,
+            }
+        )
+    return plan
+
+
+def run_plan_mode(assets, assets_with_orphans_map, source_map_reversed, plan_path, console):
+    """Writes the cleanup plan (one JSON line per asset) for review before running --mode execute."""
+    plan = build_cleanup_plan(assets, assets_with_orphans_map, source_map_reversed)
+    with open(plan_path, "w", encoding="utf-8") as f:
+        for entry in plan:
+            f.write(json.dumps(entry) + "\n")
+    operations = sum(len(entry["operations"]) for entry in plan)
+    skipped = sum(len(entry["skipped"]) for entry in plan)
+    console.print(
+        f"\n[green]Wrote a plan for {len(plan)} assets to '{plan_path}':[/green] "
+        f"{operations} operations, {skipped} skipped."
+    )
+    console.print(
+        f"Review it, then run with: [cyan]--mode execute --plan {plan_path}[/cyan]"
+    )
+
+
+def load_journal(journal_path):
+    """Returns the IDs of operations a previous run already completed (done, or already gone)."""
+    done = set()
+    if not os.path.exists(journal_path):
+        return done
+    with open(journal_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # a run killed mid-write can leave a partial last line
+                continue
+            if record.get("status") in ("done", "gone"):
+                done.add(record["id"])
+    return done
+
+
+def execute_operations(client, operations):
+    """Worker: runs one asset's operations in order and returns a result per operation.
+
+    A 404 is recorded as gone rather than done - the source or asset is
+    already gone, usually because a previous run got the change through but
+    died before journaling it. Either way it isn't retried.
+    """
+    results = []
+    for operation in operations:
+        result = {"id": operation["id"], "path": operation["path"]}
+        try:
+            response = client.delete(operation["path"])
+            result["code"] = response.status_code
+            if response.ok:
+                result["status"] = "done"
+            elif response.status_code == 404:
+                result["status"] = "gone"
+            else:
+                result["status"] = "failed"
+                result["error"] = response.text[:200]
+        except requests.exceptions.RequestException as e:
+            result["status"] = "failed"
+            result["error"] = str(e)
+        results.append(result)
+    return results
+
+
+def run_execute_mode(plan_path, workers, rate, console):
+    """Executes a cleanup plan with a worker pool, an adaptive rate limit and a resumable journal.
+
+    Every finished operation is appended to <plan>.journal, and operations the
+    journal already has as done are skipped, so an interrupted run can simply
+    be started again. Each asset's operations run in order on one worker.
+    If the first operations all come back 404 the run stops (see
+    GONE_ABORT_AFTER) - a resumed run only has a few calls in flight that
+    might have gone through before. Those 404s aren't journaled until
+    something else succeeds or fails, so a stopped run leaves nothing marked
+    as gone.
+    """
+    journal_path = plan_path + ".journal"
+    try:
+        with open(plan_path, "r", encoding="utf-8") as f:
+            plan = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        console.print(f"[bold red]Error:[/bold red] Plan file '{plan_path}' not found. Run with --mode plan first.")
+        return
+
+    done = load_journal(journal_path)
+    tasks = []
+    for entry in plan:
+        operations = [op for op in entry["operations"] if op["id"] not in done]
+        if operations:
+            tasks.append(operations)
+    total = sum(len(operations) for operations in tasks)
+    console.print(
+        f"[cyan]Executing {total} operations across {len(tasks)} assets with {workers} workers "
+        f"({len(done)} already done in '{journal_path}')...[/cyan]"
+    )
+    if not tasks:
+        return
+
+    limiter = AdaptiveRateLimiter(rate=rate, max_rate=max(rate, 100.0))
+    client = RunZeroClient(token=RUNZERO_TOKEN, base_url=BASE_URL, pool_size=workers, limiter=limiter)
+    succeeded = 0
+    gone = 0
+    failures = []
+    aborted = False
+    # 404s from the start of the run, journaled once the run is known to be on the right org
+    held = []
+    # calls already in flight when a run was killed can 404 on the rerun
+    abort_after = max(GONE_ABORT_AFTER, 2 * workers)
+    started = time.time()
+    with open(journal_path, "a", encoding="utf-8") as journal, ThreadPoolExecutor(
+        max_workers=workers
+    ) as executor:
+        futures = [executor.submit(execute_operations, client, operations) for operations in tasks]
+        for count, future in enumerate(as_completed(futures), 1):
+            for result in future.result():
+                if result["status"] == "done":
+                    succeeded += 1
+                elif result["status"] == "gone":
+                    gone += 1
+                else:
+                    failures.append(result)
+                if result["status"] == "gone" and not succeeded and not failures:
+                    held.append(result)
+                    continue
+                for record in held + [result]:
+                    journal.write(json.dumps(record) + "\n")
+                held = []
+            journal.flush()
+            if len(held) >= abort_after:
+                aborted = True
+                for pending in futures:
+                    pending.cancel()
+                break
+            if count % 100 == 0:
+                elapsed = time.time() - started
+                console.print(
+                    f"  {succeeded + gone + len(failures)}/{total} operations "
+                    f"({(succeeded + gone + len(failures)) / elapsed:.1f} ops/s, rate limit {limiter.rate:.1f}/s)"
+                )
+        if not aborted:
+            for record in held:
+                journal.write(json.dumps(record) + "\n")
+
+    elapsed = time.time() - started
+    run = succeeded + gone + len(failures)
+    console.print("\n--- [bold]Cleanup Summary[/bold] ---")
+    if aborted:
+        console.print(
+            f"[bold red]Stopped:[/bold red] the first {gone} operations all returned 404. "
+            "Check that RUNZERO_ORG_TOKEN is for the org the plan was made from."
+        )
+    console.print(f"Operations run: [bold]{run}[/bold] in {elapsed:.1f}s "
+                  f"([bold]{run / elapsed if elapsed else 0:.1f}[/bold] ops/s)")
+    console.print(f"Succeeded: [bold green]{succeeded}[/bold green]")
+    console.print(f"Already gone (404), skipped: [bold yellow]{gone}[/bold yellow]")
+    console.print(f"Failed: [bold red]{len(failures)}[/bold red]")
+    for failure in failures[:20]:
+        console.print(f"  [red]{failure['id']}[/red] {failure.get('code', '')} {failure.get('error', '')}")
+    if len(failures) > 20:
+        console.print(f"  ... and {len(failures) - 20} more in '{journal_path}'")
+    if failures:
+        console.print("Run the same command again to retry the failed operations.")
+    STATS.print()
+
+
 def main():
     """Main entry point for the script."""
     parser = argparse.ArgumentParser(
@@ -342,9 +559,27 @@ def main():
     )
     parser.add_argument(
         "--mode",
-        choices=["summary", "cleanup"],
+        choices=["summary", "cleanup", "plan", "execute"],
         default="summary",
-        help="Choose operation mode: 'summary' (default) for a quick overview, or 'cleanup' for the interactive removal workflow.",
+        help="Choose operation mode: 'summary' (default) for a quick overview, 'cleanup' for the interactive removal workflow, "
+        "'plan' to write the removals to a plan file, or 'execute' to run a plan file non-interactively.",
+    )
+    parser.add_argument(
+        "--plan",
+        default="cleanup-plan.jsonl",
+        help="Plan file written by --mode plan and read by --mode execute (default: cleanup-plan.jsonl).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="Concurrent API calls for --mode execute (default: 8).",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=10.0,
+        help="Starting requests per second for --mode execute; it adapts to 429s from the API (default: 10).",
     )
     args = parser.parse_args()
 
@@ -356,6 +591,10 @@ def main():
         )
         return
 
+    if args.mode == "execute":
+        run_execute_mode(args.plan, args.workers, args.rate, console)
+        return
+
     source_map, source_map_reversed = get_source_map_from_api(
         BASE_URL, HEADERS, console
     )
@@ -374,6 +613,10 @@ def main():
         run_cleanup_mode(
             assets, assets_with_orphans_map, parsed_data, source_map_reversed, console
         )
+    elif args.mode == "plan":
+        run_plan_mode(
+            assets, assets_with_orphans_map, source_map_reversed, args.plan, console
+        )
 
 
 if __name__ == "__main__":
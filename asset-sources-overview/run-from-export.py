@@ -1,9 +1,20 @@
+import os
+import sys
 import json
 import csv
+import time
+import heapq
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from rich.console import Console
 from rich.table import Table
 from itertools import groupby
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.export import read_export_chunks
+
 # --- Source ID to Name Mapping ---
 FALLBACK_SOURCE_MAP = {
     "1": "rumble",
@@ -43,14 +54,66 @@ FALLBACK_SOURCE_MAP = {
 }
 
 
-def load_assets_from_file(filename, console):
-    """Loads and parses the JSON asset data from a local file."""
+def aggregate_chunk(chunk, source_map, work_dir):
+    """Worker: parses one chunk of the export (a JSON array, as bytes) and writes its rows, sorted, to a file in work_dir.
+
+    Returns the file, the source names seen and the number of assets, so the
+    parent only ever holds one small partial aggregate per chunk.
+    """
+    assets = json.loads(chunk)
+    parsed_data, sources = parse_and_aggregate(assets, source_map)
+    rows = sorted(
+        (asset_id, identifier_type, value, sorted(row_sources))
+        for asset_id, identifiers in parsed_data.items()
+        for (identifier_type, value), row_sources in identifiers.items()
+    )
+    fd, path = tempfile.mkstemp(suffix=".jsonl", dir=work_dir)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+    return path, sources, len(assets)
+
+
+def load_assets_from_file(filename, source_map, work_dir, console, workers=None, chunk_mb=32):
+    """Parses an export file in chunks across a process pool.
+
+    The file (.json or .jsonl, optionally gzipped) is read incrementally and
+    only a few chunks are in flight at a time, so memory stays bounded no
+    matter how big the export is. Returns (chunk files, sorted source names,
+    asset count), or None if the file can't be read.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunk_files = []
+    all_sources_in_data = set()
+    total_assets = 0
+    started = time.time()
     try:
-        console.print(f"[cyan]Loading assets from '{filename}'...[/cyan]")
-        with open(filename, "r", encoding="utf-8") as f:
-            assets = json.load(f)
-        console.print(f"[green]Successfully loaded {len(assets)} assets.[/green]")
-        return assets
+        console.print(f"[cyan]Loading assets from '{filename}' with {workers} workers...[/cyan]")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+
+            def collect(done):
+                nonlocal total_assets
+                for future in done:
+                    path, sources, count = future.result()
+                    chunk_files.append(path)
+                    all_sources_in_data.update(sources)
+                    total_assets += count
+                elapsed = time.time() - started
+                console.print(
+                    f"  parsed {total_assets} assets ({total_assets / elapsed if elapsed else 0:.0f} assets/s)"
+                )
+
+            for chunk in read_export_chunks(filename, chunk_mb * 1024 * 1024):
+                # keep two chunks per worker queued - enough to stay busy without reading ahead
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(executor.submit(aggregate_chunk, chunk, source_map, work_dir))
+            if pending:
+                collect(wait(pending)[0])
+        console.print(f"[green]Successfully loaded {total_assets} assets.[/green]")
+        return chunk_files, sorted(all_sources_in_data), total_assets
     except FileNotFoundError:
         console.print(f"[bold red]Error:[/bold red] Input file '{filename}' not found.")
         return None
@@ -90,12 +153,13 @@ def parse_and_aggregate(assets, source_map):
     return parsed_data, sorted(list(all_sources_in_data))
 
 
-def prepare_final_rows(parsed_data, sorted_sources):
-    """Prepares the final list of dictionaries for CSV writing and terminal output."""
-    final_rows = []
-    for asset_id, identifiers in parsed_data.items():
-        for identifier_key, sources in identifiers.items():
-            identifier_type, value = identifier_key
+def prepare_final_rows(chunk_files, sorted_sources):
+    """Merges the sorted chunk files into one stream of rows for CSV writing and terminal output."""
+    files = [open(path, "r", encoding="utf-8") for path in chunk_files]
+    try:
+        for asset_id, identifier_type, value, sources in heapq.merge(
+            *[map(json.loads, f) for f in files], key=lambda x: x[:3]
+        ):
             row = {
                 "asset_id": asset_id,
                 "type": identifier_type,
@@ -104,22 +168,21 @@ def prepare_final_rows(parsed_data, sorted_sources):
             }
             for source_name in sorted_sources:
                 row[source_name] = "✅" if source_name in sources else "❌"
-            final_rows.append(row)
-    final_rows.sort(key=lambda x: (x["asset_id"], x["type"], x["value"]))
-    return final_rows
+            yield row
+    finally:
+        for f in files:
+            f.close()
 
 
 def display_and_summarize(final_rows, sorted_sources, fieldnames, console):
     """Displays tables for ALL assets and prints the final summary."""
     assets_with_orphans_map = {}
-    rows_by_asset = {
-        asset_id: list(group)
-        for asset_id, group in groupby(final_rows, key=lambda x: x["asset_id"])
-    }
 
     console.print("\n--- [bold]Asset Details[/bold] ---")
     # --- KEY CHANGE IS HERE: Loop through all assets ---
-    for asset_id, rows_for_this_asset in rows_by_asset.items():
+    # rows arrive sorted by asset, so one asset's rows are held at a time
+    for asset_id, group in groupby(final_rows, key=lambda x: x["asset_id"]):
+        rows_for_this_asset = list(group)
         source_to_counts = {source: [] for source in sorted_sources}
         for row in rows_for_this_asset:
             for source_name in sorted_sources:
@@ -199,20 +262,53 @@ def write_csv_report(final_rows, fieldnames, output_filename, console):
 
 def main():
     """Main function to run the asset analysis and reporting script."""
+    parser = argparse.ArgumentParser(
+        description="Find orphaned sources in a runZero asset export."
+    )
+    parser.add_argument(
+        "--file",
+        default="assets.json",
+        help="asset export to read - .json or .jsonl, optionally gzipped (default: assets.json)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="worker processes to parse with (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--chunk-mb",
+        type=int,
+        default=32,
+        help="MB of export text handed to a worker at a time (default: 32)",
+    )
+    args = parser.parse_args()
 
     console = Console()
 
-    assets = load_assets_from_file("assets.json", console)
-    if not assets:
-        return
-
-    parsed_data, sorted_sources = parse_and_aggregate(assets, FALLBACK_SOURCE_MAP)
-    final_rows = prepare_final_rows(parsed_data, sorted_sources)
+    work_dir = tempfile.mkdtemp(prefix="asset-sources-")
+    try:
+        loaded = load_assets_from_file(
+            args.file, FALLBACK_SOURCE_MAP, work_dir, console, args.workers, args.chunk_mb
+        )
+        if not loaded or not loaded[2]:
+            return
+        chunk_files, sorted_sources, _ = loaded
 
-    fieldnames = ["asset_id", "type", "value", "source_count"] + sorted_sources
+        fieldnames = ["asset_id", "type", "value", "source_count"] + sorted_sources
 
-    display_and_summarize(final_rows, sorted_sources, fieldnames, console)
-    write_csv_report(final_rows, fieldnames, "asset-source-report.csv", console)
+        # the merged rows are streamed from the chunk files once per output
+        display_and_summarize(
+            prepare_final_rows(chunk_files, sorted_sources), sorted_sources, fieldnames, console
+        )
+        write_csv_report(
+            prepare_final_rows(chunk_files, sorted_sources),
+            fieldnames,
+            "asset-source-report.csv",
+            console,
+        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
 
 if __name__ == "__main__":
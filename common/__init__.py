@@ -0,0 +1,7 @@
+# shared helpers for the scripts in this repo
+#
+# scripts live in their own folders, so they add the repo root to sys.path
+# before importing from here:
+#
+#   sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+#   from common.export import stream_assets
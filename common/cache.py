@@ -0,0 +1,383 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+
+from common.export import stream_export, BASE_URL
+
+# SET TO OPT A SCRIPT INTO THE SHARED CACHE - e.g. RUNZERO_CACHE_PATH=~/.runzero/cache.db
+CACHE_PATH = os.environ.get("RUNZERO_CACHE_PATH")
+# how long a cached export stays fresh, in seconds
+CACHE_TTL = int(os.environ.get("RUNZERO_CACHE_TTL", 6 * 60 * 60))
+
+# rows per executemany call while loading an export
+BATCH_SIZE = 1000
+
+# column kinds - values are stored natively except json, which is list/dict encoded as text
+INTEGER = "INTEGER"
+REAL = "REAL"
+TEXT = "TEXT"
+BOOLEAN = "BOOLEAN"
+JSON = "JSON"
+
+SQL_TYPES = {INTEGER: "INTEGER", REAL: "REAL", TEXT: "TEXT", BOOLEAN: "INTEGER", JSON: "TEXT"}
+
+
+def column_kind(value):
+    if isinstance(value, bool):
+        return BOOLEAN
+    if isinstance(value, int):
+        return INTEGER
+    if isinstance(value, float):
+        return REAL
+    if isinstance(value, (list, dict)):
+        return JSON
+    return TEXT
+
+
+def encode(value, kind: str):
+    if value is None:
+        return None
+    if kind == JSON or isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return value
+
+
+def decode(value, kind: str):
+    if value is None:
+        return None
+    if kind == JSON:
+        return json.loads(value)
+    if kind == BOOLEAN:
+        return bool(value)
+    return value
+
+
+def quote(name: str):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class InventoryCache:
+    """On-disk cache of export results shared by the report scripts.
+
+    Every distinct (org, export type, search, fields) combination is a dataset
+    stored in its own table, with one typed column per exported field. Lists
+    and dicts are kept as JSON text and decoded on the way out, so records read
+    from the cache look exactly like records from the export API.
+    """
+
+    def __init__(self, path: str, ttl: int = CACHE_TTL):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        parent = os.path.dirname(self.path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        # autocommit mode so transactions are explicit - the sqlite3 module
+        # doesn't include DDL in its implicit ones, which would break the swap
+        self.db = sqlite3.connect(self.path, isolation_level=None, timeout=300)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS datasets (
+                key TEXT PRIMARY KEY,
+                org_id TEXT NOT NULL,
+                export_type TEXT NOT NULL,
+                search TEXT,
+                fields TEXT,
+                table_name TEXT NOT NULL,
+                columns TEXT NOT NULL,
+                row_count INTEGER NOT NULL,
+                fetched_at REAL NOT NULL
+            )"""
+        )
+        # small JSON values like id -> name maps, see lookup()
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS lookups (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )"""
+        )
+
+    @staticmethod
+    def dataset_key(org_id: str, export_type: str, search: str = None, fields: str = None):
+        raw = json.dumps([org_id, export_type, search or "", fields or ""])
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def dataset(self, key: str):
+        row = self.db.execute(
+            "SELECT table_name, columns, row_count, fetched_at FROM datasets WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if not row:
+            return None
+        return {
+            "table_name": row[0],
+            "columns": json.loads(row[1]),
+            "row_count": row[2],
+            "fetched_at": row[3],
+        }
+
+    def is_fresh(self, key: str):
+        dataset = self.dataset(key)
+        return bool(dataset) and time.time() - dataset["fetched_at"] < self.ttl
+
+    def load(self, key: str, org_id: str, export_type: str, search: str, fields: str, records):
+        """Loads records into a new table and swaps it in for the old one in a single transaction.
+
+        Records are spooled to a temp file first so the (slow) download happens
+        without holding the database write lock - other threads and processes
+        can keep loading and reading in the meantime. If the download fails the
+        previous copy of the dataset is untouched.
+        """
+        with tempfile.TemporaryFile() as spool:
+            for record in records:
+                spool.write(json.dumps(record).encode("utf-8") + b"\n")
+            spool.seek(0)
+            return self._insert(
+                key, org_id, export_type, search, fields, (json.loads(line) for line in spool)
+            )
+
+    def _insert(self, key, org_id, export_type, search, fields, records):
+        table_name = f"data_{key[:16]}"
+        tmp_name = f"{table_name}_loading"
+        columns = {}
+
+        def flush(batch):
+            if not batch:
+                return
+            names = list(columns)
+            sql = "INSERT INTO {} ({}) VALUES ({})".format(
+                tmp_name, ",".join(quote(n) for n in names), ",".join("?" for _ in names)
+            )
+            self.db.executemany(
+                sql, [[encode(r.get(n), columns[n]) for n in names] for r in batch]
+            )
+
+        batch = []
+        count = 0
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.execute(f"DROP TABLE IF EXISTS {tmp_name}")
+            self.db.execute(f"CREATE TABLE {tmp_name} (_row INTEGER PRIMARY KEY)")
+            for record in records:
+                for name, value in record.items():
+                    if name not in columns:
+                        # new field - write out what we have so far so the insert
+                        # statement always matches the table
+                        flush(batch)
+                        batch = []
+                        kind = None if value is None else column_kind(value)
+                        columns[name] = kind
+                        # a field that is null so far gets an untyped column, which
+                        # stores whatever values turn up later as they are
+                        sql_type = SQL_TYPES[kind] if kind else ""
+                        self.db.execute(
+                            f"ALTER TABLE {tmp_name} ADD COLUMN {quote(name)} {sql_type}"
+                        )
+                    elif columns[name] is None and value is not None:
+                        columns[name] = column_kind(value)
+                batch.append(record)
+                count += 1
+                if len(batch) >= BATCH_SIZE:
+                    flush(batch)
+                    batch = []
+            flush(batch)
+
+            self.db.execute(f"DROP TABLE IF EXISTS {table_name}")
+            self.db.execute(f"ALTER TABLE {tmp_name} RENAME TO {table_name}")
+            if "id" in columns:
+                self.db.execute(
+                    f"CREATE INDEX IF NOT EXISTS {table_name}_id ON {table_name} (id)"
+                )
+            self.db.execute(
+                "INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    org_id,
+                    export_type,
+                    search,
+                    fields,
+                    table_name,
+                    json.dumps(columns),
+                    count,
+                    time.time(),
+                ),
+            )
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+        return count
+
+    def get(
+        self,
+        org_id: str,
+        token: str,
+        export_type: str = "assets",
+        search: str = None,
+        fields: str = None,
+        refresh: bool = False,
+        base_url: str = BASE_URL,
+        session=None,
+    ):
+        """Yields the records for an export, downloading it first if it is missing or stale."""
+        key = self.dataset_key(org_id, export_type, search, fields)
+        if refresh or not self.is_fresh(key):
+            records = stream_export(
+                token,
+                export_type,
+                search=search,
+                fields=fields,
+                base_url=base_url,
+                session=session,
+            )
+            self.load(key, org_id, export_type, search, fields, records)
+        return self.query(org_id, export_type, search=search, fields=fields)
+
+    def _select(self, org_id, export_type, search, fields, what, where, params):
+        key = self.dataset_key(org_id, export_type, search, fields)
+        dataset = self.dataset(key)
+        if not dataset:
+            raise KeyError(
+                f"nothing cached for {org_id} {export_type} search={search!r} fields={fields!r}"
+            )
+        sql = f"SELECT {what} FROM {dataset['table_name']}"
+        if where:
+            sql += f" WHERE {where}"
+        return dataset, self.db.execute(sql, params)
+
+    def query(
+        self,
+        org_id: str,
+        export_type: str = "assets",
+        search: str = None,
+        fields: str = None,
+        where: str = None,
+        params: tuple = (),
+        columns: list = None,
+    ):
+        """Yields cached records, optionally filtered with a SQL where clause over the typed columns.
+
+        cache.query(org_id, "assets", search="alive:t", where="risk_rank >= ?", params=(3,))
+        """
+        key = self.dataset_key(org_id, export_type, search, fields)
+        dataset = self.dataset(key)
+        kinds = dataset["columns"] if dataset else {}
+        names = [c for c in (columns or kinds) if c in kinds]
+        what = ",".join(quote(n) for n in names) or "_row"
+        _, cursor = self._select(org_id, export_type, search, fields, what, where, params)
+        for row in cursor:
+            record = {}
+            for name, value in zip(names, row):
+                record[name] = decode(value, kinds[name])
+            yield record
+
+    def count(
+        self,
+        org_id: str,
+        export_type: str = "assets",
+        search: str = None,
+        fields: str = None,
+        where: str = None,
+        params: tuple = (),
+    ):
+        _, cursor = self._select(
+            org_id, export_type, search, fields, "COUNT(*)", where, params
+        )
+        return cursor.fetchone()[0]
+
+    def lookup(self, key: str, fetch, ttl: int = None, refresh: bool = False):
+        """Returns a small JSON value (like a site id -> name map) cached under key.
+
+        fetch() is called when the value is missing, older than ttl (the
+        cache's TTL by default) or refresh is set. If fetch returns None, e.g.
+        because the token can't read that endpoint, nothing is cached.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        if not refresh:
+            row = self.db.execute(
+                "SELECT value, fetched_at FROM lookups WHERE key = ?", (key,)
+            ).fetchone()
+            if row and time.time() - row[1] < ttl:
+                return json.loads(row[0])
+        value = fetch()
+        if value is not None:
+            self.db.execute(
+                "INSERT OR REPLACE INTO lookups VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time()),
+            )
+        return value
+
+    def invalidate(self, org_id: str = None):
+        """Drops every cached dataset, or only the ones for a single org."""
+        sql = "SELECT key, table_name FROM datasets"
+        params = ()
+        if org_id:
+            sql += " WHERE org_id = ?"
+            params = (org_id,)
+        self.db.execute("BEGIN IMMEDIATE")
+        for key, table_name in self.db.execute(sql, params).fetchall():
+            self.db.execute(f"DROP TABLE IF EXISTS {table_name}")
+            self.db.execute("DELETE FROM datasets WHERE key = ?", (key,))
+        if not org_id:
+            self.db.execute("DELETE FROM lookups")
+        self.db.execute("COMMIT")
+
+    def close(self):
+        self.db.close()
+
+
+# sqlite connections can't be shared between threads, so each thread gets its own
+_THREAD_LOCAL = threading.local()
+
+
+def get_cache():
+    if not hasattr(_THREAD_LOCAL, "cache"):
+        _THREAD_LOCAL.cache = InventoryCache(CACHE_PATH)
+    return _THREAD_LOCAL.cache
+
+
+def cached_export(
+    org_id: str,
+    token: str,
+    export_type: str = "assets",
+    search: str = None,
+    fields: str = None,
+    base_url: str = BASE_URL,
+    session=None,
+):
+    """Streams an export, reading it from the shared cache when RUNZERO_CACHE_PATH is set.
+
+    org_id can be None for scripts that only have an export token; the token is
+    hashed into the cache key instead so it never ends up on disk.
+    """
+    if not CACHE_PATH:
+        return stream_export(
+            token, export_type, search=search, fields=fields, base_url=base_url, session=session
+        )
+    if not org_id:
+        org_id = "token-" + hashlib.sha1(token.encode()).hexdigest()[:12]
+    return get_cache().get(
+        org_id,
+        token,
+        export_type,
+        search=search,
+        fields=fields,
+        base_url=base_url,
+        session=session,
+    )
+
+
+def cached_lookup(key: str, token: str, fetch, refresh: bool = False):
+    """Calls fetch(), or reads its result from the shared cache when RUNZERO_CACHE_PATH is set.
+
+    For the id -> name maps scripts build from /org/sites, /org/explorers and
+    the like. The token is hashed into the key, so two orgs never share a map.
+    """
+    if not CACHE_PATH:
+        return fetch()
+    key = f"{key}-{hashlib.sha1(token.encode()).hexdigest()[:12]}"
+    return get_cache().lookup(key, fetch, refresh=refresh)
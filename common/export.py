@@ -0,0 +1,306 @@
+import gzip
+import json
+import requests
+
+from common.http import BASE_URL, get_client
+
+
+def stream_export(
+    token: str,
+    export_type: str = "assets",
+    search: str = None,
+    fields: str = None,
+    base_url: str = BASE_URL,
+    session: requests.Session = None,
+):
+    """Streams the JSONL variant of an org export endpoint, yielding one record at a time.
+
+    The .json exports return one big array, so calling .json() on them holds the
+    whole inventory in memory before any work can start. The .jsonl exports
+    return one record per line, which lets us parse them as the bytes arrive.
+    The request itself is made up front so HTTP errors are raised here rather
+    than on the first iteration.
+
+    :param token: a string, export (or org) API token for the organization.
+    :param export_type: a string, assets, services, wireless, software or vulnerabilities.
+    :param search: a string, runZero search to filter on (None returns everything).
+    :param fields: a string or list, fields to return (None returns all fields).
+    :param base_url: a string, API base URL including /api/v1.0.
+    :param session: a RunZeroClient or requests.Session (defaults to the shared retrying client).
+    :raises: requests.exceptions.HTTPError: if the export returns a non-200.
+    """
+    return iter_jsonl(open_export(token, export_type, search, fields, base_url, session))
+
+
+def stream_export_raw(
+    token: str,
+    export_type: str = "assets",
+    search: str = None,
+    fields: str = None,
+    base_url: str = BASE_URL,
+    session: requests.Session = None,
+    chunk_size: int = 1024 * 1024,
+):
+    """Same as stream_export, but yields the raw (already transfer-decoded) JSONL bytes in chunks.
+
+    Use this when the records only need to land on disk - nothing is parsed.
+    """
+    response = open_export(token, export_type, search, fields, base_url, session)
+
+    def chunks():
+        with response:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    yield chunk
+
+    return chunks()
+
+
+def open_export(token, export_type, search, fields, base_url, session):
+    url = f"{base_url}/export/org/{export_type}.jsonl"
+    # ask for gzip on the wire - requests decodes it transparently as we read
+    headers = {"Authorization": f"Bearer {token}", "Accept-Encoding": "gzip"}
+    params = {}
+    if search:
+        params["search"] = search
+    if fields:
+        params["fields"] = fields if isinstance(fields, str) else ",".join(fields)
+
+    http = session or get_client()
+    response = http.get(url, headers=headers, params=params, stream=True)
+    if not response.ok:
+        # read the (small) error body so callers can still log response.text
+        response.content
+        response.raise_for_status()
+    return response
+
+
+def iter_jsonl(response: requests.Response):
+    """Yields one parsed record per non-empty line of a streamed response."""
+    with response:
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
+
+
+def stream_assets(token: str, search: str = None, fields: str = None, **kwargs):
+    """Yields assets from /export/org/assets.jsonl."""
+    return stream_export(token, "assets", search=search, fields=fields, **kwargs)
+
+
+def stream_services(token: str, search: str = None, fields: str = None, **kwargs):
+    """Yields services from /export/org/services.jsonl."""
+    return stream_export(token, "services", search=search, fields=fields, **kwargs)
+
+
+def stream_vulnerabilities(token: str, search: str = None, fields: str = None, **kwargs):
+    """Yields vulnerabilities from /export/org/vulnerabilities.jsonl."""
+    return stream_export(
+        token, "vulnerabilities", search=search, fields=fields, **kwargs
+    )
+
+
+def count_export(token: str, export_type: str = "assets", search: str = None, **kwargs):
+    """Counts the records matching a search without keeping any of them around."""
+    return sum(
+        1 for _ in stream_export(token, export_type, search=search, fields="id", **kwargs)
+    )
+
+
+def write_json_array(records, f):
+    """Writes an iterable of records to a binary file as a JSON array, one record at a time.
+
+    This keeps the on-disk format of the old .json exports without building the
+    whole list first. Returns the number of records written.
+    """
+    count = 0
+    f.write(b"[")
+    for record in records:
+        f.write(b",\n" if count else b"\n")
+        f.write(json.dumps(record).encode("utf-8"))
+        count += 1
+    f.write(b"\n]\n" if count else b"]\n")
+    return count
+
+
+def write_jsonl_chunks(chunks, f):
+    """Copies raw JSONL chunks to a binary file and returns the number of records."""
+    count = 0
+    last = b"\n"
+    for chunk in chunks:
+        f.write(chunk)
+        count += chunk.count(b"\n")
+        last = chunk[-1:]
+    if last != b"\n":
+        # last record had no trailing newline
+        count += 1
+    return count
+
+
+def read_export_file(path: str, skip: int = 0, chunk_size: int = 1024 * 1024):
+    """Yields the records in a saved export one at a time.
+
+    Handles both the .json exports (one big array, parsed incrementally rather
+    than with json.load) and .jsonl exports, either of them optionally gzipped.
+    The first skip records are passed over - JSONL lines are skipped without
+    being parsed, which makes resuming a large file cheap.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        buf = f.read(chunk_size)
+        pos = len(buf) - len(buf.lstrip())
+        count = 0
+        if buf[pos:pos + 1] != "[":
+            for line in _prepend(buf, f):
+                if not line.strip():
+                    continue
+                if count >= skip:
+                    yield json.loads(line)
+                count += 1
+            return
+
+        decoder = json.JSONDecoder()
+        pos += 1
+        eof = False
+        while True:
+            # keep at least half a chunk buffered so most records parse in one go
+            if not eof and len(buf) - pos < chunk_size // 2:
+                more = f.read(chunk_size)
+                eof = not more
+                buf = buf[pos:] + more
+                pos = 0
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buf):
+                if eof:
+                    return
+                # only whitespace buffered - read more rather than stopping early
+                more = f.read(chunk_size)
+                eof = not more
+                buf = more
+                pos = 0
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                record, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # record is bigger than what's buffered - read more and try again
+                more = f.read(chunk_size)
+                eof = not more
+                buf = buf[pos:] + more
+                pos = 0
+                continue
+            if count >= skip:
+                yield record
+            count += 1
+
+
+def read_export_chunks(path: str, chunk_bytes: int = 32 * 1024 * 1024):
+    """Yields the records of a saved export as JSON array bytes, about chunk_bytes at a time.
+
+    Meant for handing chunks to worker processes, which parse each one with
+    a single json.loads. Nothing is decoded on the reading side: JSONL lines
+    are joined as read, and a .json array is cut after the last complete
+    record in each block (see _array_cut), so every record is only parsed
+    once, by a worker.
+
+    :raises: json.JSONDecodeError: if a .json export doesn't end with its closing bracket.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        head = f.read(1024 * 1024)
+        pos = len(head) - len(head.lstrip())
+        if head[pos:pos + 1] != b"[":
+            chunk = []
+            size = 0
+            for line in _prepend(head, f):
+                if not line.strip():
+                    continue
+                chunk.append(line)
+                size += len(line)
+                if size >= chunk_bytes:
+                    yield b"[" + b",".join(chunk) + b"]"
+                    chunk = []
+                    size = 0
+            if chunk:
+                yield b"[" + b",".join(chunk) + b"]"
+            return
+
+        # carry always starts between two records of the array
+        carry = head[pos + 1:]
+        eof = False
+        while not eof:
+            more = f.read(chunk_bytes)
+            eof = not more
+            block = carry + more
+            cut = _array_cut(block)
+            if not cut and not eof:
+                # a record bigger than the block - read more of it
+                carry = block
+                continue
+            records = block[:cut].lstrip(b" \t\r\n,")
+            if records:
+                yield b"[" + records + b"]"
+            carry = block[cut:]
+        if carry.strip() != b"]":
+            raise json.JSONDecodeError("Expecting ',' delimiter or ']'", carry.decode("utf-8", "replace"), 0)
+
+
+# every byte except a quote or a bracket, for bytes.translate to drop
+_NOT_STRUCTURE = bytes(c for c in range(256) if c not in b'"{}[]')
+
+
+def _array_cut(block: bytes, tail: int = 64 * 1024):
+    """Returns the index just past the last complete record in a run of JSON array bytes, or 0.
+
+    block has to start between records (outside any string, at the array's
+    top level). Only the last tail bytes are walked in Python - the state at
+    the start of them comes from _depth and a count of the quotes before it,
+    both of which run in C. If no record ends in the tail, the tail is doubled.
+    """
+    # blank out escapes so every quote left opens or closes a string
+    neutral = block.replace(b"\\\\", b"  ").replace(b'\\"', b"  ")
+    start = max(0, len(neutral) - tail)
+    while True:
+        depth = _depth(neutral[:start])
+        inside = neutral.count(b'"', 0, start) % 2 == 1
+        cut = 0
+        for index in range(start, len(neutral)):
+            char = neutral[index]
+            if char == 0x22:
+                inside = not inside
+            elif inside:
+                continue
+            elif char == 0x7b or char == 0x5b:
+                depth += 1
+            elif char == 0x7d or char == 0x5d:
+                depth -= 1
+                if depth == 0:
+                    cut = index + 1
+        if cut or not start:
+            return cut
+        start = max(0, 2 * start - len(neutral))
+
+
+def _depth(neutral: bytes):
+    """Returns how many brackets are still open at the end of neutral (escapes already blanked).
+
+    Dropping everything but quotes and brackets, then every pair of adjacent
+    quotes (strings without brackets in them), leaves only a few quotes, so
+    splitting on them to skip the strings is cheap.
+    """
+    compact = neutral.translate(None, _NOT_STRUCTURE).replace(b'""', b"")
+    outside = b"".join(compact.split(b'"')[::2])
+    return outside.count(b"{") + outside.count(b"[") - outside.count(b"}") - outside.count(b"]")
+
+
+def _prepend(head, f):
+    """Yields the lines of f as if head (already read from it) was still at the front."""
+    lines = head.splitlines(keepends=True)
+    if lines and lines[-1][-1:] not in ("\n", b"\n"):
+        lines[-1] += f.readline()
+    yield from lines
+    yield from f
@@ -0,0 +1,141 @@
+import io
+import os
+import glob
+import gzip
+import hashlib
+from contextlib import contextmanager
+
+# file suffix for each supported compression
+COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+# leading bytes of each compressed format - files are sniffed rather than trusted by name
+COMPRESSION_MAGIC = {"gzip": b"\x1f\x8b", "zstd": b"\x28\xb5\x2f\xfd"}
+
+
+@contextmanager
+def atomic_open(path: str, mode: str = "w", **kwargs):
+    """Opens a temp file next to path and renames it over path when the block succeeds.
+
+    If the block raises, the temp file is removed and path is left untouched, so
+    a crash can never leave a truncated file behind.
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    f = open(tmp_path, mode, **kwargs)
+    try:
+        yield f
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        f.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class HashingWriter:
+    """Wraps a binary file so text written through it is counted and sha256'd on the way out."""
+
+    def __init__(self, f, encoding: str = "utf-8"):
+        self.f = f
+        self.encoding = encoding
+        self.sha256 = hashlib.sha256()
+        self.bytes = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode(self.encoding)
+        self.f.write(data)
+        self.sha256.update(data)
+        self.bytes += len(data)
+        return len(data)
+
+    def flush(self):
+        self.f.flush()
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+
+@contextmanager
+def compressed_writer(f, compression: str = "none"):
+    """Wraps a binary file so everything written is compressed with gzip or zstd on the way to disk.
+
+    zstd needs the optional zstandard package (pip install zstandard).
+    """
+    if not compression or compression == "none":
+        yield f
+    elif compression == "gzip":
+        with gzip.GzipFile(fileobj=f, mode="wb", compresslevel=6) as gz:
+            yield gz
+    elif compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError(
+                "zstd compression needs the zstandard package - pip install zstandard"
+            )
+        with zstandard.ZstdCompressor().stream_writer(f, closefd=False) as zf:
+            yield zf
+    else:
+        raise ValueError(f"unsupported compression {compression}")
+
+
+def detect_compression(path: str):
+    """Returns "gzip", "zstd" or "none" based on the first bytes of a file."""
+    with open(path, "rb") as f:
+        head = f.read(4)
+    for compression, magic in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return compression
+    return "none"
+
+
+def open_compressed(path: str):
+    """Opens a file for reading bytes, decompressing gzip or zstd on the fly.
+
+    The result is line iterable like a plain binary file, so .gz/.zst task
+    data and exports can be streamed without decompressing them to disk
+    first. zstd needs the optional zstandard package (pip install zstandard).
+    """
+    compression = detect_compression(path)
+    if compression == "gzip":
+        return gzip.open(path, "rb")
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError(
+                "zstd compression needs the zstandard package - pip install zstandard"
+            )
+        raw = zstandard.ZstdDecompressor().stream_reader(
+            open(path, "rb"), read_across_frames=True, closefd=True
+        )
+        return io.BufferedReader(raw, buffer_size=1024 * 1024)
+    return open(path, "rb")
+
+
+def expand_paths(patterns: list, extensions: tuple = None):
+    """Expands file names, glob patterns and directories into a sorted list of files.
+
+    Directories contribute the files directly inside them, skipping hidden
+    files like .DS_Store and, when extensions is given, any file that doesn't
+    end in one of them (so a script's own CSVs aren't picked up on the next
+    run). A path that is listed twice is only returned once.
+    """
+    paths = set()
+    for pattern in patterns:
+        matches = glob.glob(pattern) if glob.has_magic(pattern) else [pattern]
+        for match in matches:
+            if os.path.isdir(match):
+                for name in os.listdir(match):
+                    full = os.path.join(match, name)
+                    if name.startswith(".") or not os.path.isfile(full):
+                        continue
+                    if extensions is None or name.lower().endswith(extensions):
+                        paths.add(os.path.normpath(full))
+            elif os.path.isfile(match):
+                paths.add(os.path.normpath(match))
+    return sorted(paths)
@@ -0,0 +1,165 @@
+import ipaddress
+
+import numpy as np
+
+
+def normalize_hostname(name: str):
+    """Lowercases a hostname and drops its domain, or returns None for an empty name.
+
+    TYLER-MAC, tyler-mac.local and TYLER-MAC.corp.example all come back as
+    tyler-mac. NetBIOS style DOMAIN\\host names lose the domain, and names that
+    are really IP addresses are returned whole.
+    """
+    name = (name or "").strip().strip(".").lower()
+    if "\\" in name:
+        name = name.rsplit("\\", 1)[1]
+    if not name:
+        return None
+    if ":" in name or name[0].isdigit():
+        try:
+            ipaddress.ip_address(name)
+            return name
+        except ValueError:
+            pass
+    return name.split(".", 1)[0] or None
+
+
+def group_hostnames(names):
+    """Groups hostnames by their normalized form - {normalized: [names]} in first-seen order."""
+    groups = {}
+    for name in names:
+        key = normalize_hostname(name)
+        if key is not None:
+            groups.setdefault(key, []).append(name)
+    return groups
+
+
+def hostname_ngrams(name: str, n: int = 3):
+    """Returns the set of character n-grams of a name, with ^ and $ marking its ends."""
+    padded = f"^{name}$"
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+def jaccard(a: set, b: set):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def ngram_codes(names: list, n: int = 3):
+    """Returns (codes, offsets) - every byte n-gram of every ^name$ packed into a uint64, flat.
+
+    The grams of names[i] are codes[offsets[i]:offsets[i + 1]]. Packing n bytes
+    into an int is exact, so no hashing is needed to tell grams apart, and it
+    is done with array shifts over all the names at once.
+    """
+    if not 1 <= n <= 8:
+        raise ValueError(f"n must be between 1 and 8, got {n}")
+    encoded = [f"^{name}$".encode("utf-8") for name in names]
+    lengths = np.fromiter(map(len, encoded), dtype=np.intp, count=len(encoded))
+    ends = np.cumsum(lengths)
+    counts = np.maximum(lengths - n + 1, 1)
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.intp)
+    data = np.frombuffer(b"".join(encoded) + bytes(n), dtype=np.uint8).astype(np.uint64)
+    # start position of every gram, and the end of the name it belongs to
+    positions = np.arange(counts.sum(), dtype=np.intp) + np.repeat(ends - lengths - offsets, counts)
+    limits = np.repeat(ends, counts)
+    codes = np.zeros(len(positions), dtype=np.uint64)
+    for k in range(n):
+        # names shorter than n only get one (zero padded) gram
+        byte = np.where(positions + k < limits, data[positions + k], np.uint64(0))
+        codes |= byte << np.uint64(8 * (n - 1 - k))
+    return codes, offsets
+
+
+def minhash_signatures(names: list, n: int = 3, num_perm: int = 64, seed: int = 1):
+    """Returns a (len(names), num_perm) uint32 array of MinHash signatures over byte n-grams.
+
+    Each permutation is a multiply-shift hash, one vectorized pass over the
+    grams of every name with np.minimum.reduceat picking out the minimum per
+    name, so the cost is O(total grams * num_perm) in NumPy rather than Python.
+    """
+    signatures = np.empty((len(names), num_perm), dtype=np.uint32)
+    if not len(names):
+        return signatures
+    codes, offsets = ngram_codes(names, n)
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+    for i in range(num_perm):
+        # uint64 arithmetic wraps, and the top 32 bits are the hash
+        hashed = (codes * a[i] + b[i]) >> np.uint64(32)
+        signatures[:, i] = np.minimum.reduceat(hashed, offsets)
+    return signatures
+
+
+def candidate_pairs(signatures, bands: int = 16, max_bucket: int = 1000):
+    """Yields (i, j) row pairs whose signatures are identical in at least one band (LSH blocking).
+
+    Each band's rows are folded into one uint64 key and sorted, so equal keys
+    sit next to each other and only the buckets with two or more rows are
+    expanded into pairs. Buckets bigger than max_bucket (names too generic to
+    be useful) are skipped. A pair that shares several bands is yielded once.
+    """
+    count, num_perm = signatures.shape
+    if num_perm % bands:
+        raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+    rows = num_perm // bands
+    # odd multipliers to fold a band's minhashes into one key - a collision only
+    # adds a candidate, which the similarity check then throws out
+    multipliers = np.random.default_rng(0).integers(1, 1 << 63, size=rows, dtype=np.uint64) | np.uint64(1)
+    seen = set()
+    for band in range(bands):
+        chunk = signatures[:, band * rows:(band + 1) * rows].astype(np.uint64)
+        keys = (chunk * multipliers).sum(axis=1, dtype=np.uint64)
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        sizes = np.diff(np.append(starts, count))
+        for start, size in zip(starts[sizes > 1].tolist(), sizes[sizes > 1].tolist()):
+            if size > max_bucket:
+                continue
+            members = sorted(order[start:start + size].tolist())
+            for x in range(size):
+                for y in range(x + 1, size):
+                    pair = (members[x], members[y])
+                    if pair not in seen:
+                        seen.add(pair)
+                        yield pair
+
+
+def similar_hostnames(
+    names,
+    threshold: float = 0.5,
+    n: int = 3,
+    num_perm: int = 64,
+    bands: int = 16,
+    max_bucket: int = 1000,
+):
+    """Finds pairs of distinct normalized hostnames that are near duplicates.
+
+    Names are normalized and deduplicated first (so TYLER-MAC and
+    tyler-mac.local are already the same name), then MinHash LSH over
+    character n-grams proposes candidate pairs in roughly linear time, and
+    each candidate is kept only if its n-gram Jaccard similarity is at least
+    threshold. With the default 16 bands of 4 rows, pairs above about 0.5
+    similarity are very likely to be proposed.
+
+        similar_hostnames(["TYLER-MAC", "tylers-mac.local", "printer-3"])
+        # [("tyler-mac", "tylers-mac", 0.58)]
+
+    Returns [(name_a, name_b, similarity)] sorted by name.
+    """
+    unique = sorted({key for key in map(normalize_hostname, names) if key is not None})
+    signatures = minhash_signatures(unique, n=n, num_perm=num_perm)
+    grams = {}
+    pairs = []
+    for i, j in candidate_pairs(signatures, bands=bands, max_bucket=max_bucket):
+        for k in (i, j):
+            if k not in grams:
+                grams[k] = hostname_ngrams(unique[k], n)
+        similarity = jaccard(grams[i], grams[j])
+        if similarity >= threshold:
+            pairs.append((unique[i], unique[j], round(similarity, 2)))
+    pairs.sort()
+    return pairs
@@ -0,0 +1,350 @@
+import re
+import time
+import random
+import threading
+from enum import Enum
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# UPDATE IF SELF HOSTED
+BASE_URL = "https://console.runZero.com/api/v1.0"
+
+# statuses worth another try - 429 is always safe to retry because the request was never processed
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+# query parameters for list endpoints that page - endpoints that don't page
+# ignore them and return everything, which iter_pages notices and stops
+PAGE_PARAM = "page"
+PAGE_SIZE_PARAM = "page_size"
+
+# ids in paths are collapsed so /org/sites/<uuid> shows up as one endpoint in the stats
+ID_PATTERN = re.compile(
+    r"/(?:[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|[0-9a-fA-F]{16,}|\d+)(?=/|$)"
+)
+
+
+class HTTPMethod(Enum):
+    GET = "GET"
+    POST = "POST"
+    PUT = "PUT"
+    DELETE = "DELETE"
+    PATCH = "PATCH"
+
+
+class LatencyStats:
+    """Thread safe per-endpoint request counters."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, endpoint: str, seconds: float, status: int = None, retried: bool = False):
+        with self.lock:
+            e = self.endpoints.setdefault(
+                endpoint,
+                {"count": 0, "errors": 0, "retries": 0, "total_seconds": 0.0, "max_seconds": 0.0},
+            )
+            e["count"] += 1
+            e["total_seconds"] += seconds
+            e["max_seconds"] = max(e["max_seconds"], seconds)
+            if status is None or status >= 400:
+                e["errors"] += 1
+            if retried:
+                e["retries"] += 1
+
+    def rows(self):
+        with self.lock:
+            rows = []
+            for endpoint, e in self.endpoints.items():
+                rows.append(
+                    {
+                        "endpoint": endpoint,
+                        "count": e["count"],
+                        "errors": e["errors"],
+                        "retries": e["retries"],
+                        "avg_ms": round(e["total_seconds"] / e["count"] * 1000, 1),
+                        "max_ms": round(e["max_seconds"] * 1000, 1),
+                        "total_s": round(e["total_seconds"], 2),
+                    }
+                )
+        return sorted(rows, key=lambda r: r["total_s"], reverse=True)
+
+    def print(self):
+        rows = self.rows()
+        if not rows:
+            return
+        print("\nAPI latency by endpoint")
+        for r in rows:
+            print(
+                f"  {r['endpoint']:<50} {r['count']:>6} calls  avg {r['avg_ms']:>8}ms  "
+                f"max {r['max_ms']:>8}ms  {r['retries']} retries  {r['errors']} errors"
+            )
+
+
+# shared by every client unless one is given its own
+STATS = LatencyStats()
+
+
+class AdaptiveRateLimiter:
+    """Thread safe pacer that spaces requests out to a rate that adapts to the server (AIMD).
+
+    Each success nudges the rate up (by about `increase` requests/s for every
+    second of successes) until max_rate, and each 429, 5xx or connection error
+    halves it, down to min_rate. Workers sharing one limiter back off together
+    instead of each hammering the API until its own retries run out.
+    """
+
+    def __init__(
+        self, rate: float = 10.0, min_rate: float = 0.5, max_rate: float = 100.0, increase: float = 1.0
+    ):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.next_slot = time.monotonic()
+
+    def acquire(self):
+        """Blocks until the caller's turn to send a request."""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + 1.0 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+    def success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def throttled(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.next_slot = max(self.next_slot, time.monotonic() + 1.0 / self.rate)
+
+
+def endpoint_name(method: str, url: str):
+    path = url.split("?", 1)[0]
+    if "/api/v1.0" in path:
+        path = path.split("/api/v1.0", 1)[1]
+    return f"{method.upper()} {ID_PATTERN.sub('/{id}', path)}"
+
+
+def retry_after_seconds(response: requests.Response):
+    """Reads Retry-After as either a number of seconds or an HTTP date."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RunZeroClient:
+    """requests.Session wrapper with connection pooling, retries and latency counters.
+
+    Transient failures (429, 5xx, connection errors and timeouts) are retried
+    with jittered exponential backoff, honoring Retry-After when the server
+    sends it. Non-idempotent requests (POST/PATCH) are only retried on 429 so
+    nothing gets applied twice. get/post/put/patch/delete take the same
+    arguments as requests, so a client can be passed anywhere a Session is used.
+    With a limiter every attempt waits for its turn and reports back whether it
+    was throttled.
+    """
+
+    def __init__(
+        self,
+        token: str = None,
+        base_url: str = BASE_URL,
+        retries: int = 5,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        max_retry_after: float = 300.0,
+        timeout: tuple = (10, 300),
+        pool_size: int = 10,
+        stats: LatencyStats = None,
+        limiter: AdaptiveRateLimiter = None,
+    ):
+        self.base_url = base_url
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.timeout = timeout
+        self.stats = stats or STATS
+        self.limiter = limiter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+    def url(self, path: str):
+        return path if path.startswith(("http://", "https://")) else self.base_url + path
+
+    def backoff_delay(self, attempt: int):
+        # full jitter keeps parallel workers from retrying in lockstep
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def request(self, method: str, path: str, **kwargs):
+        method = method.upper()
+        url = self.url(path)
+        endpoint = endpoint_name(method, url)
+        kwargs.setdefault("timeout", self.timeout)
+
+        attempt = 0
+        while True:
+            if self.limiter:
+                self.limiter.acquire()
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self.stats.record(endpoint, time.monotonic() - start, retried=attempt > 0)
+                if self.limiter:
+                    self.limiter.throttled()
+                if attempt >= self.retries or method not in IDEMPOTENT_METHODS:
+                    raise
+                delay = self.backoff_delay(attempt)
+            else:
+                # for streamed responses this is time to headers, not the full body
+                self.stats.record(
+                    endpoint, time.monotonic() - start, response.status_code, attempt > 0
+                )
+                status = response.status_code
+                if self.limiter:
+                    if status in RETRY_STATUSES:
+                        self.limiter.throttled()
+                    else:
+                        self.limiter.success()
+                if status not in RETRY_STATUSES or attempt >= self.retries:
+                    return response
+                if status != 429 and method not in IDEMPOTENT_METHODS:
+                    return response
+                delay = retry_after_seconds(response)
+                if delay is None:
+                    delay = self.backoff_delay(attempt)
+                delay = min(delay, self.max_retry_after)
+                response.close()
+
+            attempt += 1
+            time.sleep(delay)
+
+    def get(self, path: str, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path: str, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def patch(self, path: str, **kwargs):
+        return self.request("PATCH", path, **kwargs)
+
+    def delete(self, path: str, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    def get_page(self, path: str, page: int, page_size: int, params: dict = None, **kwargs):
+        """Returns the items on one page of a list endpoint.
+
+        :raises: requests.HTTPError: if the request fails after retries.
+        """
+        page_params = dict(params or {})
+        page_params[PAGE_PARAM] = page
+        page_params[PAGE_SIZE_PARAM] = page_size
+        response = self.get(path, params=page_params, **kwargs)
+        response.raise_for_status()
+        return response.json() or []
+
+    def iter_pages(
+        self, path: str, params: dict = None, page_size: int = 500, workers: int = 1, **kwargs
+    ):
+        """Yields the items of a list endpoint one at a time, fetching it page by page.
+
+        With workers > 1, pages after the second are requested that many at a
+        time in threads, and the items still come out in page order. Only the
+        pages in flight are held in memory. Stops at the first short page, or
+        when the server ignores the page parameters - a page bigger than
+        page_size, or a page that starts with the same item as the one before.
+
+        :raises: requests.HTTPError: if a page request fails after retries.
+        """
+        previous = None
+        # the first two pages are fetched on their own - if the server ignores
+        # the page parameters each one is the whole list, and fanning out
+        # before that's ruled out would download it once per worker
+        for page in (1, 2):
+            items = self.get_page(path, page, page_size, params, **kwargs)
+            if not items or items[0] == previous:
+                return
+            yield from items
+            if len(items) != page_size:
+                return
+            previous = items[0]
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            pending = []
+            next_page = 3
+            try:
+                while True:
+                    while len(pending) < max(1, workers):
+                        pending.append(
+                            executor.submit(self.get_page, path, next_page, page_size, params, **kwargs)
+                        )
+                        next_page += 1
+                    items = pending.pop(0).result()
+                    if not items or items[0] == previous:
+                        return
+                    yield from items
+                    if len(items) != page_size:
+                        return
+                    previous = items[0]
+            finally:
+                # pages past the end come back empty - don't wait on them
+                for future in pending:
+                    future.cancel()
+
+
+class RestRequest:
+    def __init__(self, method, url, params=None, data=None, headers=None, client=None):
+        self.method = method
+        self.url = url
+        self.params = params or {}
+        self.data = data or {}
+        self.headers = headers or {}
+        self.client = client
+
+    def execute(self):
+        client = self.client or get_client()
+        return client.request(
+            self.method,
+            self.url,
+            params=self.params,
+            data=self.data,
+            headers=self.headers,
+        )
+
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_client():
+    """Returns the process wide client used when a script doesn't make its own."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = RunZeroClient()
+        return _CLIENT
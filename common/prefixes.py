@@ -0,0 +1,220 @@
+import socket
+import ipaddress
+
+
+def to_network(value):
+    """Parses a CIDR, bare address or ip_network - host bits are allowed and dropped."""
+    if isinstance(value, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+        return value
+    return ipaddress.ip_network(value.strip() if isinstance(value, str) else value, strict=False)
+
+
+class PrefixTrie:
+    """Binary trie over IP prefixes for longest-prefix-match lookups.
+
+    Each prefix is stored at the depth of its mask length, walking one bit at a
+    time from the top of the address, so a lookup is at most 32 steps for IPv4
+    (128 for IPv6) no matter how many prefixes are loaded. IPv4 and IPv6 live
+    in separate roots.
+
+        trie = PrefixTrie()
+        trie.insert("10.0.0.0/8", "corp")
+        trie.insert("10.1.0.0/16", "lab")
+        trie.longest_match("10.1.2.0/24")   # (IPv4Network('10.1.0.0/16'), 'lab')
+        trie.covering("10.1.2.0/24")        # both, shortest prefix first
+    """
+
+    # node layout - a list is noticeably lighter than a dict or object per node
+    ZERO, ONE, NETWORK, VALUE = range(4)
+
+    def __init__(self):
+        self.roots = {4: self.node(), 6: self.node()}
+        self.size = 0
+
+    @staticmethod
+    def node():
+        return [None, None, None, None]
+
+    def __len__(self):
+        return self.size
+
+    def walk(self, network, create: bool = False):
+        """Yields the nodes on the path to network, stopping early if the path runs out."""
+        node = self.roots[network.version]
+        yield node
+        bits = network.max_prefixlen
+        address = int(network.network_address)
+        for depth in range(network.prefixlen):
+            bit = (address >> (bits - 1 - depth)) & 1
+            child = node[bit]
+            if child is None:
+                if not create:
+                    return
+                child = node[bit] = self.node()
+            node = child
+            yield node
+
+    def insert(self, network, value=None, replace: bool = True):
+        """Adds a prefix. With replace=False an existing value for the same prefix is kept.
+
+        :raises: ValueError: if network isn't a valid address or CIDR.
+        """
+        network = to_network(network)
+        node = None
+        for node in self.walk(network, create=True):
+            pass
+        if node[self.NETWORK] is None:
+            self.size += 1
+        elif not replace:
+            return
+        node[self.NETWORK] = network
+        node[self.VALUE] = value
+
+    def covering(self, network):
+        """Returns [(network, value)] for every stored prefix that contains network, shortest first."""
+        network = to_network(network)
+        return [
+            (node[self.NETWORK], node[self.VALUE])
+            for node in self.walk(network)
+            if node[self.NETWORK] is not None
+        ]
+
+    def longest_match(self, network):
+        """Returns (network, value) for the most specific stored prefix containing network, or None."""
+        match = None
+        for node in self.walk(to_network(network)):
+            if node[self.NETWORK] is not None:
+                match = node
+        if match is None:
+            return None
+        return match[self.NETWORK], match[self.VALUE]
+
+    def __contains__(self, network):
+        """True if network is covered by a stored prefix."""
+        return self.longest_match(network) is not None
+
+
+def site_subnet_index(sites: list, by_site: bool = False):
+    """Builds a PrefixTrie of the subnets defined on a list of sites from /org/sites.
+
+    Values are {"site_id", "site_name", "subnet", "tags", "description"}.
+    With by_site=True a dict of site name -> PrefixTrie is returned instead,
+    for lookups that should only consider an asset's own site. Subnet entries
+    that aren't valid CIDRs are skipped; if two sites define the same subnet
+    the first one wins.
+    """
+    tries = {}
+    for site in sites:
+        name = site.get("name")
+        trie = tries.setdefault(name if by_site else None, PrefixTrie())
+        for subnet, details in (site.get("subnets") or {}).items():
+            details = details or {}
+            try:
+                trie.insert(
+                    subnet,
+                    {
+                        "site_id": site.get("id"),
+                        "site_name": name,
+                        "subnet": subnet,
+                        "tags": details.get("tags") or {},
+                        "description": details.get("description", ""),
+                    },
+                    replace=False,
+                )
+            except ValueError:
+                continue
+    if by_site:
+        return tries
+    return tries.get(None, PrefixTrie())
+
+
+def network_interval(network):
+    """Returns (version, first, last) for a network, with the addresses as ints.
+
+    Plain IPv4 CIDR strings are parsed directly, skipping the ipaddress
+    objects, which matters when there are tens of thousands of them.
+
+    :raises: ValueError: if network isn't a valid address or CIDR.
+    """
+    if isinstance(network, str) and ":" not in network:
+        address, _, prefix = network.strip().partition("/")
+        try:
+            start = int.from_bytes(socket.inet_pton(socket.AF_INET, address), "big")
+            prefix = int(prefix) if prefix else 32
+        except (OSError, ValueError):
+            start = prefix = None
+        if prefix is not None and 0 <= prefix <= 32:
+            size = 1 << (32 - prefix)
+            start &= ~(size - 1)
+            return 4, start, start + size - 1
+    network = to_network(network)
+    return network.version, int(network.network_address), int(network.broadcast_address)
+
+
+def merge_intervals(intervals):
+    """Sorts inclusive (start, end) int intervals and merges the ones that overlap or touch."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def subtract_intervals(start: int, end: int, covered: list):
+    """Returns the parts of [start, end] not in covered, which must be sorted and merged."""
+    gaps = []
+    cursor = start
+    for c_start, c_end in covered:
+        if c_end < cursor:
+            continue
+        if c_start > end:
+            break
+        if c_start > cursor:
+            gaps.append((cursor, c_start - 1))
+        cursor = c_end + 1
+        if cursor > end:
+            return gaps
+    if cursor <= end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def interval_to_networks(start: int, end: int, version: int = 4):
+    """Returns the fewest CIDRs that exactly cover [start, end]."""
+    bits, network_class = (32, ipaddress.IPv4Network) if version == 4 else (128, ipaddress.IPv6Network)
+    networks = []
+    while start <= end:
+        # biggest block that is aligned at start and doesn't run past end
+        size = (start & -start).bit_length() - 1 if start else bits
+        while size and start + (1 << size) - 1 > end:
+            size -= 1
+        networks.append(network_class((start, bits - size)))
+        start += 1 << size
+    return networks
+
+
+def coverage_gaps(ranges: list, subnets: list):
+    """Returns the minimal list of CIDRs inside ranges that none of subnets cover.
+
+    Works on sorted integer intervals, so it costs O(n log n) in the number of
+    subnets no matter how small they are. Subnets of the other IP version or
+    that aren't valid CIDRs are ignored.
+    """
+    covered = {4: [], 6: []}
+    for subnet in subnets:
+        try:
+            version, start, end = network_interval(subnet)
+        except ValueError:
+            continue
+        covered[version].append((start, end))
+    covered = {version: merge_intervals(intervals) for version, intervals in covered.items()}
+
+    gaps = []
+    for network in ranges:
+        version, start, end = network_interval(network)
+        for gap_start, gap_end in subtract_intervals(start, end, covered[version]):
+            gaps.extend(interval_to_networks(gap_start, gap_end, version))
+    return gaps
@@ -0,0 +1,427 @@
+import re
+import time
+import bisect
+import ipaddress
+from datetime import datetime, timezone
+
+# runZero search keywords that aren't export fields, and the fields they are computed from
+DERIVED_FIELDS = {
+    "haspublic": ["addresses", "addresses_extra"],
+    "hasprivate": ["addresses", "addresses_extra"],
+    "cidr": ["addresses", "addresses_extra"],
+}
+
+# search keywords that are named differently in the exports
+FIELD_ALIASES = {
+    "_asset.protocol": "protocols",
+    "protocol": "protocols",
+}
+
+TRUE_WORDS = {"t", "true", "yes", "y", "1"}
+FALSE_WORDS = {"f", "false", "no", "n", "0"}
+
+TIME_UNITS = {
+    "s": 1, "sec": 1, "secs": 1, "second": 1, "seconds": 1,
+    "min": 60, "mins": 60, "minute": 60, "minutes": 60,
+    "h": 3600, "hr": 3600, "hrs": 3600, "hour": 3600, "hours": 3600,
+    "d": 86400, "day": 86400, "days": 86400,
+    "w": 604800, "wk": 604800, "wks": 604800, "week": 604800, "weeks": 604800,
+    "month": 2592000, "months": 2592000,
+    "y": 31536000, "yr": 31536000, "yrs": 31536000, "year": 31536000, "years": 31536000,
+}
+
+TOKEN_PATTERN = re.compile(
+    r"""\s*(?:
+        (?P<paren>[()])
+      | (?P<field>[A-Za-z_][\w.]*):(?P<op><=|>=|<|>|=)?(?:"(?P<quoted>(?:[^"\\]|\\.)*)"|(?P<bare>[^\s()]*))
+      | (?P<word>[^\s()]+)
+    )""",
+    re.VERBOSE,
+)
+RELATIVE_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)\s*([a-z]+)$")
+
+
+class UnsupportedSearch(ValueError):
+    """Raised for searches the local evaluator can't answer - callers should fall back to the API."""
+
+
+def tokenize(search: str):
+    tokens = []
+    pos = 0
+    search = search.strip()
+    while pos < len(search):
+        match = TOKEN_PATTERN.match(search, pos)
+        if not match or match.end() == pos:
+            raise UnsupportedSearch(f"can't parse {search[pos:]!r}")
+        pos = match.end()
+        if match.group("paren"):
+            tokens.append(match.group("paren"))
+        elif match.group("field"):
+            quoted = match.group("quoted")
+            value = re.sub(r"\\(.)", r"\1", quoted) if quoted is not None else match.group("bare")
+            tokens.append(("term", match.group("field").lower(), match.group("op") or "", value))
+        else:
+            word = match.group("word")
+            if word.upper() in ("AND", "OR", "NOT"):
+                tokens.append(word.upper())
+            else:
+                # free text matches any field on the server, which we can't reproduce reliably
+                raise UnsupportedSearch(f"free text search {word!r} isn't supported locally")
+    return tokens
+
+
+def parse_search(search: str):
+    """Parses a runZero search into a tree of tuples.
+
+    ("and", [nodes]), ("or", [nodes]), ("not", node) or ("term", field, op, value).
+    Terms next to each other without an operator are ANDed, like the console does.
+    An empty search matches everything and parses to ("and", []).
+    """
+    tokens = tokenize(search or "")
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def take():
+        nonlocal pos
+        pos += 1
+        return tokens[pos - 1]
+
+    def parse_or():
+        nodes = [parse_and()]
+        while peek() == "OR":
+            take()
+            nodes.append(parse_and())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def parse_and():
+        nodes = [parse_not()]
+        while peek() not in (None, "OR", ")"):
+            if peek() == "AND":
+                take()
+            nodes.append(parse_not())
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def parse_not():
+        if peek() == "NOT":
+            take()
+            return ("not", parse_not())
+        return parse_atom()
+
+    def parse_atom():
+        token = take() if peek() is not None else None
+        if token == "(":
+            node = parse_or()
+            if peek() != ")":
+                raise UnsupportedSearch(f"unbalanced parentheses in {search!r}")
+            take()
+            return node
+        if token == ")":
+            raise UnsupportedSearch(f"unbalanced parentheses in {search!r}")
+        if isinstance(token, tuple):
+            return token
+        raise UnsupportedSearch(f"unexpected {token!r} in {search!r}")
+
+    if not tokens:
+        return ("and", [])
+    node = parse_or()
+    if pos != len(tokens):
+        raise UnsupportedSearch(f"unexpected {tokens[pos]!r} in {search!r}")
+    return node
+
+
+def terms(node):
+    """Yields every ("term", field, op, value) in a parsed search."""
+    if node[0] == "term":
+        yield node
+    elif node[0] == "not":
+        yield from terms(node[1])
+    else:
+        for child in node[1]:
+            yield from terms(child)
+
+
+def search_fields(*searches: str):
+    """Returns the export fields needed to evaluate the searches locally, always including id.
+
+    Dotted attribute fields (e.g. tls.notAfterTS) can't be requested on their
+    own, so None is returned when one is used - export every field instead.
+    """
+    fields = {"id"}
+    for search in searches:
+        for _, field, _, _ in terms(parse_search(search)):
+            field = FIELD_ALIASES.get(field, field)
+            if field in DERIVED_FIELDS:
+                fields.update(DERIVED_FIELDS[field])
+            elif "." in field:
+                return None
+            else:
+                fields.add(field)
+    return ",".join(sorted(fields))
+
+
+def parse_time(value: str, now: float):
+    """Returns (kind, seconds) for a comparison value - kind is "absolute" or "relative"."""
+    value = value.strip().lower()
+    if value == "now":
+        return "absolute", now
+    try:
+        return "absolute", float(value)
+    except ValueError:
+        pass
+    match = RELATIVE_PATTERN.match(value)
+    if match and match.group(2) in TIME_UNITS:
+        return "relative", float(match.group(1)) * TIME_UNITS[match.group(2)]
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
+        try:
+            parsed = datetime.strptime(value.upper() if "T" in fmt else value, fmt)
+            return "absolute", parsed.replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            continue
+    raise UnsupportedSearch(f"can't compare against {value!r}")
+
+
+def to_number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+def index_key(value):
+    if isinstance(value, str):
+        return value.lower()
+    return value
+
+
+def ip_addresses(values):
+    ips = []
+    for value in values:
+        try:
+            ips.append(ipaddress.ip_address(value))
+        except ValueError:
+            continue
+    return ips
+
+
+class LocalInventory:
+    """Evaluates runZero searches against records that are already on hand.
+
+    Build one from a single export (ideally through common.cache.cached_export)
+    and ask it for as many counts as you like. Every field gets an index the
+    first time a search uses it - a value -> rows map for field:value matches
+    and a sorted array for comparisons - and each term's result is memoized,
+    so a batch of overlapping searches costs one download plus a few
+    milliseconds each.
+
+    Supported syntax is the common subset of the console's:
+
+    - field:value - case insensitive substring match, field:=value for an exact match
+    - quoted values, e.g. type:"ip camera"
+    - AND / OR / NOT and parentheses, with AND implied between terms
+    - field:<n, field:>=n etc. for numbers and epoch timestamps
+    - times as now, a date (2024-01-31) or a relative age like 6weeks - relative
+      ages compare the distance from now, so last_seen:<2weeks is seen in the
+      last two weeks and tls.notAfterTS:<6weeks expires within six weeks
+    - t/f for booleans, plus haspublic:, hasprivate: and cidr: computed from addresses
+
+    Anything else (free text, a field the export doesn't contain) raises
+    UnsupportedSearch so the caller can ask the API instead.
+    """
+
+    def __init__(self, records, now: float = None):
+        self.records = list(records)
+        self.now = now or time.time()
+        self.all_rows = frozenset(range(len(self.records)))
+        self.columns = set()
+        # dotted attribute name -> the dict column it lives in (e.g. service_data)
+        self.nested = {}
+        for record in self.records:
+            for name, value in record.items():
+                self.columns.add(name)
+                if isinstance(value, dict):
+                    for key in value:
+                        self.nested.setdefault(key.lower(), (name, key))
+        self.value_indexes = {}
+        self.sorted_indexes = {}
+        self.ip_index = None
+        self.term_cache = {}
+        self.parsed = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def values(self, field: str, record: dict):
+        if field in self.nested and field not in self.columns:
+            parent, key = self.nested[field]
+            value = (record.get(parent) or {}).get(key)
+        else:
+            value = record.get(field)
+        if value is None:
+            return []
+        if isinstance(value, list):
+            return [v for v in value if v is not None and not isinstance(v, dict)]
+        if isinstance(value, dict):
+            return []
+        return [value]
+
+    def resolve(self, field: str):
+        field = FIELD_ALIASES.get(field, field)
+        if field in DERIVED_FIELDS:
+            if not any(f in self.columns for f in DERIVED_FIELDS[field]):
+                raise UnsupportedSearch(f"{field}: needs the addresses field in the export")
+            return field
+        if field in self.columns or field in self.nested:
+            return field
+        # exports leave out fields that are empty, so a missing field might just
+        # mean nothing has it - or that it was never requested
+        raise UnsupportedSearch(f"{field} isn't in the export")
+
+    def value_index(self, field: str):
+        """value -> set of rows, built once per field."""
+        if field not in self.value_indexes:
+            index = {}
+            for row, record in enumerate(self.records):
+                for value in self.values(field, record):
+                    index.setdefault(index_key(value), set()).add(row)
+            self.value_indexes[field] = index
+        return self.value_indexes[field]
+
+    def sorted_index(self, field: str):
+        """(sorted numeric values, rows in the same order), built once per field."""
+        if field not in self.sorted_indexes:
+            pairs = []
+            for row, record in enumerate(self.records):
+                for value in self.values(field, record):
+                    number = to_number(value)
+                    if number is not None:
+                        pairs.append((number, row))
+            pairs.sort()
+            self.sorted_indexes[field] = ([p[0] for p in pairs], [p[1] for p in pairs])
+        return self.sorted_indexes[field]
+
+    def addresses(self):
+        """Parsed IP addresses per row, built once."""
+        if self.ip_index is None:
+            self.ip_index = [
+                ip_addresses(
+                    self.values("addresses", record) + self.values("addresses_extra", record)
+                )
+                for record in self.records
+            ]
+        return self.ip_index
+
+    def match_text(self, field: str, op: str, value: str):
+        wanted = value.lower()
+        rows = set()
+        for key, key_rows in self.value_index(field).items():
+            if isinstance(key, bool):
+                if wanted in TRUE_WORDS:
+                    hit = key
+                elif wanted in FALSE_WORDS:
+                    hit = not key
+                else:
+                    hit = False
+            elif isinstance(key, str):
+                hit = key == wanted if op == "=" else wanted in key
+            else:
+                text = str(key)
+                hit = text == wanted if op == "=" else wanted in text
+            if hit:
+                rows |= key_rows
+        return rows
+
+    def match_compare(self, field: str, op: str, value: str):
+        values, rows = self.sorted_index(field)
+        kind, amount = parse_time(value, self.now)
+        if kind == "relative":
+            # distance from now in either direction
+            start, end = self.now - amount, self.now + amount
+            if op == "<":
+                return set(rows[bisect.bisect_right(values, start):bisect.bisect_left(values, end)])
+            if op == "<=":
+                return set(rows[bisect.bisect_left(values, start):bisect.bisect_right(values, end)])
+            if op == ">":
+                return set(rows[: bisect.bisect_left(values, start)]) | set(
+                    rows[bisect.bisect_right(values, end):]
+                )
+            return set(rows[: bisect.bisect_right(values, start)]) | set(
+                rows[bisect.bisect_left(values, end):]
+            )
+        if op == "<":
+            return set(rows[: bisect.bisect_left(values, amount)])
+        if op == "<=":
+            return set(rows[: bisect.bisect_right(values, amount)])
+        if op == ">":
+            return set(rows[bisect.bisect_right(values, amount):])
+        return set(rows[bisect.bisect_left(values, amount):])
+
+    def match_derived(self, field: str, value: str):
+        ips = self.addresses()
+        if field == "cidr":
+            try:
+                network = ipaddress.ip_network(value, strict=False)
+            except ValueError:
+                raise UnsupportedSearch(f"cidr:{value} isn't a network")
+            return {
+                row for row, row_ips in enumerate(ips)
+                if any(ip.version == network.version and ip in network for ip in row_ips)
+            }
+        wanted = value.lower()
+        if wanted not in TRUE_WORDS | FALSE_WORDS:
+            raise UnsupportedSearch(f"{field}:{value} should be true or false")
+        if field == "haspublic":
+            has = {row for row, row_ips in enumerate(ips) if any(ip.is_global for ip in row_ips)}
+        else:
+            has = {row for row, row_ips in enumerate(ips) if any(ip.is_private for ip in row_ips)}
+        return has if wanted in TRUE_WORDS else set(self.all_rows) - has
+
+    def match_term(self, field: str, op: str, value: str):
+        key = (field, op, value)
+        if key not in self.term_cache:
+            resolved = self.resolve(field)
+            if resolved in DERIVED_FIELDS:
+                rows = self.match_derived(resolved, value)
+            elif op in ("<", "<=", ">", ">="):
+                rows = self.match_compare(resolved, op, value)
+            else:
+                rows = self.match_text(resolved, op, value)
+            self.term_cache[key] = frozenset(rows)
+        return self.term_cache[key]
+
+    def evaluate(self, node):
+        kind = node[0]
+        if kind == "term":
+            return self.match_term(*node[1:])
+        if kind == "not":
+            return self.all_rows - self.evaluate(node[1])
+        if kind == "and":
+            rows = self.all_rows
+            for child in node[1]:
+                rows = rows & self.evaluate(child)
+                if not rows:
+                    break
+            return rows
+        rows = frozenset()
+        for child in node[1]:
+            rows = rows | self.evaluate(child)
+        return rows
+
+    def rows(self, search: str):
+        if search not in self.parsed:
+            self.parsed[search] = parse_search(search)
+        return self.evaluate(self.parsed[search])
+
+    def count(self, search: str):
+        return len(self.rows(search))
+
+    def select(self, search: str):
+        """Returns the matching records in export order."""
+        return [self.records[row] for row in sorted(self.rows(search))]
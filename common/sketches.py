@@ -0,0 +1,201 @@
+import math
+
+import numpy as np
+
+
+def mix64(values):
+    """splitmix64 finalizer over a uint64 array - spreads structured keys (like packed IPs) over all 64 bits."""
+    values = np.asarray(values, dtype=np.uint64)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+class CountMinSketch:
+    """Count-min sketch over uint64 keys - approximate counts in a fixed amount of memory.
+
+    Each of the depth rows hashes a key to one of width counters, and the
+    estimate is the smallest of its counters, so it never undercounts. With
+    N counted in total, an estimate is at most epsilon * N too high
+    (epsilon = e / width) with probability 1 - delta (delta = e^-depth).
+    Updates and lookups take whole NumPy arrays of keys at a time.
+
+        sketch = CountMinSketch.from_memory(16 * 1024 * 1024)
+        sketch.add(keys)
+        sketch.estimate(keys), sketch.error_bound()
+
+    Sketches with the same shape and seed can be merged, e.g. one per worker.
+    """
+
+    def __init__(self, width: int, depth: int = 4, seed: int = 1):
+        if width < 1 or depth < 1:
+            raise ValueError(f"width and depth must be at least 1, got {width}x{depth}")
+        self.width = width
+        self.depth = depth
+        self.seed = seed
+        self.total = 0
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(0, 1 << 63, size=depth, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.integers(0, 1 << 63, size=depth, dtype=np.uint64)
+
+    @classmethod
+    def from_memory(cls, max_bytes: int, depth: int = 4, seed: int = 1):
+        """Makes the widest sketch whose counters fit in max_bytes."""
+        return cls(max(1, max_bytes // (depth * 8)), depth=depth, seed=seed)
+
+    @property
+    def epsilon(self):
+        return math.e / self.width
+
+    @property
+    def delta(self):
+        return math.exp(-self.depth)
+
+    def columns(self, keys, row: int):
+        # multiply-shift hash - uint64 arithmetic wraps, and the top 32 bits are the hash
+        return ((keys * self.a[row] + self.b[row]) >> np.uint64(32)) % np.uint64(self.width)
+
+    def add(self, keys, counts=None):
+        """Counts keys (a uint64 array), once each or by the matching entry of counts."""
+        keys = np.asarray(keys, dtype=np.uint64)
+        counts = np.ones(len(keys), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        for row in range(self.depth):
+            np.add.at(self.table[row], self.columns(keys, row), counts)
+        self.total += int(counts.sum())
+
+    def estimate(self, keys):
+        """Returns the estimated count of each key - never lower than the true count."""
+        keys = np.asarray(keys, dtype=np.uint64)
+        estimates = self.table[0][self.columns(keys, 0)]
+        for row in range(1, self.depth):
+            estimates = np.minimum(estimates, self.table[row][self.columns(keys, row)])
+        return estimates
+
+    def error_bound(self):
+        """How far over the true count an estimate can be, with probability 1 - delta."""
+        return math.ceil(self.epsilon * self.total)
+
+    def merge(self, other: "CountMinSketch"):
+        """Adds another sketch's counts into this one.
+
+        :raises: ValueError: if the sketches don't share a shape and seed.
+        """
+        if (other.width, other.depth, other.seed) != (self.width, self.depth, self.seed):
+            raise ValueError("only sketches with the same width, depth and seed can be merged")
+        self.table += other.table
+        self.total += other.total
+
+
+class TopK:
+    """The k heaviest keys of a stream, tracked with a count-min sketch in bounded memory.
+
+    Every batch of keys is added to the sketch, and the distinct keys of the
+    batch join a candidate set that is cut back to the `capacity` keys with
+    the highest estimates. A key dropped from the candidates keeps its counts
+    in the sketch, so if it turns out to be heavy later it comes back with its
+    full estimate. Memory is the sketch plus `capacity` keys, however many
+    distinct keys the stream has.
+
+    Keys are anything hashable (like a (src, dst, port) tuple), passed along
+    with a uint64 fingerprint of each - fingerprints are what gets sketched.
+    """
+
+    def __init__(self, k: int, sketch: CountMinSketch, capacity: int = None):
+        self.k = k
+        self.sketch = sketch
+        self.capacity = capacity or 4 * k
+        # fingerprint -> key
+        self.candidates = {}
+
+    def add(self, fingerprints, keys: list):
+        """Counts one batch - fingerprints is a uint64 array and keys the matching list of keys."""
+        fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        if not len(fingerprints):
+            return
+        unique, first, counts = np.unique(fingerprints, return_index=True, return_counts=True)
+        self.sketch.add(unique, counts)
+        for fingerprint, index in zip(unique.tolist(), first.tolist()):
+            if fingerprint not in self.candidates:
+                self.candidates[fingerprint] = keys[index]
+        self.prune()
+
+    def prune(self):
+        if len(self.candidates) <= self.capacity:
+            return
+        fingerprints = np.fromiter(self.candidates, dtype=np.uint64, count=len(self.candidates))
+        estimates = self.sketch.estimate(fingerprints)
+        keep = np.argpartition(-estimates, self.capacity - 1)[:self.capacity]
+        self.candidates = {
+            fingerprint: self.candidates[fingerprint] for fingerprint in fingerprints[keep].tolist()
+        }
+
+    def merge(self, other: "TopK"):
+        """Adds another TopK's sketch and candidates into this one.
+
+        The merged sketch counts are exact, but only keys that were among the
+        other's candidates can become candidates here - a key spread evenly
+        over many streams, never heavy in any one of them, can be missed.
+        """
+        self.sketch.merge(other.sketch)
+        for fingerprint, key in other.candidates.items():
+            self.candidates.setdefault(fingerprint, key)
+        self.prune()
+
+    def top(self, k: int = None):
+        """Returns [(key, estimated count)] for the k heaviest keys, heaviest first."""
+        if not self.candidates:
+            return []
+        fingerprints = np.fromiter(self.candidates, dtype=np.uint64, count=len(self.candidates))
+        estimates = self.sketch.estimate(fingerprints).tolist()
+        ranked = sorted(zip(fingerprints.tolist(), estimates), key=lambda item: -item[1])
+        return [(self.candidates[fingerprint], estimate) for fingerprint, estimate in ranked[:k or self.k]]
+
+
+class MisraGries:
+    """Misra-Gries frequent items summary - at most k counters, pure Python, mergeable.
+
+    Every key that makes up more than 1/(k+1) of the stream is guaranteed to
+    have a counter, and each counter undercounts its key by at most
+    error_bound(). Cheap enough to keep one per time window.
+    """
+
+    def __init__(self, k: int):
+        self.k = k
+        self.total = 0
+        self.counters = {}
+
+    def add(self, key):
+        self.total += 1
+        counters = self.counters
+        if key in counters:
+            counters[key] += 1
+        elif len(counters) < self.k:
+            counters[key] = 1
+        else:
+            # no room - take one off every counter (and the new key), dropping the ones at zero
+            for other in list(counters):
+                if counters[other] == 1:
+                    del counters[other]
+                else:
+                    counters[other] -= 1
+
+    def merge(self, other: "MisraGries"):
+        """Adds another summary's counters, then cuts back to k with the same error guarantee."""
+        self.total += other.total
+        for key, count in other.counters.items():
+            self.counters[key] = self.counters.get(key, 0) + count
+        if len(self.counters) > self.k:
+            cut = sorted(self.counters.values(), reverse=True)[self.k]
+            self.counters = {
+                key: count - cut for key, count in self.counters.items() if count > cut
+            }
+
+    def error_bound(self):
+        """How far under the true count any counter can be."""
+        return (self.total - sum(self.counters.values())) // (self.k + 1)
+
+    def top(self, n: int = None):
+        """Returns [(key, count)] heaviest first."""
+        ranked = sorted(self.counters.items(), key=lambda item: -item[1])
+        return ranked[:n] if n else ranked
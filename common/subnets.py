@@ -0,0 +1,237 @@
+import socket
+import ipaddress
+from array import array
+
+import numpy as np
+
+
+def ipv4_to_int(address: str):
+    """Returns a dotted quad as an int, or None for anything that isn't a plain IPv4 address."""
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, address), "big")
+    except (OSError, TypeError, ValueError):
+        return None
+
+
+def int_to_ipv4(value: int):
+    return socket.inet_ntoa(int(value).to_bytes(4, "big"))
+
+
+def format_networks(networks, prefix: int):
+    """Formats an array of uint32 network addresses as a list of "a.b.c.d/prefix" strings."""
+    networks = np.asarray(networks, dtype=np.uint64)
+    octets = [((networks >> np.uint64(s)) & np.uint64(255)).tolist() for s in (24, 16, 8, 0)]
+    return [f"{a}.{b}.{c}.{d}/{prefix}" for a, b, c, d in zip(*octets)]
+
+
+class SubnetAggregator:
+    """Buckets IPv4 addresses into subnets per group and sums values for each bucket.
+
+    Addresses are packed into a flat big-endian uint32 buffer as they are
+    added, and values are stored once per add() call rather than once per
+    address, so the counts, sums and averages per subnet come out of a single
+    np.unique + np.bincount pass instead of dict updates per address.
+
+        agg = SubnetAggregator(prefix=24, value_fields=["risk_rank"])
+        agg.add("site-a", ["10.0.0.5", "10.0.0.9"], {"risk_rank": 3})
+        agg.aggregate()
+        # [{"group": "site-a", "subnet": "10.0.0.0/24", "count": 2, "risk_rank": 6, "avg_risk_rank": 3.0}]
+
+    Rows come back in the order each (group, subnet) was first seen.
+    """
+
+    def __init__(self, prefix: int = 24, value_fields: list = ()):
+        if not 0 <= prefix <= 32:
+            raise ValueError(f"prefix must be between 0 and 32, got {prefix}")
+        self.prefix = prefix
+        self.value_fields = list(value_fields)
+        self.labels = []
+        self.label_codes = {}
+        # one entry per add() call - its group code and values
+        self.entry_codes = array("I")
+        self.entry_values = {field: array("d") for field in self.value_fields}
+        # one item per address - the packed address and the entry it came from
+        self.packed = bytearray()
+        self.entries = array("I")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, group, addresses: list, values: dict = None):
+        """Adds the IPv4 addresses in a list (anything else is skipped) under one group.
+
+        Returns how many addresses were added. Values are counted once per address.
+        """
+        entry = len(self.entry_codes)
+        added = 0
+        packed = self.packed
+        entries = self.entries
+        for address in addresses:
+            try:
+                packed += socket.inet_pton(socket.AF_INET, address)
+            except (OSError, TypeError, ValueError):
+                continue
+            entries.append(entry)
+            added += 1
+        if not added:
+            return 0
+
+        code = self.label_codes.get(group)
+        if code is None:
+            code = self.label_codes[group] = len(self.labels)
+            self.labels.append(group)
+        self.entry_codes.append(code)
+        for field in self.value_fields:
+            self.entry_values[field].append((values or {}).get(field) or 0)
+        return added
+
+    def aggregate(self):
+        if not self.entries:
+            return []
+        shift = np.uint64(32 - self.prefix)
+        # 'I' is a C unsigned int, which np.uintc reads back without copying
+        entries = np.frombuffer(self.entries, dtype=np.uintc)
+        codes = np.frombuffer(self.entry_codes, dtype=np.uintc).astype(np.uint64)[entries]
+        networks = np.frombuffer(self.packed, dtype=">u4").astype(np.uint64) >> shift
+        keys = (codes << np.uint64(32)) | networks
+
+        unique, first, inverse, counts = np.unique(
+            keys, return_index=True, return_inverse=True, return_counts=True
+        )
+        inverse = inverse.ravel()
+        order = np.argsort(first, kind="stable")
+        unique = unique[order]
+        counts = counts[order]
+
+        columns = {
+            "group": [self.labels[c] for c in (unique >> np.uint64(32)).tolist()],
+            "subnet": format_networks((unique & np.uint64(0xFFFFFFFF)) << shift, self.prefix),
+            "count": counts.tolist(),
+        }
+        for field in self.value_fields:
+            weights = np.frombuffer(self.entry_values[field], dtype=np.float64)[entries]
+            sums = np.bincount(inverse, weights=weights, minlength=len(first))[order]
+            integral = np.array_equal(sums, np.floor(sums))
+            columns[field] = sums.astype(np.int64).tolist() if integral else sums.tolist()
+            columns[f"avg_{field}"] = np.round(sums / counts, 2).tolist()
+
+        names = list(columns)
+        return [dict(zip(names, row)) for row in zip(*columns.values())]
+
+
+def aggregate_assets(
+    assets,
+    group_field: str,
+    value_fields: list = (),
+    prefix: int = 24,
+    default_group: str = None,
+    address_fields: list = ("addresses",),
+):
+    """Aggregates the IPv4 addresses of a stream of assets into subnets per group_field.
+
+    Every address counts once, so an asset with two addresses in the same
+    subnet counts twice. Assets without group_field use default_group, or are
+    skipped when that is None. Missing values count as 0.
+    """
+    aggregator = SubnetAggregator(prefix=prefix, value_fields=value_fields)
+    for asset in assets:
+        group = asset.get(group_field) or default_group
+        if group is None:
+            continue
+        addresses = asset.get(address_fields[0]) or []
+        for field in address_fields[1:]:
+            addresses = addresses + (asset.get(field) or [])
+        aggregator.add(group, addresses, asset)
+    return aggregator.aggregate()
+
+
+class IPSet:
+    """Set of IP addresses with IPv4 kept as a sparse bitmap.
+
+    Each /24 that has at least one address is a single 256 bit int, so
+    membership is a mask test, a /24 costs a few dozen bytes however full it
+    is, and counting the addresses in any range is a popcount over the blocks
+    in it. IPv6 addresses (rare in comparison) fall back to a plain set.
+    Strings that aren't IP addresses are ignored.
+    """
+
+    def __init__(self, addresses=()):
+        # ip >> 8 -> bitmap of the 256 addresses in that /24
+        self.blocks = {}
+        self.ipv6 = set()
+        for address in addresses:
+            self.add(address)
+
+    def add(self, address: str):
+        """Adds an address, returning True if it wasn't already in the set."""
+        ip = ipv4_to_int(address)
+        if ip is not None:
+            block = ip >> 8
+            bit = 1 << (ip & 255)
+            bits = self.blocks.get(block, 0)
+            if bits & bit:
+                return False
+            self.blocks[block] = bits | bit
+            return True
+        try:
+            ip = ipaddress.IPv6Address(address)
+        except ValueError:
+            return False
+        if ip in self.ipv6:
+            return False
+        self.ipv6.add(ip)
+        return True
+
+    def update(self, addresses):
+        for address in addresses:
+            self.add(address)
+
+    def __contains__(self, address: str):
+        ip = ipv4_to_int(address)
+        if ip is not None:
+            return bool(self.blocks.get(ip >> 8, 0) & (1 << (ip & 255)))
+        try:
+            return ipaddress.IPv6Address(address) in self.ipv6
+        except ValueError:
+            return False
+
+    def ipv4_count(self):
+        return sum(bin(bits).count("1") for bits in self.blocks.values())
+
+    def __len__(self):
+        return self.ipv4_count() + len(self.ipv6)
+
+    def counts_by_prefix(self, prefix: int = 24):
+        """Returns {network int: addresses in use} for every IPv4 range of the given size that has any."""
+        if not 0 <= prefix <= 32:
+            raise ValueError(f"prefix must be between 0 and 32, got {prefix}")
+        counts = {}
+        if prefix <= 24:
+            shift = 24 - prefix
+            for block, bits in self.blocks.items():
+                network = (block >> shift) << (32 - prefix)
+                counts[network] = counts.get(network, 0) + bin(bits).count("1")
+            return counts
+        # smaller than a /24 - split each block's bitmap into 2 ** (32 - prefix) bit slices
+        width = 32 - prefix
+        mask = (1 << (1 << width)) - 1
+        for block, bits in self.blocks.items():
+            for offset in range(0, 256, 1 << width):
+                used = bin((bits >> offset) & mask).count("1")
+                if used:
+                    counts[(block << 8) | offset] = used
+        return counts
+
+    def ipv4_addresses(self):
+        """Yields the IPv4 addresses in numeric order."""
+        for block in sorted(self.blocks):
+            bits = self.blocks[block]
+            base = block << 8
+            while bits:
+                low = bits & -bits
+                yield int_to_ipv4(base | (low.bit_length() - 1))
+                bits ^= low
+
+    def addresses(self):
+        """Returns every address as a string, IPv4 in numeric order followed by IPv6."""
+        return list(self.ipv4_addresses()) + [str(ip) for ip in sorted(self.ipv6)]
@@ -0,0 +1,164 @@
+import os
+import json
+import gzip
+import time
+import hashlib
+from datetime import datetime, timezone
+
+from common.export import stream_assets, BASE_URL
+from common.files import atomic_open
+
+# field the watermark is tracked on and searched with - runZero stores it as epoch seconds
+WATERMARK_FIELD = "updated_at"
+
+# re-request this many seconds before the watermark to cover clock skew and
+# assets that were being written while the last sync ran
+WATERMARK_OVERLAP = 300
+
+
+def snapshot_key(org_id: str, search: str = None, fields: str = None):
+    """Snapshots are keyed by org and by the search + fields they were built with,
+    so scripts asking for different slices of the inventory don't overwrite each other."""
+    digest = hashlib.sha1(f"{search or ''}|{fields or ''}".encode()).hexdigest()[:8]
+    return f"{org_id}-{digest}"
+
+
+def snapshot_paths(snapshot_dir: str, key: str):
+    return (
+        os.path.join(snapshot_dir, f"{key}.jsonl.gz"),
+        os.path.join(snapshot_dir, f"{key}.state.json"),
+    )
+
+
+def load_state(state_path: str):
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_snapshot(snapshot_path: str):
+    """Yields the assets in a snapshot one at a time."""
+    with gzip.open(snapshot_path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def format_watermark(ts: float):
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def delta_search(search: str, watermark: float):
+    since = f'{WATERMARK_FIELD}:>"{format_watermark(watermark - WATERMARK_OVERLAP)}"'
+    return f"({search}) AND {since}" if search else since
+
+
+def with_required_fields(fields: str):
+    """The merge needs id and the watermark field, so make sure they are exported."""
+    if not fields:
+        return fields
+    wanted = [f.strip() for f in fields.split(",") if f.strip()]
+    for required in ("id", WATERMARK_FIELD):
+        if required not in wanted:
+            wanted.append(required)
+    return ",".join(wanted)
+
+
+def write_snapshot(snapshot_path: str, assets):
+    """Writes assets to the snapshot atomically and returns (count, max watermark seen)."""
+    count = 0
+    watermark = 0
+    with atomic_open(snapshot_path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+            for asset in assets:
+                gz.write((json.dumps(asset) + "\n").encode("utf-8"))
+                count += 1
+                watermark = max(watermark, asset.get(WATERMARK_FIELD) or 0)
+    return count, watermark
+
+
+def sync_assets(
+    org_id: str,
+    token: str,
+    snapshot_dir: str,
+    search: str = None,
+    fields: str = None,
+    full: bool = False,
+    prune: bool = True,
+    base_url: str = BASE_URL,
+    session=None,
+):
+    """Brings the local snapshot for an org up to date and returns (snapshot_path, stats).
+
+    The first run (or full=True, or a change to search/fields) downloads every
+    matching asset. After that only assets updated since the stored watermark
+    are requested and merged over the previous snapshot. With prune=True an
+    id-only export of the same search is used to drop assets that were deleted
+    or no longer match; it is much smaller than a full export but can be turned
+    off when speed matters more than catching deletions right away.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    fields = with_required_fields(fields)
+    key = snapshot_key(org_id, search, fields)
+    snapshot_path, state_path = snapshot_paths(snapshot_dir, key)
+    state = load_state(state_path)
+    start = time.time()
+    export_kwargs = {"base_url": base_url, "session": session}
+
+    stats = {"mode": "delta", "changed": 0, "removed": 0, "total": 0}
+    if full or not state or not os.path.exists(snapshot_path):
+        stats["mode"] = "full"
+        assets = stream_assets(token, search=search, fields=fields, **export_kwargs)
+        stats["total"], watermark = write_snapshot(snapshot_path, assets)
+        stats["changed"] = stats["total"]
+    else:
+        delta = {
+            a["id"]: a
+            for a in stream_assets(
+                token,
+                search=delta_search(search, state["watermark"]),
+                fields=fields,
+                **export_kwargs,
+            )
+        }
+        stats["changed"] = len(delta)
+
+        keep_ids = None
+        if prune:
+            keep_ids = {
+                a["id"]
+                for a in stream_assets(token, search=search, fields="id", **export_kwargs)
+            }
+
+        def merged():
+            for asset in read_snapshot(snapshot_path):
+                if asset["id"] in delta:
+                    continue
+                if keep_ids is not None and asset["id"] not in keep_ids:
+                    stats["removed"] += 1
+                    continue
+                yield asset
+            yield from delta.values()
+
+        stats["total"], watermark = write_snapshot(snapshot_path, merged())
+        watermark = max(watermark, state["watermark"])
+
+    # fall back to the local clock if the export didn't include the watermark field
+    watermark = watermark or start
+    with atomic_open(state_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "org_id": org_id,
+                "search": search,
+                "fields": fields,
+                "watermark": watermark,
+                "synced_at": datetime.now(timezone.utc).isoformat(),
+                "count": stats["total"],
+            },
+            f,
+            indent=2,
+        )
+
+    stats["seconds"] = round(time.time() - start, 2)
+    return snapshot_path, stats
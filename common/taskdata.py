@@ -0,0 +1,61 @@
+import os
+import json
+
+from common.files import open_compressed
+
+# orjson parses task lines several times faster - use it when it's installed
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+# extensions dropped from a task file's name to get the task name
+COMPRESSED_EXTENSIONS = (".gz", ".zst", ".zstd")
+DATA_EXTENSIONS = (".json", ".jsonl", ".log", ".txt")
+# files picked up when a directory of tasks is given
+TASK_EXTENSIONS = DATA_EXTENSIONS + tuple(
+    data + compressed for data in DATA_EXTENSIONS for compressed in COMPRESSED_EXTENSIONS
+)
+
+
+def task_stem(path: str):
+    """Returns path without its data and compression extensions - dir/task.json.gz -> dir/task."""
+    for extensions in (COMPRESSED_EXTENSIONS, DATA_EXTENSIONS):
+        root, ext = os.path.splitext(path)
+        if ext.lower() in extensions:
+            path = root
+    return path
+
+
+def parse_task_line(line: bytes):
+    """Parses one line of task data or a task log, with or without the @cee: syslog prefix."""
+    if line.startswith(b"@cee:"):
+        line = line[5:]
+    return loads(line)
+
+
+def iter_task_records(path: str):
+    """Yields every record in a task file, which may be plain, gzipped or zstd compressed."""
+    with open_compressed(path) as f:
+        for line in f:
+            if line.strip():
+                yield parse_task_line(line)
+
+
+def record_errors(jline: dict):
+    """Returns the error messages in one task record - usually none, at most a few.
+
+    Covers error level status lines and SNMP auth failures from task data, and
+    the error-message field of task logs.
+    """
+    errors = []
+    if jline.get("level", "") == "error" and "msg" in jline:
+        errors.append(jline["msg"])
+    info = jline.get("info", "")
+    if info and isinstance(info, dict) and info.get("snmp.failedAuth", ""):
+        errors.append(f"snmp auth error: {jline.get('host', '')}:161 {info['snmp.failedAuth']}")
+    if "error-message" in jline:
+        errors.append(jline["error-message"])
+    return errors
@@ -0,0 +1,316 @@
+import os
+import time
+import sqlite3
+
+from common.taskdata import iter_task_records, record_errors, task_stem
+
+# rows per executemany call while ingesting a task
+BATCH_SIZE = 5000
+
+# results without a port (arp, icmp, most udp probes) are stored as port 0
+NO_PORT = 0
+
+TASK_COLUMNS = [
+    "task_id",
+    "path",
+    "fingerprint",
+    "started_at",
+    "finished_at",
+    "lines",
+    "host_count",
+    "port_count",
+    "error_count",
+    "ingested_at",
+]
+
+# every table is keyed by task first, so per-task lookups and diffs are range
+# scans of the primary key - WITHOUT ROWID makes that key the table itself,
+# so those queries never touch a second b-tree
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS tasks (
+        task_id TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        fingerprint TEXT NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        lines INTEGER NOT NULL,
+        host_count INTEGER NOT NULL,
+        port_count INTEGER NOT NULL,
+        error_count INTEGER NOT NULL,
+        ingested_at REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS tasks_started_at ON tasks (started_at, task_id)",
+    """CREATE TABLE IF NOT EXISTS task_hosts (
+        task_id TEXT NOT NULL,
+        host TEXT NOT NULL,
+        results INTEGER NOT NULL,
+        PRIMARY KEY (task_id, host)
+    ) WITHOUT ROWID""",
+    # which tasks saw a host, without scanning every task
+    "CREATE INDEX IF NOT EXISTS task_hosts_host ON task_hosts (host, task_id)",
+    """CREATE TABLE IF NOT EXISTS task_ports (
+        task_id TEXT NOT NULL,
+        host TEXT NOT NULL,
+        port INTEGER NOT NULL,
+        results INTEGER NOT NULL,
+        PRIMARY KEY (task_id, host, port)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS task_errors (
+        task_id TEXT NOT NULL,
+        error TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (task_id, error)
+    ) WITHOUT ROWID""",
+    # covers the trend of a single error across tasks
+    "CREATE INDEX IF NOT EXISTS task_errors_error ON task_errors (error, task_id, count)",
+]
+
+
+def task_fingerprint(path: str):
+    """Size and mtime of a task file - cheap to check, and changes if the file is replaced."""
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def task_port(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return NO_PORT
+
+
+def record_time(jline: dict):
+    """Returns a record's ts in epoch seconds, or None if it has none."""
+    ts = jline.get("ts")
+    if not isinstance(ts, (int, float)):
+        return None
+    # task data timestamps are in nanoseconds
+    return ts / 1e9 if ts > 1e12 else ts
+
+
+def summarize_task(path: str):
+    """Reads a task file (plain, gzip or zstd) once and returns what the index stores for it.
+
+    Returns {"started_at", "finished_at", "lines", "ports", "errors",
+    "error_messages"} where ports is {(host, port): result count}, errors is
+    {message: count} and error_messages counts just the error-message field of
+    task logs, as the per-log error CSVs do. Timestamps are the first and last
+    record ts in epoch seconds. This is the slow part of an ingest, so it runs
+    in worker processes.
+    """
+    ports = {}
+    errors = {}
+    error_messages = {}
+    lines = 0
+    started_at = finished_at = None
+    for jline in iter_task_records(path):
+        lines += 1
+        ts = record_time(jline)
+        if ts is not None:
+            started_at = ts if started_at is None else min(started_at, ts)
+            finished_at = ts if finished_at is None else max(finished_at, ts)
+        if jline.get("type", "") == "result":
+            key = (jline.get("host", ""), task_port(jline.get("port")))
+            ports[key] = ports.get(key, 0) + 1
+        for error in record_errors(jline):
+            errors[error] = errors.get(error, 0) + 1
+        if "error-message" in jline:
+            message = jline["error-message"]
+            error_messages[message] = error_messages.get(message, 0) + 1
+    return {
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "lines": lines,
+        "ports": ports,
+        "errors": errors,
+        "error_messages": error_messages,
+    }
+
+
+class TaskIndex:
+    """SQLite index of task results - hosts, ports and errors per task - for comparing tasks.
+
+    Each task file is parsed once and stored under its task ID (the file name
+    without extensions unless one is given). Ingesting a task that is already
+    indexed from the same file does nothing; if the file has changed, the
+    task's rows are replaced in one transaction, so the index never holds a
+    half-loaded task.
+
+        index = TaskIndex("tasks.db")
+        index.ingest("scan-monday.json.gz")
+        index.ingest("scan-tuesday.json.gz")
+        appeared, disappeared = index.host_changes("scan-monday", "scan-tuesday")
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.expanduser(path)
+        parent = os.path.dirname(self.path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        # autocommit mode so each ingest is one explicit transaction
+        self.db = sqlite3.connect(self.path, isolation_level=None, timeout=300)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        for statement in SCHEMA:
+            self.db.execute(statement)
+
+    @staticmethod
+    def task_id(path: str):
+        return os.path.basename(task_stem(path))
+
+    def task(self, task_id: str):
+        row = self.db.execute(
+            f"SELECT {','.join(TASK_COLUMNS)} FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        return dict(zip(TASK_COLUMNS, row)) if row else None
+
+    def tasks(self):
+        """Returns every indexed task, oldest first."""
+        rows = self.db.execute(
+            f"SELECT {','.join(TASK_COLUMNS)} FROM tasks ORDER BY started_at, task_id"
+        )
+        return [dict(zip(TASK_COLUMNS, row)) for row in rows]
+
+    def needs_ingest(self, path: str, task_id: str = None):
+        """True if the task isn't indexed yet or was indexed from a different file."""
+        task = self.task(task_id or self.task_id(path))
+        return task is None or task["fingerprint"] != task_fingerprint(path)
+
+    def ingest(self, path: str, task_id: str = None, summary: dict = None):
+        """Indexes a task file and returns True, or False if it was already indexed.
+
+        summary is the output of summarize_task(path), for callers that parse
+        files in a process pool; without it the file is parsed here.
+        """
+        task_id = task_id or self.task_id(path)
+        if not self.needs_ingest(path, task_id):
+            return False
+        fingerprint = task_fingerprint(path)
+        if summary is None:
+            summary = summarize_task(path)
+        ports = summary["ports"]
+        hosts = {}
+        for (host, _), count in ports.items():
+            hosts[host] = hosts.get(host, 0) + count
+
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            for table in ("task_hosts", "task_ports", "task_errors", "tasks"):
+                self.db.execute(f"DELETE FROM {table} WHERE task_id = ?", (task_id,))
+            self._insert_many(
+                "INSERT INTO task_hosts VALUES (?, ?, ?)",
+                ((task_id, host, count) for host, count in hosts.items()),
+            )
+            self._insert_many(
+                "INSERT INTO task_ports VALUES (?, ?, ?, ?)",
+                ((task_id, host, port, count) for (host, port), count in ports.items()),
+            )
+            self._insert_many(
+                "INSERT INTO task_errors VALUES (?, ?, ?)",
+                ((task_id, error, count) for error, count in summary["errors"].items()),
+            )
+            self.db.execute(
+                "INSERT INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    task_id,
+                    os.path.abspath(path),
+                    fingerprint,
+                    summary["started_at"],
+                    summary["finished_at"],
+                    summary["lines"],
+                    len(hosts),
+                    len(ports),
+                    sum(summary["errors"].values()),
+                    time.time(),
+                ),
+            )
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+        return True
+
+    def _insert_many(self, sql: str, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                self.db.executemany(sql, batch)
+                batch = []
+        if batch:
+            self.db.executemany(sql, batch)
+
+    def _require(self, *task_ids):
+        for task_id in task_ids:
+            if self.task(task_id) is None:
+                raise KeyError(f"task {task_id} isn't in the index")
+
+    def host_changes(self, task_a: str, task_b: str):
+        """Returns (appeared, disappeared) - hosts seen in task_b but not task_a, and the reverse.
+
+        :raises: KeyError: if either task isn't indexed.
+        """
+        self._require(task_a, task_b)
+        sql = """SELECT host FROM task_hosts WHERE task_id = ?
+                 EXCEPT SELECT host FROM task_hosts WHERE task_id = ?
+                 ORDER BY host"""
+        appeared = [row[0] for row in self.db.execute(sql, (task_b, task_a))]
+        disappeared = [row[0] for row in self.db.execute(sql, (task_a, task_b))]
+        return appeared, disappeared
+
+    def port_changes(self, task_a: str, task_b: str):
+        """Returns (appeared, disappeared) lists of (host, port) between two tasks.
+
+        Port 0 stands for results without a port.
+
+        :raises: KeyError: if either task isn't indexed.
+        """
+        self._require(task_a, task_b)
+        sql = """SELECT host, port FROM task_ports WHERE task_id = ?
+                 EXCEPT SELECT host, port FROM task_ports WHERE task_id = ?
+                 ORDER BY host, port"""
+        appeared = self.db.execute(sql, (task_b, task_a)).fetchall()
+        disappeared = self.db.execute(sql, (task_a, task_b)).fetchall()
+        return appeared, disappeared
+
+    def error_trend(self, error: str = None):
+        """Yields {"task_id", "started_at", "error", "count"} per task and error, oldest task first.
+
+        With error set, only that message is returned - one row per task it
+        showed up in, read from the error index.
+        """
+        sql = """SELECT t.task_id, t.started_at, e.error, e.count
+                 FROM task_errors e JOIN tasks t ON t.task_id = e.task_id"""
+        params = ()
+        if error is not None:
+            sql += " WHERE e.error = ?"
+            params = (error,)
+        sql += " ORDER BY t.started_at, t.task_id, e.count DESC"
+        for task_id, started_at, message, count in self.db.execute(sql, params):
+            yield {"task_id": task_id, "started_at": started_at, "error": message, "count": count}
+
+    def host_history(self, host: str):
+        """Returns the IDs of the tasks that saw a host, oldest first."""
+        rows = self.db.execute(
+            """SELECT h.task_id FROM task_hosts h JOIN tasks t ON t.task_id = h.task_id
+               WHERE h.host = ? ORDER BY t.started_at, t.task_id""",
+            (host,),
+        )
+        return [row[0] for row in rows]
+
+    def close(self):
+        self.db.close()
+
+
+def compare_tasks(index: TaskIndex, task_a: str, task_b: str):
+    """Returns CSV rows for the hosts and ports that appeared or disappeared from task_a to task_b.
+
+    :raises: KeyError: if either task isn't indexed.
+    """
+    output = []
+    appeared, disappeared = index.host_changes(task_a, task_b)
+    output.extend({"change": "host appeared", "host": host, "port": ""} for host in appeared)
+    output.extend({"change": "host disappeared", "host": host, "port": ""} for host in disappeared)
+    appeared, disappeared = index.port_changes(task_a, task_b)
+    output.extend({"change": "port appeared", "host": host, "port": port} for host, port in appeared)
+    output.extend({"change": "port disappeared", "host": host, "port": port} for host, port in disappeared)
+    return output
@@ -1,7 +1,13 @@
-import requests
 import os
+import sys
 import json
 import csv
+import argparse
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.http import RunZeroClient
+from common.cache import cached_lookup, column_kind, BOOLEAN, INTEGER, JSON, REAL, TEXT
 
 # AUTH
 RUNZERO_ORG_TOKEN = os.environ["RUNZERO_ORG_TOKEN"]
@@ -10,24 +16,57 @@ RUNZERO_ACCOUNT_TOKEN = os.environ["RUNZERO_ACCOUNT_TOKEN"]
 ACCOUNT_HEADERS = {"Authorization": f"Bearer {RUNZERO_ACCOUNT_TOKEN}"}
 BASE_URL = "https://console.runZero.com/api/v1.0"
 
+# pooled connections + retries on 429/5xx
+CLIENT = RunZeroClient(base_url=BASE_URL)
+
 # UPDATE IF NEEDED
 FIELDS_TO_SKIP = ["params"]
 
-
-def write_to_csv(output: dict, filename: str, fieldnames: list):
-    file = open(filename, "w")
-    writer = csv.DictWriter(
-        file,
-        fieldnames=fieldnames
-    )
-    writer.writeheader()
-    writer.writerows(output)
-    file.close()
+# rows per parquet row group - only this many are held in memory while writing
+PARQUET_BATCH_SIZE = 10000
+
+# Command line args
+parser = argparse.ArgumentParser(
+    prog="Dump Task Info",
+    description="Writes every runZero task matching a search to CSV or Parquet",
+)
+parser.add_argument(
+    "--search",
+    default="type:scan recur:t",
+    help="task search (default: recurring scans) - use type:scan for every historical scan",
+)
+parser.add_argument(
+    "--format",
+    choices=["csv", "parquet"],
+    default="csv",
+    help="output format - parquet needs pip install pyarrow (default: csv)",
+)
+parser.add_argument(
+    "--output",
+    help="output file (default: tasks.csv or tasks.parquet)",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=4,
+    help="task pages to fetch at once (default: 4)",
+)
+parser.add_argument(
+    "--page-size",
+    type=int,
+    default=500,
+    help="tasks per page (default: 500)",
+)
+parser.add_argument(
+    "--refresh-names",
+    action="store_true",
+    help="fetch the site, explorer and template names even if they are cached",
+)
 
 
 def get_sites():
     url = BASE_URL + "/org/sites"
-    sites = requests.get(url, headers=ORG_HEADERS)
+    sites = CLIENT.get(url, headers=ORG_HEADERS)
     site_names = {}
     for s in sites.json():
         site_names[s["id"]] = s["name"]
@@ -36,7 +75,7 @@ def get_sites():
 
 def get_explorers():
     url = BASE_URL + "/org/explorers"
-    explorers = requests.get(url, headers=ORG_HEADERS)
+    explorers = CLIENT.get(url, headers=ORG_HEADERS)
     explorer_names = {}
     for e in explorers.json():
         explorer_names[e["id"]] = e["name"]
@@ -45,51 +84,162 @@ def get_explorers():
 
 def get_templates():
     url = BASE_URL + "/account/tasks/templates"
-    templates = requests.get(url, headers=ACCOUNT_HEADERS)
+    templates = CLIENT.get(url, headers=ACCOUNT_HEADERS)
+    if templates.status_code != 200:
+        # not cached, so a fixed account token is picked up on the next run
+        return None
     template_names = {}
-    if templates.status_code == 200:
-        for t in templates.json():
-            template_names[t["id"]] = t["name"]
+    for t in templates.json():
+        template_names[t["id"]] = t["name"]
     return template_names
 
 
-def get_tasks():
+def get_names(refresh: bool = False):
+    """Returns the site, explorer and template id -> name maps.
+
+    With RUNZERO_CACHE_PATH set they are kept in the shared cache and only
+    fetched again once they are older than RUNZERO_CACHE_TTL.
+    """
+    sites = cached_lookup("site-names", RUNZERO_ORG_TOKEN, get_sites, refresh=refresh)
+    explorers = cached_lookup("explorer-names", RUNZERO_ORG_TOKEN, get_explorers, refresh=refresh)
+    templates = cached_lookup(
+        "template-names", RUNZERO_ACCOUNT_TOKEN, get_templates, refresh=refresh
+    )
+    return sites, explorers, templates or {}
+
+
+def get_tasks(search: str, workers: int = 4, page_size: int = 500):
+    """Streams the tasks matching search, fetching several pages at once."""
     url = BASE_URL + "/org/tasks"
-    tasks = requests.get(
-        url, headers=ORG_HEADERS, params={
-            "search": "type:scan recur:t"}
+    return CLIENT.iter_pages(
+        url,
+        headers=ORG_HEADERS,
+        params={"search": search},
+        page_size=page_size,
+        workers=workers,
     )
-    return tasks.json()
+
+
+def task_row(t: dict, sites: dict, explorers: dict, templates: dict):
+    t["explorer_name"] = explorers.get(t["agent_id"], "")
+    t["site_name"] = sites.get(t["site_id"], "")
+    t["template_name"] = templates.get(
+        t["template_id"], "NOT FOUND - CHECK ACCOUNT API TOKEN")
+    finished = t["updated_at"]
+    started = t["start_time"]
+    t["time_taken_seconds"] = finished - started
+    t["time_taken_minutes"] = (finished - started) / 60
+    t["time_taken_hours"] = (finished - started) / 3600
+    return dict((k, t[k]) for k in t.keys() if k not in FIELDS_TO_SKIP)
+
+
+def spool_tasks(tasks, spool, sites: dict, explorers: dict, templates: dict):
+    """Writes task rows to a temp file as JSON lines and returns {field: kind} in first-seen order.
+
+    The fields dict is the ordered set of every field any task had, so the
+    output can have one header for the union schema without keeping the rows
+    in memory. A field seen with more than one kind of value is TEXT.
+    """
+    fields = {}
+    count = 0
+    for t in tasks:
+        row = task_row(t, sites, explorers, templates)
+        for key, value in row.items():
+            if value is None:
+                fields.setdefault(key, None)
+                continue
+            kind = column_kind(value)
+            seen = fields.get(key)
+            if seen is None:
+                fields[key] = kind
+            elif seen != kind:
+                fields[key] = REAL if {seen, kind} == {INTEGER, REAL} else TEXT
+        spool.write(json.dumps(row).encode("utf-8") + b"\n")
+        count += 1
+    print(f"{count} tasks, {len(fields)} fields")
+    return fields
+
+
+def read_spool(spool):
+    spool.seek(0)
+    for line in spool:
+        yield json.loads(line)
+
+
+def write_csv(spool, fields: dict, filename: str):
+    file = open(filename, "w")
+    writer = csv.DictWriter(
+        file,
+        fieldnames=list(fields)
+    )
+    writer.writeheader()
+    for row in read_spool(spool):
+        writer.writerow(row)
+    file.close()
+
+
+def parquet_value(value, kind: str):
+    if value is None:
+        return None
+    if kind == JSON or isinstance(value, (list, dict)):
+        return json.dumps(value)
+    if kind == TEXT:
+        return str(value)
+    return value
+
+
+def write_parquet(spool, fields: dict, filename: str):
+    """Writes the spooled rows to Parquet one row group at a time, typed by the kinds seen."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("parquet output needs the pyarrow package - pip install pyarrow")
+
+    types = {INTEGER: pa.int64(), REAL: pa.float64(), BOOLEAN: pa.bool_(), TEXT: pa.string(), JSON: pa.string()}
+    # fields that were only ever null are written as strings
+    kinds = {name: kind or TEXT for name, kind in fields.items()}
+    schema = pa.schema([(name, types[kind]) for name, kind in kinds.items()])
+
+    def flush(batch):
+        columns = {
+            name: [parquet_value(row.get(name), kind) for row in batch]
+            for name, kind in kinds.items()
+        }
+        writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+
+    with pq.ParquetWriter(filename, schema) as writer:
+        batch = []
+        for row in read_spool(spool):
+            batch.append(row)
+            if len(batch) >= PARQUET_BATCH_SIZE:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
 
 
 def main():
-    fields = []
-    tasks = get_tasks()
-    sites = get_sites()
-    explorers = get_explorers()
-    templates = get_templates()
-    csv_out = []
-    if len(tasks) > 0:
-        for t in tasks:
-            t["explorer_name"] = explorers.get(t["agent_id"], "")
-            t["site_name"] = sites.get(t["site_id"], "")
-            t["template_name"] = templates.get(
-                t["template_id"], "NOT FOUND - CHECK ACCOUNT API TOKEN")
-            finished = t["updated_at"]
-            started = t["start_time"]
-            t["time_taken_seconds"] = finished - started
-            t["time_taken_minutes"] = (finished - started) / 60
-            t["time_taken_hours"] = (finished - started) / 3600
-            csv_out.append(dict((k, t[k])
-                           for k in t.keys() if k not in FIELDS_TO_SKIP))
-            for key in t.keys():
-                if key not in fields and key not in FIELDS_TO_SKIP:
-                    fields.append(key)
-
-    write_to_csv(
-        output=csv_out,
-        filename="tasks.csv",
-        fieldnames=fields)
+    args = parser.parse_args()
+    output = args.output or f"tasks.{args.format}"
+    sites, explorers, templates = get_names(refresh=args.refresh_names)
+
+    # rows go to a temp file while the union of their fields is found, then
+    # get written out in a second pass - memory stays flat however many tasks
+    with tempfile.TemporaryFile() as spool:
+        fields = spool_tasks(
+            get_tasks(args.search, workers=args.workers, page_size=args.page_size),
+            spool,
+            sites,
+            explorers,
+            templates,
+        )
+        if args.format == "parquet":
+            write_parquet(spool, fields, output)
+        else:
+            write_csv(spool, fields, output)
+
+    CLIENT.stats.print()
 
 
 if __name__ == "__main__":
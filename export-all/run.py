@@ -1,10 +1,71 @@
 import os
+import sys
+import json
+import time
+import argparse
+import importlib.util
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone, timedelta
 from dotenv import load_dotenv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.export import (
+    stream_assets,
+    stream_export_raw,
+    write_json_array,
+    write_jsonl_chunks,
+)
+from common.files import (
+    atomic_open,
+    compressed_writer,
+    HashingWriter,
+    COMPRESSION_SUFFIXES,
+)
+from common.http import RunZeroClient, STATS
+
 # load environment variables from .env file
 load_dotenv()
 
+# Command line args
+parser = argparse.ArgumentParser(
+    prog="Export All",
+    description="Exports assets for every organization in the account",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="how many organizations to export at the same time",
+)
+parser.add_argument(
+    "--output-dir", type=str, default="exports", help="where to write the exports"
+)
+parser.add_argument(
+    "--format",
+    choices=["json", "jsonl"],
+    default="json",
+    help="json writes one JSON array per org, jsonl copies the export to disk as-is without parsing it",
+)
+parser.add_argument(
+    "--compress",
+    choices=list(COMPRESSION_SUFFIXES),
+    default="none",
+    help="compress the exports on disk (zstd needs pip install zstandard)",
+)
+parser.add_argument(
+    "--resume",
+    action="store_true",
+    help="skip orgs the manifest says were exported within --max-age-hours",
+)
+parser.add_argument(
+    "--max-age-hours",
+    type=float,
+    default=24,
+    help="how old a completed export can be before --resume exports it again",
+)
+
 # RUNZERO_ACCOUNT_TOKEN should be an account-level API key with permission to list organizations
 RUNZERO_ACCOUNT_TOKEN = os.environ.get("RUNZERO_ACCOUNT_TOKEN")
 BASE_URL = "https://console.runzero.com/api/v1.0"
@@ -26,70 +87,236 @@ EXPORT_FIELDS = [
     "last_seen",
 ]
 
+# one pooled, retrying client per worker thread so connections get reused between orgs
+THREAD_LOCAL = threading.local()
+
+# checkpoint of what has been exported, written to <output-dir>/manifest.json
+MANIFEST_NAME = "manifest.json"
+MANIFEST_LOCK = threading.Lock()
+
+
+def get_client():
+    if not hasattr(THREAD_LOCAL, "client"):
+        THREAD_LOCAL.client = RunZeroClient(base_url=BASE_URL)
+    return THREAD_LOCAL.client
+
+
+def load_manifest(output_dir: str):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except ValueError:
+        print(f"warning: ignoring unreadable manifest {path}")
+        return {}
+
+
+def update_manifest(manifest: dict, output_dir: str, org_id: str, entry: dict):
+    """Records one org's result and rewrites the manifest atomically."""
+    with MANIFEST_LOCK:
+        manifest[org_id] = entry
+        path = os.path.join(output_dir, MANIFEST_NAME)
+        with atomic_open(path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def is_fresh(entry: dict, max_age: timedelta, suffix: str):
+    """True if the manifest entry is a completed export that is still on disk and young enough."""
+    if not entry or entry.get("status") != "ok":
+        return False
+    path = entry.get("path", "")
+    if not path.endswith(suffix):
+        # exported with a different --format/--compress
+        return False
+    if not os.path.exists(path) or os.path.getsize(path) != entry.get("bytes"):
+        return False
+    completed_at = datetime.fromisoformat(entry["completed_at"])
+    return datetime.now(timezone.utc) - completed_at < max_age
+
+
+def export_org(
+    org: dict,
+    output_dir: str,
+    manifest: dict,
+    output_format: str = "json",
+    compression: str = "none",
+):
+    """Exports a single org and returns a result dict for the summary.
+
+    Errors are caught and returned instead of raised so one bad org doesn't
+    stop the rest of the run. The export is written to a temp file and only
+    renamed into place once it is complete, then checkpointed in the manifest.
+    The body is streamed from the socket (gzip on the wire) through the
+    optional compressor to disk, so memory stays flat no matter the org size.
+    """
+    org_name = org.get("name")
+    export_token = org.get("export_token")
+    result = {"org": org_name, "status": "", "count": 0, "seconds": 0.0, "path": ""}
+    start = time.time()
+
+    if not export_token:
+        result["status"] = "skipped"
+        result["error"] = "export token not available in the API response"
+        return result
+
+    # Sanitize org_name for filename
+    safe_org_name = org_name.replace(" ", "_").replace("/", "_")
+    filename = f"{safe_org_name}_assets.{output_format}{COMPRESSION_SUFFIXES[compression]}"
+    output_path = os.path.join(output_dir, filename)
+
+    try:
+        export_kwargs = {
+            "fields": EXPORT_FIELDS,
+            "base_url": BASE_URL,
+            "session": get_client(),
+        }
+        with atomic_open(output_path, "wb") as f:
+            # hash what actually lands on disk so the manifest matches the file
+            writer = HashingWriter(f)
+            with compressed_writer(writer, compression) as out:
+                if output_format == "jsonl":
+                    chunks = stream_export_raw(export_token, "assets", **export_kwargs)
+                    result["count"] = write_jsonl_chunks(chunks, out)
+                else:
+                    assets = stream_assets(export_token, **export_kwargs)
+                    result["count"] = write_json_array(assets, out)
+        result["status"] = "ok"
+        result["path"] = output_path
+        result["bytes"] = writer.bytes
+        result["sha256"] = writer.hexdigest()
+    except requests.exceptions.HTTPError as e:
+        result["status"] = "failed"
+        result["error"] = f"HTTP error: {e}"
+        if e.response is not None and e.response.status_code == 401:
+            result["error"] += " - check the export token for this organization"
+    except requests.exceptions.RequestException as e:
+        result["status"] = "failed"
+        result["error"] = f"Request error: {e}"
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = f"An error occurred: {e}"
+
+    result["seconds"] = round(time.time() - start, 2)
+    entry = {
+        "name": org_name,
+        "status": result["status"],
+        "count": result["count"],
+        "path": result["path"],
+        "bytes": result.get("bytes", 0),
+        "sha256": result.get("sha256", ""),
+        "seconds": result["seconds"],
+        "completed_at": datetime.now(timezone.utc).isoformat(),
+    }
+    if result.get("error"):
+        entry["error"] = result["error"]
+    update_manifest(manifest, output_dir, org.get("id"), entry)
+    return result
+
+
+def print_summary(results: list, elapsed: float):
+    print("\nSummary")
+    for r in sorted(results, key=lambda x: x["seconds"], reverse=True):
+        line = f"  {r['status']:<8} {r['org']} - {r['count']} assets in {r['seconds']}s"
+        if r.get("error"):
+            line += f" ({r['error']})"
+        print(line)
+
+    ok = [r for r in results if r["status"] == "ok"]
+    failed = [r for r in results if r["status"] == "failed"]
+    skipped = [r for r in results if r["status"] == "skipped"]
+    resumed = [r for r in results if r["status"] == "resumed"]
+    total_assets = sum(r["count"] for r in ok)
+    print(
+        f"\nExported {total_assets} assets from {len(ok)} orgs in {round(elapsed, 2)}s "
+        f"({len(failed)} failed, {len(skipped)} skipped, {len(resumed)} resumed)"
+    )
+
+
 def main():
+    args = parser.parse_args()
+
     if not RUNZERO_ACCOUNT_TOKEN:
         print("error: RUNZERO_ACCOUNT_TOKEN environment variable not set.")
         print("Please set this to an Account-level API key.")
         return
 
+    if args.compress == "zstd" and importlib.util.find_spec("zstandard") is None:
+        print("error: --compress zstd needs the zstandard package - pip install zstandard")
+        return
+
     try:
         # Get all organizations
-        orgs_url = BASE_URL + "/account/orgs"
-        response = requests.get(orgs_url, headers=ACCOUNT_HEADERS)
+        response = get_client().get("/account/orgs", headers=ACCOUNT_HEADERS)
         response.raise_for_status()  # Raise an exception for bad status codes
         orgs = response.json()
-
-        print(f"Found {len(orgs)} organizations.")
-
-        # Loop through all organizations
-        for org in orgs:
-            org_name = org.get("name")
-            export_token = org.get("export_token")
-            
-            # Sanitize org_name for filename
-            safe_org_name = org_name.replace(" ", "_").replace("/", "_")
-
-            if not export_token:
-                print(f"Skipping org '{org_name}': Export token not available in the API response.")
-                print("  - Please ensure an export token is generated for this organization in the runZero console.")
-                continue
-
-            print(f"Exporting assets for org: {org_name}")
-
-            # Headers for org-level export
-            org_headers = {"Authorization": f"Bearer {export_token}"}
-            
-            # URL for exporting assets from the organization
-            export_url = BASE_URL + "/export/org/assets.json"
-            
-            params = {
-                "fields": ",".join(EXPORT_FIELDS)
-            }
-
-            # Export assets to csv
-            asset_response = requests.get(export_url, headers=org_headers, params=params)
-            asset_response.raise_for_status()
-
-            filename = f"{safe_org_name}_assets.json"
-            output_dir = "exports"
-            os.makedirs(output_dir, exist_ok=True)
-            output_path = os.path.join(output_dir, filename)
-
-            with open(output_path, "w", newline="", encoding="utf-8") as f:
-                f.write(asset_response.text)
-            
-            print(f"  - Assets exported to {output_path}")
-
     except requests.exceptions.HTTPError as e:
         print(f"HTTP error: {e}")
         if e.response.status_code == 401:
             print("Authentication failed. Please check your RUNZERO_ACCOUNT_TOKEN.")
         print(f"Response content: {e.response.text}")
+        return
     except requests.exceptions.RequestException as e:
         print(f"Request error: {e}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+        return
+
+    print(f"Found {len(orgs)} organizations.")
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest = load_manifest(args.output_dir)
+
+    results = []
+    if args.resume:
+        max_age = timedelta(hours=args.max_age_hours)
+        suffix = f"_assets.{args.format}{COMPRESSION_SUFFIXES[args.compress]}"
+        remaining = []
+        for org in orgs:
+            entry = manifest.get(org.get("id"))
+            if is_fresh(entry, max_age, suffix):
+                results.append(
+                    {
+                        "org": org.get("name"),
+                        "status": "resumed",
+                        "count": entry.get("count", 0),
+                        "seconds": 0.0,
+                        "path": entry.get("path"),
+                    }
+                )
+            else:
+                remaining.append(org)
+        print(
+            f"Resuming - {len(results)} orgs already exported in the last {args.max_age_hours} hours"
+        )
+        orgs_to_export = remaining
+    else:
+        orgs_to_export = orgs
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        future_map = {
+            executor.submit(
+                export_org, org, args.output_dir, manifest, args.format, args.compress
+            ): org.get("name")
+            for org in orgs_to_export
+        }
+
+        # as_completed yields futures as they finish
+        for future in as_completed(future_map):
+            result = future.result()
+            results.append(result)
+            progress = f"[{len(results)}/{len(orgs)}]"
+            if result["status"] == "ok":
+                print(
+                    f"{progress} {result['org']} - {result['count']} assets exported to {result['path']} in {result['seconds']}s"
+                )
+            elif result["status"] == "skipped":
+                print(f"{progress} Skipping org '{result['org']}': {result['error']}")
+            else:
+                print(f"{progress} FAILED - {result['org']}: {result['error']}")
+
+    print_summary(results, time.time() - start)
+    STATS.print()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,7 +1,12 @@
 import requests
 import os
+import sys
 import time
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.export import stream_export
+from common.search import LocalInventory, UnsupportedSearch, search_fields
+
 RUNZERO_EXPORT_TOKEN = os.environ["RUNZERO_EXPORT_TOKEN"]
 HEADERS = {"Authorization": f"Bearer {RUNZERO_EXPORT_TOKEN}"}
 BASE_URL = "https://console.runZero.com/api/v1.0"
@@ -32,17 +37,41 @@ def handle_search(search, type):
     url = BASE_URL + "/export/org/assets.json" if type == "assets" else BASE_URL + "/export/org/services.json"
     data = requests.get(url, headers=HEADERS, params={"search": "alive:t " + search, "fields": "id"})
     return data
+
+
+def load_inventories():
+    """Downloads one snapshot of the live assets/services per type, with just the fields the searches need."""
+    inventories = {}
+    for type in sorted({s["type"] for s in SEARCHES}):
+        searches = [s[k] for s in SEARCHES if s["type"] == type for k in ("search", "denominator")]
+        try:
+            fields = search_fields(*searches)
+        except UnsupportedSearch:
+            fields = "id"
+        records = stream_export(
+            RUNZERO_EXPORT_TOKEN, type, search="alive:t", fields=fields, base_url=BASE_URL
+        )
+        inventories[type] = LocalInventory(records)
+    return inventories
+
+
+def find_ids(inventory, search, type):
+    """Ids matching the search, evaluated locally when possible and through the API otherwise."""
+    try:
+        return [r["id"] for r in inventory.select(search)]
+    except UnsupportedSearch as e:
+        print(f"{search} - using the API instead ({e})")
+        return [r["id"] for r in handle_search(search=search, type=type).json()]
+
+
 def main():
+    inventories = load_inventories()
 
     for search in SEARCHES:
-        search_data = handle_search(search=search["search"], type=search["type"])
-        search_count = len(search_data.json())
-        asset_ids = []
-        for id in search_data.json():
-            asset_ids.append(id["id"])
-
-        denominator_data = handle_search(search=search["denominator"], type=search["type"])
-        denominator_count = len(denominator_data.json())
+        inventory = inventories[search["type"]]
+        asset_ids = find_ids(inventory, search["search"], search["type"])
+        search_count = len(asset_ids)
+        denominator_count = len(find_ids(inventory, search["denominator"], search["type"]))
 
         percentage = round((search_count / denominator_count) * 100)
 
@@ -1,8 +1,12 @@
 import requests
 import os
+import sys
 import json
 import csv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.cache import cached_export
+
 RUNZERO_EXPORT_TOKEN = os.environ["RUNZERO_EXPORT_TOKEN"]
 HEADERS = {"Authorization": f"Bearer {RUNZERO_EXPORT_TOKEN}"}
 BASE_URL = "https://console.runZero.com/api/v1.0"
@@ -16,70 +20,76 @@ def get_vulns(sites: list):
     for site in sites:
         safe_site = site.get("name").replace(" ", "_").lower()
         site_id = site.get("id")
-        url = BASE_URL + "/export/org/vulnerabilities.json?"
-        data = requests.get(url, headers=HEADERS, params={"search": f"source:runzero site:{site_id} (risk:high or risk:critical)"})
-        vulns = data.json()
-        if len(vulns) > 0:
-            output = []
-            fields = [
-                "site_name",
-                "vulnerability_risk_rank",
-                "vulnerability_id",
-                "vulnerability_asset_id",
-                "vulnerability_created_at",
-                "vulnerability_updated_at",
-                "vulnerability_service_address",
-                "vulnerability_service_transport",
-                "vulnerability_service_port",
-                "vulnerability_cpe23",
-                "vulnerability_vuln_id",
-                "vulnerability_category",
-                "vulnerability_name",
-                "vulnerability_description",
-                "vulnerability_solution",
-                "alive",
-                "type",
-                "os_vendor",
-                "os_product",
-                "os_version",
-                "os",
-                "hw_vendor",
-                "hw_product",
-                "hw_version",
-                "hw",
-                "addresses",
-                "addresses_extra",
-                "macs",
-                "names",
-                "owners",
-            ]
+        vulns = cached_export(
+            None,
+            RUNZERO_EXPORT_TOKEN,
+            "vulnerabilities",
+            search=f"source:runzero site:{site_id} (risk:high or risk:critical)",
+            base_url=BASE_URL,
+        )
+        fname = f"{safe_site}.csv"
+        tls_csv = None
+        count = 0
+        fields = [
+            "site_name",
+            "vulnerability_risk_rank",
+            "vulnerability_id",
+            "vulnerability_asset_id",
+            "vulnerability_created_at",
+            "vulnerability_updated_at",
+            "vulnerability_service_address",
+            "vulnerability_service_transport",
+            "vulnerability_service_port",
+            "vulnerability_cpe23",
+            "vulnerability_vuln_id",
+            "vulnerability_category",
+            "vulnerability_name",
+            "vulnerability_description",
+            "vulnerability_solution",
+            "alive",
+            "type",
+            "os_vendor",
+            "os_product",
+            "os_version",
+            "os",
+            "hw_vendor",
+            "hw_product",
+            "hw_version",
+            "hw",
+            "addresses",
+            "addresses_extra",
+            "macs",
+            "names",
+            "owners",
+        ]
 
-            for v in vulns:
-                # normalize the risk rank
-                vuln_risk_map = {
-                    3: "High",
-                    4: "Critical",
-                }
-                v["vulnerability_risk_rank"] = vuln_risk_map.get(
-                    v.get("risk_rank", 0), "Unknown"
-                )
+        # write rows as they stream in so large sites never sit in memory
+        for v in vulns:
+            # normalize the risk rank
+            vuln_risk_map = {
+                3: "High",
+                4: "Critical",
+            }
+            v["vulnerability_risk_rank"] = vuln_risk_map.get(
+                v.get("risk_rank", 0), "Unknown"
+            )
 
-                # create CSV row
-                vuln_row = {}
-                for field in fields:
-                    vuln_row[field] = v.get(field, "")
+            # create CSV row
+            vuln_row = {}
+            for field in fields:
+                vuln_row[field] = v.get(field, "")
 
-                # add row to output
-                output.append(vuln_row)
+            # add row to output
+            if tls_csv is None:
+                tls_csv = open(fname, "w")
+                writer = csv.DictWriter(tls_csv, fieldnames=fields)
+                writer.writeheader()
+            writer.writerow(vuln_row)
+            count += 1
 
-            fname = f"{safe_site}.csv"
-            tls_csv = open(fname, "w")
-            writer = csv.DictWriter(tls_csv, fieldnames=fields)
-            writer.writeheader()
-            writer.writerows(output)
+        if tls_csv is not None:
             tls_csv.close()
-
-            print(f"Successfully loaded the data to {fname}")
+            print(f"Successfully loaded {count} vulnerabilities to {fname}")
         else:
             print(f"No vulnerabilities found for {site.get('name')}")
 
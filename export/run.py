@@ -1,8 +1,10 @@
-import requests
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.export import count_export
 
 RUNZERO_EXPORT_TOKEN = os.environ["RUNZERO_EXPORT_TOKEN"]
-HEADERS = {"Authorization": f"Bearer {RUNZERO_EXPORT_TOKEN}"}
 BASE_URL = "https://console.runZero.com/api/v1.0"
 
 MAC = "A0:5C:D5:E7:C1:11"
@@ -11,28 +13,25 @@ NAME = "TYLERS-PHONE"
 SEARCH = "alive:t"
 
 
-def main():
-    url = BASE_URL + "/export/org/assets.json"
+def count(search: str):
+    return count_export(RUNZERO_EXPORT_TOKEN, "assets", search=search, base_url=BASE_URL)
 
-    everything = requests.get(url, headers=HEADERS, params={
-        "search": "alive:t"})
-    print(f"Found {len(everything.json())} total assets alive")
 
-    mac_results = requests.get(url, headers=HEADERS, params={
-        "search": f"alive:t mac:{MAC}"})
-    print(f"Found {len(mac_results.json())} assets with the MAC address {MAC}")
+def main():
+    everything = count("alive:t")
+    print(f"Found {everything} total assets alive")
+
+    mac_results = count(f"alive:t mac:{MAC}")
+    print(f"Found {mac_results} assets with the MAC address {MAC}")
 
-    ip_results = requests.get(url, headers=HEADERS, params={
-        "search": f"alive:t address:{IP}"})
-    print(f"Found {len(ip_results.json())} assets with the IP address {IP}")
+    ip_results = count(f"alive:t address:{IP}")
+    print(f"Found {ip_results} assets with the IP address {IP}")
 
-    name_results = requests.get(url, headers=HEADERS, params={
-        "search": f"alive:t name:{NAME}"})
-    print(f"Found {len(name_results.json())} assets with the name {NAME}")
+    name_results = count(f"alive:t name:{NAME}")
+    print(f"Found {name_results} assets with the name {NAME}")
 
-    search_results = requests.get(url, headers=HEADERS, params={
-        "search": SEARCH})
-    print(f"Found {len(search_results.json())} assets with the search {SEARCH}")
+    search_results = count(SEARCH)
+    print(f"Found {search_results} assets with the search {SEARCH}")
 
 
 if __name__ == "__main__":
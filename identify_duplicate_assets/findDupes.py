@@ -3,16 +3,24 @@
 """ EXAMPLE PYTHON SCRIPT! NOT INTENDED FOR PRODUCTION USE! 
     findDupes.py, version 1.2 by Derek Burke
     Query runZero API for all assets found within an Organization (tied to Export API key provided) and sort out assets with
-    same MAC, Hostname, and IP but different asset ID. Optionally, an output file format can be specified to write to."""
+    same MAC, Hostname, or IP but different asset ID, grouped into clusters. Optionally, an output file format can be specified to write to."""
 
+import hashlib
 import json
+import os
 import re
-import requests
+import sqlite3
 import sys
+import time
+from array import array
 from datetime import datetime
 from getpass import getpass
 from requests.exceptions import ConnectionError
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.export import read_export_file, stream_assets
+from common.hostnames import normalize_hostname, similar_hostnames
+
 def usage():
     """ Display usage and switches. """
     print(""" Usage:
@@ -28,12 +36,23 @@ def usage():
                                             If used in conjunction with config will take precedence over config value.
                     -c <config file/path>   Filename of config file including absolute path.
                     -o <text| json | all>   Output file format for report. JSON is default.
+                    -f <export file>        Read assets from a saved export (.json, .jsonl, optionally .gz)
+                                            instead of the API. Can be given more than once.
+                    -d <index file>         Build the identifier index in this SQLite file instead of in
+                                            memory, for exports too large to hold at once. Rerunning with
+                                            the same file resumes an interrupted load, and loading exports
+                                            from several orgs into one file finds duplicates across them.
+                    -s <similarity>         Also report near-duplicate hostnames (e.g. tyler-mac and tylers-mac)
+                                            whose similarity is at least this value, between 0 and 1, as
+                                            scored candidate pairs listed after the clusters.
                     -g                      Generate config file template.
                     -h                      Show this help dialogue
                     
                 Examples:
                     findDupes.py -c example.config
                     findDupes.py -c example.config -o json
+                    findDupes.py -d dupes.db -f org1_assets.jsonl.gz -f org2_assets.json -o json
+                    findDupes.py -c example.config -s 0.6
                     python3 -m findDupes -u https://custom.runzero.com -t 1week""")
 
 def genConfig():
@@ -69,90 +88,448 @@ def getAssets(uri, token, filter=" ", fields=" "):
         :param token: A string, Export API Key.
         :param filter: A string, query to filter returned assets(" " returns all).
         :param fields: A string, comma separated string of fields to return(" " returns all).
-        :returns: a dict, JSON object of assets.
+        :returns: a generator, assets streamed one at a time from the JSONL export.
         :raises: ConnectionError: if unable to successfully make GET request to console."""
 
-    uri = uri + "/api/v1.0/export/org/assets.json?"
-    params = {'search': filter,
-              'fields': fields}
-    payload = ''
-    headers = {'Accept': 'application/json',
-               'Authorization': 'Bearer %s' % token}
     try:
-        response = requests.get(uri, headers=headers, params=params, data=payload)
-        content = response.content
-        data = json.loads(content)
-        return data
+        return stream_assets(token, search=filter, fields=fields, base_url=uri + "/api/v1.0")
     except ConnectionError as error:
-        content = "No Response"
         raise error
     
-def findDupes(data):
-    """ Parse runZero asset data (JSON) to find potential duplicates. 
-    
-        :param data: a dict, JSON formatted runZero asset data.
-        :raises: KeyError: if key:value pair not present in asset data. """
-    #Create list of assets(dicts) with unique IDs
+#Asset fields used to tie assets together, and how they are labelled in the report
+MATCH_FIELDS = {'macs': 'MAC', 'addresses': 'IP address', 'names': 'Hostname'}
+#Label for hostnames that are close but not equal (only with -s); also stored as ints in the on-disk index
+MATCH_LABELS = list(MATCH_FIELDS.values()) + ['Similar hostname']
+
+class UnionFind:
+    """ Disjoint sets of asset IDs, with path halving and union by size so every
+        operation is close to constant time. """
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def find(self, x):
+        """ Return the representative ID for x's set, adding x if it's new. """
+        parent = self.parent
+        if x not in parent:
+            parent[x] = x
+            self.size[x] = 1
+            return x
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a, b):
+        """ Merge the sets holding a and b. """
+        rootA = self.find(a)
+        rootB = self.find(b)
+        if rootA == rootB:
+            return rootA
+        if self.size[rootA] < self.size[rootB]:
+            rootA, rootB = rootB, rootA
+        self.parent[rootB] = rootA
+        self.size[rootA] += self.size[rootB]
+        return rootA
+
+def identifierKeys(asset):
+    """ Yield (label, value) for every identifier on an asset that can tie it to another asset.
+
+        :param asset: a dict, runZero asset.
+        :returns: a generator, (label, normalized value) tuples. """
+    for field, label in MATCH_FIELDS.items():
+        for value in asset.get(field) or []:
+            if not value:
+                continue
+            if label == 'Hostname':
+                #short name without the domain, so HOST and host.corp.example match
+                value = normalize_hostname(value)
+                if value:
+                    yield (label, value)
+            else:
+                yield (label, value.lower() if label != 'IP address' else value)
+
+def similarIdentifier(nameA, nameB, score, ids):
+    """ The shared identifier entry for a pair of near-duplicate hostnames. """
+    return {'type': 'Similar hostname', 'value': nameA + ' ~ ' + nameB, 'score': score, 'asset_ids': ids}
+
+def buildClusters(assets, index, groups, links=()):
+    """ Turn union-find groups and the identifier index into report entries.
+
+        A similar hostname link whose assets are already one cluster is listed with
+        that cluster's identifiers; any other link becomes a candidate entry of its
+        own, after the clusters, so near-duplicate names never merge clusters.
+
+        :param assets: a dict, asset ID to asset.
+        :param index: a dict, (label, value) to the list of asset IDs that have it.
+        :param groups: a UnionFind, the merged asset IDs.
+        :param links: a list, (nameA, nameB, score, asset IDs) from matchSimilarHostnames.
+        :returns: a list, one dict per cluster of two or more assets, largest first, then candidates. """
+    members = {}
+    for uid in assets:
+        root = groups.find(uid)
+        if groups.size[root] > 1:
+            members.setdefault(root, []).append(uid)
+    shared = {}
+    for (label, value), ids in index.items():
+        if len(ids) > 1:
+            shared.setdefault(groups.find(ids[0]), []).append(
+                {'type': label, 'value': value, 'asset_ids': ids})
+    candidates = []
+    for nameA, nameB, score, ids in links:
+        root = groups.find(ids[0])
+        if all(groups.find(uid) == root for uid in ids):
+            shared.setdefault(root, []).append(similarIdentifier(nameA, nameB, score, ids))
+        else:
+            candidates.append(similarIdentifier(nameA, nameB, score, ids))
+    clusters = []
+    for root, ids in members.items():
+        identifiers = shared.get(root, [])
+        counts = {label: 0 for label in MATCH_LABELS}
+        for identifier in identifiers:
+            counts[identifier['type']] += 1
+        clusters.append({'cluster': 0,
+                         'asset_count': len(ids),
+                         'match_counts': counts,
+                         'shared_identifiers': identifiers,
+                         'assets': [assets[uid] for uid in ids]})
+    clusters.sort(key=lambda c: c['asset_count'], reverse=True)
+    candidates.sort(key=lambda identifier: identifier['score'], reverse=True)
+    for identifier in candidates:
+        counts = {label: 0 for label in MATCH_LABELS}
+        counts['Similar hostname'] = 1
+        clusters.append({'cluster': 0,
+                         'asset_count': len(identifier['asset_ids']),
+                         'match_counts': counts,
+                         'shared_identifiers': [identifier],
+                         'assets': [assets[uid] for uid in identifier['asset_ids']]})
+    for number, cluster in enumerate(clusters, 1):
+        cluster['cluster'] = number
+    return clusters
+
+def matchSimilarHostnames(index, similarity):
+    """ Find the hostnames that are near duplicates, without merging their assets.
+
+        Similarity isn't transitive - merging every pair would chain server-001 to
+        server-002 to server-003 into one cluster - so each pair is kept as a link
+        of its own with its score.
+
+        :param index: a dict, (label, value) to the list of asset IDs that have it.
+        :param similarity: a float, minimum n-gram similarity (0-1) for two hostnames to match.
+        :returns: a list, (nameA, nameB, score, asset IDs) for pairs that span two or more assets. """
+    names = [value for label, value in index if label == 'Hostname']
+    links = []
+    for nameA, nameB, score in similar_hostnames(names, threshold=similarity):
+        idsA = index[('Hostname', nameA)]
+        idsB = index[('Hostname', nameB)]
+        ids = idsA + [uid for uid in idsB if uid not in idsA]
+        if len(ids) > 1:
+            links.append((nameA, nameB, score, ids))
+    return links
+
+def findDupes(data, similarity=None):
+    """ Parse runZero asset data (JSON) to find clusters of potential duplicates.
+
+        Every MAC, IP address and hostname is indexed to the assets that have it,
+        and assets sharing any of them are merged with union-find, so chains of
+        matches (A shares a MAC with B, B shares a hostname with C) end up in one
+        cluster. Runs in roughly linear time in the number of identifiers.
+        Hostnames are compared without their domain. With similarity set, near
+        duplicate hostnames are found too, using MinHash blocking, and reported with
+        their score as candidate links rather than merged into the clusters.
+
+        :param data: an iterable, runZero asset data (a list or the getAssets stream).
+        :param similarity: a float, minimum hostname similarity (0-1) to match on, or None for exact only.
+        :returns: a list, clusters with their assets and the identifiers that tie them together.
+        :raises: KeyError: if an asset has no id. """
+    assets = {}
+    index = {}
+    groups = UnionFind()
     try:
-        uniqIDs = []
         for item in data:
-            count = 0
-            for asset in uniqIDs:
-                if item['id'] == asset['id']:
-                    count += 1
-            if count == 0: 
-                uniqIDs.append(item)
+            uid = item['id']
+            #Skip repeated IDs in the export
+            if uid in assets:
+                continue
+            assets[uid] = item
+            groups.find(uid)
+            for key in identifierKeys(item):
+                ids = index.get(key)
+                if ids is None:
+                    index[key] = [uid]
+                else:
+                    if ids[-1] != uid:
+                        ids.append(uid)
+                        groups.union(ids[0], uid)
     except KeyError as error:
         raise error
-    #Loop through unique IDs and identify assets that identical MACs, Hostnames, and/or IPs
-    #Add these assets with duplicate fields to list
-    possblDups = []
+    links = matchSimilarHostnames(index, similarity) if similarity else []
+    clusters = buildClusters(assets, index, groups, links)
+    if len(clusters) > 0:
+        return clusters
+    else:
+        return({"Msg": "No potential duplicate assets found."})
+
+#Assets written to the on-disk index per transaction; progress is saved at the end of each one
+BATCH_SIZE = 5000
+
+def openIndex(path):
+    """ Open (or create) the on-disk identifier index used for exports too large for memory.
+
+        :param path: a string, SQLite file to keep the index in.
+        :returns: a sqlite3.Connection, in autocommit mode so transactions are explicit. """
+    db = sqlite3.connect(path, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, records INTEGER NOT NULL, done INTEGER NOT NULL)")
+    db.execute("CREATE TABLE IF NOT EXISTS assets (num INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, data TEXT NOT NULL)")
+    db.execute("CREATE TABLE IF NOT EXISTS identifiers (kind INTEGER, value TEXT, asset INTEGER, PRIMARY KEY (kind, value, asset)) WITHOUT ROWID")
+    return db
+
+def peakRSS():
+    """ Peak resident memory of this process in MB, or None where the resource module isn't available. """
     try:
-        for asset in uniqIDs:
-            uid = asset['id']
-            macs = asset['macs']
-            addresses = asset['addresses']
-            hostnames = asset['names']
-            for others in uniqIDs:
-                #So asset doesn't match itself as a duplicate
-                if uid == others['id']:
-                    pass
-                else:
-                    macMatch = False
-                    addrMatch = False
-                    nameMatch = False
-                    matchedMACs = []
-                    matchedAddresses = []
-                    matchedHostnames = []  
-                    for mac in others['macs']:
-                        if mac in macs:
-                            macMatch = True
-                            matchedMACs.append(mac)
-                    for addr in others['addresses']:
-                        if addr in addresses:
-                            addMatch = True
-                            matchedAddresses.append(addr)
-                    for name in others['names']:
-                        if name in hostnames:
-                            nameMatch = True
-                            matchedHostnames.append(name)
-                    if macMatch or addrMatch or nameMatch:
-                        asset['possible_dupe'] = {'id': others['id'], 'os': others['os'], 'hw': others['hw']}
-                        asset['shared_fields'] = {'MAC': macMatch,
-                                                  'matched_MACs': matchedMACs,  
-                                                  'IP address': addrMatch, 
-                                                  'matched_Addresses': matchedAddresses, 
-                                                  'Hostname': nameMatch, 
-                                                  'matched_Hostnames': matchedHostnames, 
-                                                  'site': others['site_id']}
-                        possblDups.append(asset)
-        if len(possblDups) > 0:
-            return possblDups
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #bytes on macOS, KB everywhere else
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def progress(message):
+    """ Print a progress line to stderr so it doesn't mix with a report printed to stdout. """
+    rss = peakRSS()
+    print(message + ("" if rss is None else ", peak RSS %.0f MB" % rss), file=sys.stderr)
+
+def indexAssets(db, source, assets, skipped=0):
+    """ Stream assets into the on-disk index, committing every BATCH_SIZE assets.
+
+        Each commit also records how many records of the source have been read, so
+        an interrupted load can pick up from the last commit. Asset IDs already in
+        the index are ignored, which makes reloading a source harmless.
+
+        :param db: a sqlite3.Connection, from openIndex.
+        :param source: a string, name the source's progress is saved under.
+        :param assets: an iterable, runZero assets (already past the first skipped records).
+        :param skipped: an int, records of the source read by an earlier run.
+        :returns: an int, the number of new assets added.
+        :raises: KeyError: if an asset has no id. """
+    added = 0
+    read = skipped
+    started = time.time()
+    cursor = db.cursor()
+    rows = []
+
+    def commit(done):
+        cursor.executemany("INSERT OR IGNORE INTO identifiers VALUES (?, ?, ?)", rows)
+        cursor.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?)", (source, read, done))
+        cursor.execute("COMMIT")
+        rows.clear()
+        elapsed = time.time() - started
+        progress("%s: %d records read, %d new assets (%.0f assets/s)" % (
+            source, read, added, (read - skipped) / elapsed if elapsed else 0))
+
+    cursor.execute("BEGIN")
+    for item in assets:
+        cursor.execute("INSERT OR IGNORE INTO assets (id, data) VALUES (?, ?)", (item['id'], json.dumps(item)))
+        read += 1
+        if cursor.rowcount == 1:
+            added += 1
+            num = cursor.lastrowid
+            for label, value in identifierKeys(item):
+                rows.append((MATCH_LABELS.index(label), value, num))
+        if read % BATCH_SIZE == 0:
+            commit(0)
+            cursor.execute("BEGIN")
+    commit(1)
+    return added
+
+def loadSource(db, source, assets, resumable=False):
+    """ Load a source into the on-disk index unless an earlier run already finished it.
+
+        :param db: a sqlite3.Connection, from openIndex.
+        :param source: a string, name the source's progress is saved under.
+        :param assets: a function, called with the number of records to skip and returning an asset iterable.
+        :param resumable: a bool, True if the source returns records in the same order every time,
+                          so records read by an earlier run can be skipped instead of reloaded.
+        :returns: an int, the number of new assets added. """
+    row = db.execute("SELECT records, done FROM sources WHERE source = ?", (source,)).fetchone()
+    if row and row[1]:
+        progress("%s: already loaded (%d records), skipping" % (source, row[0]))
+        return 0
+    skipped = row[0] if row and resumable else 0
+    if skipped:
+        progress("%s: resuming after %d records" % (source, skipped))
+    return indexAssets(db, source, assets(skipped), skipped)
+
+class CompactUnionFind:
+    """ UnionFind over the integers 0..n-1, kept in two flat arrays (8 bytes per asset)
+        rather than dicts, so millions of assets fit comfortably in memory. """
+
+    def __init__(self, n):
+        self.parent = array('I', range(n))
+        self.size = array('I', [1]) * n
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a, b):
+        rootA = self.find(a)
+        rootB = self.find(b)
+        if rootA == rootB:
+            return rootA
+        if self.size[rootA] < self.size[rootB]:
+            rootA, rootB = rootB, rootA
+        self.parent[rootB] = rootA
+        self.size[rootA] += self.size[rootB]
+        return rootA
+
+def identifierGroups(db):
+    """ Yield (kind, value, [asset numbers]) for every identifier shared by two or more assets.
+
+        Rows come back in primary key order, so each identifier's assets are next to
+        each other and only one group is held at a time. """
+    group = None
+    members = []
+    for kind, value, num in db.execute("SELECT kind, value, asset FROM identifiers ORDER BY kind, value, asset"):
+        if (kind, value) != group:
+            if len(members) > 1:
+                yield group[0], group[1], members
+            group = (kind, value)
+            members = []
+        members.append(num)
+    if len(members) > 1:
+        yield group[0], group[1], members
+
+def clusterIndex(db, similarity=None):
+    """ Merge the assets in the on-disk index into clusters and save them back to it.
+
+        Only the union-find arrays are held in memory; the identifiers are streamed
+        out of SQLite twice (once to merge, once to record which cluster each shared
+        identifier belongs to) and the cluster membership is written to the members
+        and shared tables, which are rebuilt on every run. With similarity set the
+        distinct hostnames are also loaded (one string per name) for MinHash matching;
+        similar pairs don't merge clusters, they are added to the cluster they are
+        already in or saved to the candidates table, as buildClusters does.
+
+        :param db: a sqlite3.Connection, from openIndex.
+        :param similarity: a float, minimum hostname similarity (0-1) to match on, or None for exact only.
+        :returns: an int, the number of clusters of two or more assets plus candidate links. """
+    started = time.time()
+    count = db.execute("SELECT COALESCE(MAX(num), 0) FROM assets").fetchone()[0] + 1
+    groups = CompactUnionFind(count)
+    for kind, value, members in identifierGroups(db):
+        first = members[0]
+        for num in members[1:]:
+            groups.union(first, num)
+    hostname = MATCH_LABELS.index('Hostname')
+    similar = []
+    if similarity:
+        firsts = dict(db.execute("SELECT value, MIN(asset) FROM identifiers WHERE kind = ? GROUP BY value", (hostname,)))
+        similar = similar_hostnames(firsts, threshold=similarity)
+
+    cursor = db.cursor()
+    cursor.execute("BEGIN")
+    cursor.execute("DROP TABLE IF EXISTS members")
+    cursor.execute("DROP TABLE IF EXISTS shared")
+    cursor.execute("DROP TABLE IF EXISTS candidates")
+    cursor.execute("CREATE TABLE members (root INTEGER, asset INTEGER, PRIMARY KEY (root, asset)) WITHOUT ROWID")
+    cursor.execute("CREATE TABLE shared (root INTEGER, kind INTEGER, value TEXT, assets TEXT, score REAL)")
+    cursor.execute("CREATE TABLE candidates (value TEXT, score REAL, assets TEXT)")
+    cursor.executemany("INSERT INTO shared VALUES (?, ?, ?, ?, NULL)",
+                       ((groups.find(members[0]), kind, value, json.dumps(members))
+                        for kind, value, members in identifierGroups(db)))
+    candidates = 0
+    for nameA, nameB, score in similar:
+        members = [num for (num,) in db.execute(
+            "SELECT DISTINCT asset FROM identifiers WHERE kind = ? AND value IN (?, ?) ORDER BY asset", (hostname, nameA, nameB))]
+        if len(members) < 2:
+            continue
+        root = groups.find(members[0])
+        if all(groups.find(num) == root for num in members):
+            cursor.execute("INSERT INTO shared VALUES (?, ?, ?, ?, ?)", (root, MATCH_LABELS.index('Similar hostname'),
+                                                                        nameA + ' ~ ' + nameB, json.dumps(members), score))
         else:
-            return({"Msg": "No potential duplicate assets found."})
-    except KeyError as error:
-        raise error
-    
+            cursor.execute("INSERT INTO candidates VALUES (?, ?, ?)", (nameA + ' ~ ' + nameB, score, json.dumps(members)))
+            candidates += 1
+    cursor.execute("CREATE INDEX shared_root ON shared (root)")
+    size = groups.size
+    clustered = ((root, num) for num, root in
+                 ((num, groups.find(num)) for num in range(1, count)) if size[root] > 1)
+    cursor.executemany("INSERT INTO members VALUES (?, ?)", clustered)
+    cursor.execute("COMMIT")
+    clusters = db.execute("SELECT COUNT(DISTINCT root) FROM members").fetchone()[0]
+    progress("clustered %d assets into %d clusters (%d similar hostname candidates) in %.1f s"
+             % (count - 1, clusters, candidates, time.time() - started))
+    return clusters + candidates
+
+def iterClusters(db):
+    """ Yield the clusters saved by clusterIndex, largest first, then the similar hostname
+        candidates, in the same format findDupes returns.
+
+        :param db: a sqlite3.Connection, from openIndex.
+        :returns: a generator, one cluster dict at a time. """
+    roots = db.execute("SELECT root, COUNT(*) AS n FROM members GROUP BY root ORDER BY n DESC, root")
+    number = 0
+    for number, (root, size) in enumerate(roots, 1):
+        ids = {}
+        clusterAssets = []
+        for num, uid, data in db.execute(
+                "SELECT a.num, a.id, a.data FROM members m JOIN assets a ON a.num = m.asset WHERE m.root = ?", (root,)):
+            ids[num] = uid
+            clusterAssets.append(json.loads(data))
+        counts = {label: 0 for label in MATCH_LABELS}
+        identifiers = []
+        for kind, value, members, score in db.execute("SELECT kind, value, assets, score FROM shared WHERE root = ?", (root,)):
+            counts[MATCH_LABELS[kind]] += 1
+            identifier = {'type': MATCH_LABELS[kind], 'value': value,
+                          'asset_ids': [ids[num] for num in json.loads(members)]}
+            if score is not None:
+                identifier = similarIdentifier(*value.split(' ~ ', 1), score, identifier['asset_ids'])
+            identifiers.append(identifier)
+        yield {'cluster': number,
+               'asset_count': size,
+               'match_counts': counts,
+               'shared_identifiers': identifiers,
+               'assets': clusterAssets}
+    candidates = db.execute("SELECT value, score, assets FROM candidates ORDER BY score DESC, value")
+    for number, (value, score, members) in enumerate(candidates, number + 1):
+        nums = json.loads(members)
+        rows = {num: (uid, data) for num, uid, data in db.execute(
+            "SELECT num, id, data FROM assets WHERE num IN (%s)" % ",".join("?" * len(nums)), nums)}
+        counts = {label: 0 for label in MATCH_LABELS}
+        counts['Similar hostname'] = 1
+        yield {'cluster': number,
+               'asset_count': len(nums),
+               'match_counts': counts,
+               'shared_identifiers': [similarIdentifier(*value.split(' ~ ', 1), score, [rows[num][0] for num in nums])],
+               'assets': [json.loads(rows[num][1]) for num in nums]}
+
+def writeClusters(clusters, f, text=False):
+    """ Write clusters to an open file one at a time, as a JSON array or one line per cluster.
+
+        :param clusters: an iterable, cluster dicts from iterClusters.
+        :param f: a file, opened for writing text.
+        :param text: a bool, True for one str(cluster) line each instead of JSON.
+        :returns: an int, the number of clusters written. """
+    count = 0
+    if not text:
+        f.write("[")
+    for cluster in clusters:
+        if text:
+            f.write(str(cluster) + "\n")
+        else:
+            f.write((",\n" if count else "\n") + json.dumps(cluster, indent=4))
+        count += 1
+    if not text:
+        f.write("\n]\n" if count else "]\n")
+    return count
+
 def writeFile(fileName, contents):
     """ Write contents to output file in plaintext. 
     
@@ -191,7 +568,25 @@ if __name__ == "__main__":
             print("Config file switch used but no file provided!\n")
             usage()
             exit()
-    else:
+    #Saved exports to read instead of querying the console
+    exportFiles = [sys.argv[i + 1] for i, arg in enumerate(sys.argv[:-1]) if arg == "-f"]
+    indexFile = None
+    if "-d" in sys.argv:
+        try:
+            indexFile = sys.argv[sys.argv.index("-d") + 1]
+        except IndexError:
+            print("Index file switch used but no file provided!\n")
+            usage()
+            exit()
+    similarity = None
+    if "-s" in sys.argv:
+        try:
+            similarity = float(sys.argv[sys.argv.index("-s") + 1])
+        except (IndexError, ValueError):
+            print("Similarity switch used but no number between 0 and 1 provided!\n")
+            usage()
+            exit()
+    if not config and not exportFiles:
         print("Enter your Export API Key: ")
         token = getpass()
     if "-u" in sys.argv and not config:
@@ -209,8 +604,39 @@ if __name__ == "__main__":
             usage()
             exit()
     fields = "id, os, hw, addresses, macs, names, alive, site_id" #fields to return in API call; modify for more or less
-    assets = getAssets(consoleURL, token, 'first_seen:<' + timeRange, fields)
-    dupes = findDupes(assets)
+    query = 'first_seen:<' + timeRange
+    output = sys.argv[sys.argv.index("-o") + 1].lower() if "-o" in sys.argv[:-1] else None
+    if indexFile:
+        started = time.time()
+        db = openIndex(indexFile)
+        if exportFiles:
+            for path in exportFiles:
+                loadSource(db, os.path.abspath(path), lambda skip, path=path: read_export_file(path, skip), resumable=True)
+        else:
+            #keyed by console, token and query so loading several orgs into one index keeps them apart
+            source = "%s %s %s" % (consoleURL, hashlib.sha1(token.encode()).hexdigest()[:8], query)
+            loadSource(db, source, lambda skip: getAssets(consoleURL, token, query, fields))
+        total = db.execute("SELECT COUNT(*) FROM assets").fetchone()[0]
+        if clusterIndex(db, similarity):
+            if output in ('text', 'txt', 'all'):
+                with open(fileName + '.txt', 'w') as o:
+                    writeClusters(iterClusters(db), o, text=True)
+            if output is not None and output not in ('text', 'txt'):
+                with open(fileName + '.json', 'w') as o:
+                    writeClusters(iterClusters(db), o)
+            if output is None:
+                writeClusters(iterClusters(db), sys.stdout)
+            progress("done: %d assets in the index, finished in %.1f s" % (total, time.time() - started))
+            db.close()
+            exit()
+        db.close()
+        dupes = {"Msg": "No potential duplicate assets found."}
+    else:
+        if exportFiles:
+            assets = (item for path in exportFiles for item in read_export_file(path))
+        else:
+            assets = getAssets(consoleURL, token, query, fields)
+        dupes = findDupes(assets, similarity)
     if "-o" in sys.argv and sys.argv[sys.argv.index("-o") + 1].lower() not in ('text', 'txt', 'all'):
         writeFile(fileName + '.json', json.dumps(dupes, indent=4))
     elif "-o" in sys.argv and sys.argv[sys.argv.index("-o") + 1].lower() in ('text', 'txt'):
@@ -220,7 +646,7 @@ if __name__ == "__main__":
         textFile = '\n'.join(stringList)
         writeFile(fileName + '.txt', textFile)
     elif "-o" in sys.argv and sys.argv[sys.argv.index("-o") + 1].lower() == 'all':
-        writeFile(fileName + '.txt', '\n'.join(dupes))
+        writeFile(fileName + '.txt', '\n'.join(str(line) for line in dupes))
         writeFile(fileName + '.json', json.dumps(dupes, indent=4))
     else:
         print(json.dumps(dupes, indent=4))
\ No newline at end of file
@@ -0,0 +1,80 @@
+import os
+import sys
+import argparse
+import requests
+from dotenv import load_dotenv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.sync import sync_assets
+
+# load environment variables from .env file
+load_dotenv()
+
+# Command line args
+parser = argparse.ArgumentParser(
+    prog="Incremental Sync",
+    description="Keeps a local asset snapshot per organization up to date using only the assets that changed",
+)
+parser.add_argument(
+    "--snapshot-dir",
+    type=str,
+    default=os.environ.get("RUNZERO_SNAPSHOT_DIR", "snapshots"),
+    help="where snapshots and watermarks are stored",
+)
+parser.add_argument("--search", type=str, default=None, help="only keep assets matching this search")
+parser.add_argument("--fields", type=str, default=None, help="comma separated fields to keep (default all)")
+parser.add_argument("--full", action="store_true", help="ignore the watermark and download everything")
+parser.add_argument(
+    "--no-prune",
+    action="store_true",
+    help="skip the id-only export used to drop deleted assets",
+)
+
+# RUNZERO_ACCOUNT_TOKEN should be an account-level API key with permission to list organizations
+RUNZERO_ACCOUNT_TOKEN = os.environ.get("RUNZERO_ACCOUNT_TOKEN")
+BASE_URL = "https://console.runzero.com/api/v1.0"
+HEADERS = {"Authorization": f"Bearer {RUNZERO_ACCOUNT_TOKEN}"}
+
+
+def main():
+    args = parser.parse_args()
+
+    if not RUNZERO_ACCOUNT_TOKEN:
+        print("error: RUNZERO_ACCOUNT_TOKEN environment variable not set.")
+        return
+
+    orgs = requests.get(BASE_URL + "/account/orgs", headers=HEADERS)
+    orgs.raise_for_status()
+    session = requests.Session()
+
+    for o in orgs.json():
+        name = o.get("name")
+        token = o.get("export_token")
+        if not token:
+            print(f"skipping {name} - you need to enable the export token in the UI to sync")
+            continue
+
+        try:
+            snapshot_path, stats = sync_assets(
+                org_id=o.get("id"),
+                token=token,
+                snapshot_dir=args.snapshot_dir,
+                search=args.search,
+                fields=args.fields,
+                full=args.full,
+                prune=not args.no_prune,
+                base_url=BASE_URL,
+                session=session,
+            )
+        except requests.exceptions.RequestException as e:
+            print(f"FAILED - {name}: {e}")
+            continue
+
+        print(
+            f"{name} - {stats['mode']} sync: {stats['changed']} changed, {stats['removed']} removed, "
+            f"{stats['total']} total in {stats['seconds']}s -> {snapshot_path}"
+        )
+
+
+if __name__ == "__main__":
+    main()
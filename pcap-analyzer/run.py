@@ -1,13 +1,54 @@
 import dpkt
-from dpkt.compat import compat_ord
 from dpkt.udp import UDP
 from dpkt.tcp import TCP
+import numpy as np
+import argparse
 import socket
+import struct
+import mmap
+import time
 import csv
+import sys
 import os
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.sketches import CountMinSketch, MisraGries, TopK, mix64
 
 FILENAMES = ['test.pcap']
 
+# pcaps are split into chunks of about this size, one per worker job
+CHUNK_BYTES = 64 * 1024 * 1024
+
+# top-k mode - flows are fingerprinted and sketched this many at a time
+SKETCH_BATCH = 65536
+# counters kept per time window for each flow reported in it
+WINDOW_COUNTERS_PER_FLOW = 50
+WINDOW_FIELDS = ['window_start', 'flow_packets', 'src_dst_port', 'count', 'error_bound']
+
+# pcap global header magic -> (struct byte order, timestamp fraction divisor)
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e9),
+}
+PCAP_HEADER_LEN = 24
+RECORD_HEADER_LEN = 16
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_8021Q = 0x8100
+# vlan tag types dpkt unwraps (up to two tags deep)
+ETH_TYPES_VLAN = (0x8100, 0x88a8, 0x9100, 0x9200)
+ETH_TYPES_MPLS = (0x8847, 0x8848)
+# Cisco ISL frames start with one of these destination MACs
+ISL_PREFIXES = (b'\x01\x00\x0c\x00\x00', b'\x03\x00\x0c\x00\x00')
+
+U16 = struct.Struct('!H')
+IP_ADDRS = struct.Struct('!II')
+
+
 # helpers
 def write_to_csv(output: dict, filename: str, fieldnames: list):
     file = open(filename, 'w')
@@ -20,17 +61,6 @@ def write_to_csv(output: dict, filename: str, fieldnames: list):
     file.close()
 
 
-def mac_addr(address):
-    """Convert a MAC address to a readable/printable string
-
-       Args:
-           address (str): a MAC address in hex form (e.g. '\x01\x02\x03\x04\x05\x06')
-       Returns:
-           str: Printable/readable MAC address
-    """
-    return ':'.join('%02x' % compat_ord(b) for b in address)
-
-
 def inet_to_str(inet):
     """Convert inet object to a string
 
@@ -45,51 +75,240 @@ def inet_to_str(inet):
     except ValueError:
         return socket.inet_ntop(socket.AF_INET6, inet)
 
+
+def flow_to_str(key: tuple):
+    """Formats a (src, dst, dport) integer key as src:dst:port - only done at output time."""
+    src, dst, dport = key
+    return f'{inet_to_str(src.to_bytes(4, "big"))}:{inet_to_str(dst.to_bytes(4, "big"))}:{dport}'
+
+
+def pcap_format(mm):
+    """Returns (record header struct, timestamp divisor) for a pcap, from its magic number."""
+    try:
+        byte_order, divisor = PCAP_MAGIC[bytes(mm[:4])]
+    except KeyError:
+        raise ValueError('invalid tcpdump header - only pcap (not pcapng) files are supported')
+    return struct.Struct(byte_order + 'IIII'), divisor
+
+
+def chunk_ranges(filename: str, chunk_bytes: int = CHUNK_BYTES):
+    """Splits a pcap into (start, end) byte ranges that begin and end on record boundaries.
+
+    Only the 16 byte record headers are read - each one says how far it is
+    to the next - so finding the boundaries is quick even for huge captures.
+    """
+    ranges = []
+    with open(filename, 'rb') as file:
+        if os.fstat(file.fileno()).st_size < PCAP_HEADER_LEN:
+            raise ValueError('invalid tcpdump header - file is too short')
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            record, _ = pcap_format(mm)
+            size = len(mm)
+            start = position = PCAP_HEADER_LEN
+            while position + RECORD_HEADER_LEN <= size:
+                position += RECORD_HEADER_LEN + record.unpack_from(mm, position)[2]
+                if position - start >= chunk_bytes:
+                    ranges.append((start, min(position, size)))
+                    start = position
+            if start < size:
+                ranges.append((start, size))
+    return ranges
+
+
+def dpkt_flow(frame: bytes):
+    """Decodes a frame with dpkt, for the encapsulations the fast path leaves to it (MPLS, ISL)."""
+    try:
+        eth = dpkt.ethernet.Ethernet(frame)
+    except dpkt.UnpackError:
+        return None
+    if isinstance(eth.data, dpkt.ip.IP):
+        ip = eth.data
+        transport = ip.data
+        if (isinstance(transport, TCP) or isinstance(transport, UDP)):
+            src, dst = IP_ADDRS.unpack(ip.src + ip.dst)
+            return (src, dst, transport.dport)
+    return None
+
+
+def iter_packets(mm, start: int, end: int, record):
+    """Yields (timestamp seconds, timestamp fraction, frame start, frame end) for each record in a range."""
+    size = len(mm)
+    position = start
+    while position + RECORD_HEADER_LEN <= end:
+        ts_sec, ts_frac, incl_len, _ = record.unpack_from(mm, position)
+        frame = position + RECORD_HEADER_LEN
+        position = frame + incl_len
+        # the last record of a truncated capture is cut short
+        yield ts_sec, ts_frac, frame, min(position, size)
+
+
+def frame_flow(mm, frame: int, frame_end: int):
+    """Returns the (src, dst, dport) integer key of an Ethernet frame, or None if it isn't IPv4 TCP/UDP.
+
+    Reads the headers straight out of the memory map with struct instead of
+    building dpkt objects, and counts the same packets dpkt would: Ethernet II
+    with up to two vlan tags, IPv4 that isn't a non-first fragment, and a TCP
+    or UDP header that fits inside the IP length.
+    """
+    if frame_end - frame < 14:
+        return None
+    eth_type = U16.unpack_from(mm, frame + 12)[0]
+    offset = frame + 14
+    if eth_type <= 1500:
+        if mm[frame:frame + 5] in ISL_PREFIXES:
+            return dpkt_flow(mm[frame:frame_end])
+        return None
+    if eth_type in ETH_TYPES_VLAN:
+        for _ in range(2):
+            if frame_end - offset < 4:
+                return None
+            eth_type = U16.unpack_from(mm, offset + 2)[0]
+            offset += 4
+            if eth_type != ETH_TYPE_8021Q:
+                break
+    elif eth_type in ETH_TYPES_MPLS:
+        return dpkt_flow(mm[frame:frame_end])
+    if eth_type != ETH_TYPE_IP or frame_end - offset < 20:
+        return None
+
+    header_len = (mm[offset] & 0xf) << 2
+    if header_len < 20:
+        return None
+    ip_len = U16.unpack_from(mm, offset + 2)[0]
+    if U16.unpack_from(mm, offset + 6)[0] & 0x1fff:
+        # a later fragment - there's no transport header in it
+        return None
+    protocol = mm[offset + 9]
+    # a zero IP length usually means TCP segmentation offload - use the whole frame
+    ip_end = min(offset + ip_len, frame_end) if ip_len else frame_end
+    transport = offset + header_len
+    if protocol == 6:
+        if ip_end - transport < 20 or (mm[transport + 12] >> 4) < 5:
+            return None
+    elif protocol == 17:
+        if ip_end - transport < 8:
+            return None
+    else:
+        return None
+    src, dst = IP_ADDRS.unpack_from(mm, offset + 12)
+    return (src, dst, U16.unpack_from(mm, transport + 2)[0])
+
+
+def aggregate_chunk(filename: str, start: int, end: int):
+    """Worker: counts src/dst/port flows in one chunk of a pcap.
+
+    Returns ({(src, dst, dport): count} in first-seen order, packets). Keys
+    are plain ints, which take a fraction of the memory of the formatted
+    strings and are much cheaper to hash.
+    """
+    flows = {}
+    packets = 0
+    with open(filename, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            record, _ = pcap_format(mm)
+            for _, _, frame, frame_end in iter_packets(mm, start, end, record):
+                packets += 1
+                key = frame_flow(mm, frame, frame_end)
+                if key is not None:
+                    flows[key] = flows.get(key, 0) + 1
+    return flows, packets
+
+
+def flow_fingerprints(keys: list):
+    """Returns a uint64 fingerprint for each (src, dst, dport) key, for the count-min sketch."""
+    flows = np.array(keys, dtype=np.uint64).reshape(-1, 3)
+    packed = (flows[:, 0] << np.uint64(32)) | flows[:, 1]
+    return mix64(packed ^ mix64(flows[:, 2]))
+
+
+def sketch_chunk(filename: str, start: int, end: int, top_k: int, sketch_bytes: int, window: int, window_top: int):
+    """Worker: the top-k version of aggregate_chunk, in fixed memory however many flows there are.
+
+    Returns (TopK, {window start: MisraGries}, packets). Flows go through a
+    count-min sketch in batches, and with window set each window of that
+    many seconds gets its own small Misra-Gries summary. Every worker uses
+    the same sketch seed, so the results merge exactly.
+    """
+    top = TopK(top_k, CountMinSketch.from_memory(sketch_bytes))
+    windows = {}
+    packets = 0
+    batch = []
+    with open(filename, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            record, _ = pcap_format(mm)
+            for ts_sec, _, frame, frame_end in iter_packets(mm, start, end, record):
+                packets += 1
+                key = frame_flow(mm, frame, frame_end)
+                if key is None:
+                    continue
+                batch.append(key)
+                if window:
+                    window_start = ts_sec - ts_sec % window
+                    summary = windows.get(window_start)
+                    if summary is None:
+                        summary = windows[window_start] = MisraGries(window_top * WINDOW_COUNTERS_PER_FLOW)
+                    summary.add(key)
+                if len(batch) >= SKETCH_BATCH:
+                    top.add(flow_fingerprints(batch), batch)
+                    batch = []
+    if batch:
+        top.add(flow_fingerprints(batch), batch)
+    return top, windows, packets
+
+
+def write_window(writer: csv.DictWriter, window_start: int, summary: MisraGries, window_top: int):
+    """Writes the top flows of one finished window to windows.csv."""
+    for key, count in summary.top(window_top):
+        writer.writerow({
+            'window_start': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(window_start)),
+            'flow_packets': summary.total,
+            'src_dst_port': flow_to_str(key),
+            'count': count,
+            'error_bound': summary.error_bound()
+        })
+
+
 # grab pcap + do work
 
 
-def handle_pcap(filename: str):
+def output_dir(filename: str):
     safe_file = filename.split('.')[:-1]
     safe_file = '_'.join(safe_file)
     # make output directory for each task
     if not os.path.exists(f'{safe_file}-out'):
         os.mkdir(f'{safe_file}-out')
+    return f'{safe_file}-out'
+
+
+def handle_pcap(filename: str, executor: ProcessPoolExecutor, chunk_bytes: int = CHUNK_BYTES):
+    out_dir = output_dir(filename)
 
     output = {}
     output_csv = []
     output_csv_reduced = []
-    file = open(filename, 'rb')
-    pcap = dpkt.pcap.Reader(file)
-    for timestamp, buf in pcap:
-
-        # Unpack the Ethernet frame (mac src/dst, ethertype)
-        eth = dpkt.ethernet.Ethernet(buf)
-
-        # Make sure the Ethernet frame contains an IP packet
-        if isinstance(eth.data, dpkt.ip.IP):
-
-            # Now access the data within the Ethernet frame (the IP packet)
-            # Pulling out src, dst, length, fragment info, TTL, and Protocol
-            ip = eth.data
-            transport = ip.data
-
-            # add src/dst/port combos to the output dict + track count of each
-            if (isinstance(transport, TCP) or isinstance(transport, UDP)):
-                gist = f'{inet_to_str(ip.src)}:{inet_to_str(ip.dst)}:{transport.dport}'
-                if gist in output:
-                    output[gist] += 1
-                else:
-                    output[gist] = 1
+    packets = 0
+    started = time.time()
+    ranges = chunk_ranges(filename, chunk_bytes)
+    # merge the chunks in file order so ties keep the order flows were first seen
+    for chunk_flows, chunk_packets in executor.map(
+        aggregate_chunk, [filename] * len(ranges), *zip(*ranges)
+    ):
+        for key, count in chunk_flows.items():
+            output[key] = output.get(key, 0) + count
+        packets += chunk_packets
+    elapsed = time.time() - started
+    print(f'{filename}: {packets} packets, {len(output)} flows in {elapsed:.1f}s '
+          f'({packets / elapsed if elapsed else 0:.0f} packets/s)')
 
     # create csv output
     for k, v in output.items():
         output_csv.append({
-            'src_dst_port': k,
+            'src_dst_port': flow_to_str(k),
             'count': v
         })
         if v > 4:
             output_csv_reduced.append({
-                'src_dst_port': k,
+                'src_dst_port': flow_to_str(k),
                 'count': v
             })
 
@@ -99,22 +318,173 @@ def handle_pcap(filename: str):
     # write csv output
     write_to_csv(
         output=output_csv,
-        filename=f'{safe_file}-out/src-dst-port.csv',
+        filename=f'{out_dir}/src-dst-port.csv',
         fieldnames=[
             'src_dst_port',
             'count'
         ])
-    
+
     # write csv output
     write_to_csv(
         output=output_csv_reduced,
-        filename=f'{safe_file}-out/src-dst-port-reduced.csv',
+        filename=f'{out_dir}/src-dst-port-reduced.csv',
         fieldnames=[
             'src_dst_port',
             'count'
         ])
 
 
+def handle_pcap_top(
+    filename: str,
+    executor: ProcessPoolExecutor,
+    chunk_bytes: int = CHUNK_BYTES,
+    top_k: int = 100,
+    sketch_bytes: int = 16 * 1024 * 1024,
+    window: int = 60,
+    window_top: int = 10,
+):
+    """Writes the heaviest flows and per-window summaries of a pcap, in bounded memory.
+
+    The counts in top-flows.csv come from a count-min sketch: they are never
+    too low, and with the sketch's confidence (1 - delta) at most error_bound
+    too high. The per-window counts come from Misra-Gries summaries: they are
+    never too high, and at most error_bound too low.
+
+    Chunks are merged in file order, and a capture is written in time order,
+    so once a chunk comes back every window before its first one is finished.
+    Those windows are written to windows.csv and dropped right away, which
+    keeps only the windows of the last chunk or two in memory.
+    """
+    out_dir = output_dir(filename)
+    top = None
+    windows = {}
+    # every window before this one has been written
+    written_before = None
+    late_packets = 0
+    packets = 0
+    started = time.time()
+    ranges = chunk_ranges(filename, chunk_bytes)
+    chunks = len(ranges)
+    with open(f'{out_dir}/windows.csv', 'w') if window else nullcontext() as windows_file:
+        if window:
+            windows_writer = csv.DictWriter(windows_file, fieldnames=WINDOW_FIELDS)
+            windows_writer.writeheader()
+        for chunk_top, chunk_windows, chunk_packets in executor.map(
+            sketch_chunk,
+            [filename] * chunks,
+            *zip(*ranges),
+            [top_k] * chunks,
+            [sketch_bytes] * chunks,
+            [window] * chunks,
+            [window_top] * chunks,
+        ):
+            if top is None:
+                top = chunk_top
+            else:
+                top.merge(chunk_top)
+            if chunk_windows:
+                first = min(chunk_windows)
+                for window_start in sorted(start for start in windows if start < first):
+                    write_window(windows_writer, window_start, windows.pop(window_start), window_top)
+                if written_before is not None and first < written_before:
+                    # out of time order - these windows get a second set of rows
+                    late_packets += sum(
+                        summary.total for start, summary in chunk_windows.items() if start < written_before
+                    )
+                written_before = first if written_before is None else max(written_before, first)
+            # a window can straddle two chunks - its summaries merge
+            for window_start, summary in chunk_windows.items():
+                if window_start in windows:
+                    windows[window_start].merge(summary)
+                else:
+                    windows[window_start] = summary
+            packets += chunk_packets
+        for window_start in sorted(windows):
+            write_window(windows_writer, window_start, windows[window_start], window_top)
+    elapsed = time.time() - started
+    if top is None:
+        top = TopK(top_k, CountMinSketch.from_memory(sketch_bytes))
+    sketch = top.sketch
+    print(f'{filename}: {packets} packets, {sketch.total} flow packets in {elapsed:.1f}s '
+          f'({packets / elapsed if elapsed else 0:.0f} packets/s)')
+    print(f'  {sketch.width}x{sketch.depth} sketch ({sketch.table.nbytes / 1024 / 1024:.1f} MB) - '
+          f'counts are at most {sketch.error_bound()} too high with {1 - sketch.delta:.1%} confidence')
+
+    error_bound = sketch.error_bound()
+    write_to_csv(
+        output=[
+            {'src_dst_port': flow_to_str(key), 'count': count, 'error_bound': error_bound}
+            for key, count in top.top()
+        ],
+        filename=f'{out_dir}/top-flows.csv',
+        fieldnames=[
+            'src_dst_port',
+            'count',
+            'error_bound'
+        ])
+    if late_packets:
+        print(f'  {late_packets} flow packets were out of time order - windows.csv can have more than one set of rows for their windows')
+
+
 if __name__ == '__main__':
-    for filename in FILENAMES:
-        handle_pcap(filename=filename)
+    parser = argparse.ArgumentParser(
+        description='Counts src/dst/port flows in pcap files'
+    )
+    parser.add_argument(
+        'filenames',
+        nargs='*',
+        default=FILENAMES,
+        help='pcap files to analyze (default: FILENAMES)',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='worker processes to parse with (default: one per CPU)',
+    )
+    parser.add_argument(
+        '--chunk-mb',
+        type=int,
+        default=CHUNK_BYTES // (1024 * 1024),
+        help='size of the chunks each worker parses (default: 64)',
+    )
+    parser.add_argument(
+        '--top-k',
+        type=int,
+        default=None,
+        help='only track the K heaviest flows, in fixed memory (writes top-flows.csv and windows.csv)',
+    )
+    parser.add_argument(
+        '--sketch-mb',
+        type=int,
+        default=16,
+        help='memory for the top-k count-min sketch, per worker (default: 16)',
+    )
+    parser.add_argument(
+        '--window',
+        type=int,
+        default=60,
+        help='seconds per window in windows.csv, 0 to skip it (default: 60)',
+    )
+    parser.add_argument(
+        '--window-top',
+        type=int,
+        default=10,
+        help='flows reported per window (default: 10)',
+    )
+    args = parser.parse_args()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for filename in args.filenames:
+            if args.top_k:
+                handle_pcap_top(
+                    filename=filename,
+                    executor=executor,
+                    chunk_bytes=args.chunk_mb * 1024 * 1024,
+                    top_k=args.top_k,
+                    sketch_bytes=args.sketch_mb * 1024 * 1024,
+                    window=args.window,
+                    window_top=args.window_top,
+                )
+            else:
+                handle_pcap(filename=filename, executor=executor, chunk_bytes=args.chunk_mb * 1024 * 1024)
@@ -1,15 +1,23 @@
 import requests
 import os
+import sys
 import csv
 import json
 import urllib.parse
-import ipaddress
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.cache import cached_export
+from common.sync import sync_assets, read_snapshot
+from common.subnets import aggregate_assets
 
 # auth - navigate here to create an account token: https://console.runzero.com/account
 RUNZERO_ACCOUNT_TOKEN = os.environ["RUNZERO_ACCOUNT_TOKEN"]
 HEADERS = {"Authorization": f"Bearer {RUNZERO_ACCOUNT_TOKEN}"}
 BASE_URL = "https://console.runZero.com/api/v1.0"
 
+# SET TO READ FROM A LOCAL SNAPSHOT THAT ONLY PULLS CHANGED ASSETS - see incremental-sync/README.md
+SNAPSHOT_DIR = os.environ.get("RUNZERO_SNAPSHOT_DIR")
+
 # dict for tracking counts and data
 GLOBAL_RISK = []
 
@@ -45,65 +53,36 @@ def create_output(
     search: str = None,
     search_url: str = None,
 ):
-    tracker = {}
     output = []
 
-    for asset in assets:
-        addresses = asset.get("addresses", [])
-        risk = asset.get("risk_rank", 0)
-        criticality = asset.get("criticality_rank", 0)
-        site = asset.get("site_id", "unknown-site")
-        for address in addresses:
-            ip = ipaddress.ip_address(address)
-            if ip.version == 4:
-                address.split(".")
-                subnet = ".".join(address.split(".")[0:3]) + ".0/24"
-                subnet = f"{site}_{subnet}"
-                if subnet not in tracker:
-                    # new subnet
-                    tracker[subnet] = {}
-                    tracker[subnet]["asset_count"] = 0
-                    tracker[subnet]["risk"] = risk
-                    tracker[subnet]["avg_risk"] = risk
-                    tracker[subnet]["criticality"] = criticality
-                    tracker[subnet]["avg_criticality"] = criticality
-                    search_params = subnet.split("_")
-
-                    safe_search = (
-                        urllib.parse.quote_plus(
-                            f"{search} AND site:{search_params[0]} AND net:{search_params[1]}"
-                        )
-                        if search
-                        else urllib.parse.quote_plus(
-                            f"site:{search_params[0]} AND net:{search_params[1]}"
-                        )
-                    )
-
-                    tracker[subnet]["search"] = f"{search_url}{safe_search}"
-
-                # handle subnets that already exist
-                tracker[subnet]["asset_count"] += 1
-                tracker[subnet]["risk"] += risk
-                tracker[subnet]["avg_risk"] = round(
-                    tracker[subnet]["risk"] / tracker[subnet]["asset_count"], 2
-                )
-                tracker[subnet]["criticality"] += criticality
-                tracker[subnet]["avg_criticality"] = round(
-                    tracker[subnet]["criticality"] / tracker[subnet]["asset_count"], 2
-                )
+    # one pass over the addresses, then counts/sums/averages per site + /24 in numpy
+    subnets = aggregate_assets(
+        assets,
+        group_field="site_id",
+        value_fields=["risk_rank", "criticality_rank"],
+        default_group="unknown-site",
+    )
 
-    for subnet in tracker.keys():
+    for subnet in subnets:
+        site_id = subnet["group"]
+        safe_search = (
+            urllib.parse.quote_plus(
+                f"{search} AND site:{site_id} AND net:{subnet['subnet']}"
+            )
+            if search
+            else urllib.parse.quote_plus(f"site:{site_id} AND net:{subnet['subnet']}")
+        )
         output.append(
             {
                 "org_name": org_name,
-                "site_id": subnet.split("_")[0],
-                "subnet": subnet.split("_")[1],
-                "asset_count": tracker[subnet]["asset_count"],
-                "risk": tracker[subnet]["risk"],
-                "avg_risk": tracker[subnet]["avg_risk"],
-                "criticality": tracker[subnet]["criticality"],
-                "avg_criticality": tracker[subnet]["avg_criticality"],
-                "search": tracker[subnet]["search"],
+                "site_id": site_id,
+                "subnet": subnet["subnet"],
+                "asset_count": subnet["count"],
+                "risk": subnet["risk_rank"],
+                "avg_risk": subnet["avg_risk_rank"],
+                "criticality": subnet["criticality_rank"],
+                "avg_criticality": subnet["avg_criticality_rank"],
+                "search": f"{search_url}{safe_search}",
             }
         )
 
@@ -133,7 +112,12 @@ def create_output(
 
 
 def handle_search(
-    token: str, org_name: str, search_name: str, search_type: str, search: str
+    token: str,
+    org_name: str,
+    search_name: str,
+    search_type: str,
+    search: str,
+    org_id: str = None,
 ):
 
     # ensure search name is good for file creation
@@ -143,25 +127,22 @@ def handle_search(
     if not os.path.exists(f"{org_name}/{search_type}"):
         os.mkdir(f"{org_name}/{search_type}")
 
-    headers = {"Authorization": f"Bearer {token}"}
     if search_type == "assets":
-        url = BASE_URL + "/export/org/assets.json?"
         search_url = "https://console.runzero.com/inventory?search="
     elif search_type == "services":
-        url = BASE_URL + "/export/org/services.json?"
         search_url = "https://console.runzero.com/inventory/services?search="
     else:
         print(f"non supported search type {search_type}")
+        return
 
-    data = requests.get(
-        url,
-        headers=headers,
-        params={
-            "search": search,
-            "fields": "site_id, addresses, addresses_extra, risk_rank, risk, criticality, criticality_rank",
-        },
+    results = cached_export(
+        org_id,
+        token,
+        search_type,
+        search=search,
+        fields="site_id, addresses, addresses_extra, risk_rank, risk, criticality, criticality_rank",
+        base_url=BASE_URL,
     )
-    results = data.json()
 
     create_output(
         assets=results,
@@ -173,29 +154,24 @@ def handle_search(
     )
 
 
-def handle_org_risk(token: str, name: str):
+def handle_org_risk(token: str, name: str, org_id: str):
     print(f"handling {name}...")
     # check for folder or create
     if not os.path.exists(name):
         os.mkdir(name)
 
-    # create export variables
-    headers = {"Authorization": f"Bearer {token}"}
-    url = BASE_URL + "/export/org/assets.json"
-
-    # total risk by subnet dict
-    risk_by_subnet = {}
-
-    data = requests.get(
-        url,
-        headers=headers,
-        params={
-            "search": "alive:t",
-            "fields": "site_id, addresses, addresses_extra, risk_rank, risk, criticality, criticality_rank",
-        },
-    )
-
-    results = data.json()
+    search = "alive:t"
+    fields = "site_id, addresses, addresses_extra, risk_rank, risk, criticality, criticality_rank"
+    if SNAPSHOT_DIR:
+        snapshot_path, stats = sync_assets(
+            org_id, token, SNAPSHOT_DIR, search=search, fields=fields, base_url=BASE_URL
+        )
+        print(f"{stats['mode']} sync: {stats['changed']} changed, {stats['removed']} removed")
+        results = read_snapshot(snapshot_path)
+    else:
+        results = cached_export(
+            org_id, token, "assets", search=search, fields=fields, base_url=BASE_URL
+        )
 
     risk_by_subnet_output = create_output(
         assets=results,
@@ -214,7 +190,7 @@ def main():
         asset_count = o.get("asset_count")
         max_assets = 100000
         if token and asset_count < max_assets and asset_count > 50:
-            handle_org_risk(token=token, name=name)
+            handle_org_risk(token=token, name=name, org_id=o.get("id"))
             for search in SEARCHES:
                 handle_search(
                     token=token,
@@ -222,6 +198,7 @@ def main():
                     search_name=search["name"],
                     search_type=search["type"],
                     search=search["search"],
+                    org_id=o.get("id"),
                 )
         if not token:
             print(
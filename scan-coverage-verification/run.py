@@ -1,9 +1,12 @@
-from ipaddress import ip_network
 import site
 import requests
 import os
+import sys
 import json
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.prefixes import PrefixTrie
+
 # UPDATE "ADD ME" if you aren"t using the .env file
 RUNZERO_ORG_TOKEN = os.environ["RUNZERO_ORG_TOKEN"] or "ADD ME"
 
@@ -31,18 +34,26 @@ def get_tasks():
 
 def check_for_subnets(subnets: dict, runZero_subnets: list):
     tracker = {}
+    exact = set(runZero_subnets)
+    # index the runZero subnets once so each lookup is a single longest-prefix match
+    trie = PrefixTrie()
+    for runZero_sub in runZero_subnets:
+        try:
+            trie.insert(runZero_sub)
+        except ValueError:
+            # task targets can also be hostnames or ranges
+            pass
+
     for s in subnets:
         cidr = s["cidr"]
         # checks if cidr is an exact match in the runZero list
-        if s["cidr"] in runZero_subnets:
+        if cidr in exact:
             tracker[cidr] = {"state": "exists", "tag": s["name"]}
+        # checks if the cidr is already covered by a larger subnet mask
+        elif cidr in trie:
+            tracker[cidr] = {"state": "covered", "tag": s["name"]}
         else:
-            # checks if the cidr is already covered by a larger subnet mask
-            for runZero_sub in runZero_subnets:
-                if ip_network(s["cidr"]).subnet_of(ip_network(runZero_sub)):
-                    tracker[cidr] = {"state": "covered", "tag": s["name"]}
-                else:
-                    tracker[cidr] = {"state": "missing", "tag": s["name"]}
+            tracker[cidr] = {"state": "missing", "tag": s["name"]}
     return tracker
 
 
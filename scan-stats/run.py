@@ -1,8 +1,11 @@
-import requests
 import json
 import os
+import sys
 import csv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.http import RunZeroClient
+
 # DO NOT TOUCH
 RUNZERO_ORG_TOKEN = os.environ["RUNZERO_ORG_TOKEN"]
 ORG_HEADERS = {"Authorization": f"Bearer {RUNZERO_ORG_TOKEN}"}
@@ -10,64 +13,92 @@ ORG_HEADERS = {"Authorization": f"Bearer {RUNZERO_ORG_TOKEN}"}
 # UPDATE IF SELF HOSTED
 BASE_URL = "https://console.runZero.com/api/v1.0"
 
+# pooled connections + retries on 429/5xx
+CLIENT = RunZeroClient(base_url=BASE_URL)
+
+
+# recurring tasks that aren't scans
+SKIP_TASK_NAMES = ["Outlier calculation", "Query"]
+
+
+def get_sites():
+    """Returns {site id: site name} from a single /org/sites call."""
+    url = BASE_URL + "/org/sites"
+    sites = CLIENT.get(url, headers=ORG_HEADERS)
+    return {s["id"]: s.get("name") for s in sites.json()}
+
+
+def new_task_stats():
+    return {
+        "names": [],
+        "site_ids": [],
+        "site_names": [],
+        "new_assets_all_time": 0,
+        "offline_assets_all_time": 0,
+        "total_assets_seen": 0,
+        "scan_count": 0,
+        "average_assets_seen": 0,
+        "max_assets_seen": 0,
+        "min_assets_seen": 10000000000000
+    }
+
+
+def add_task(stats: dict, t: dict):
+    """Folds one child task into its recurring task's running stats."""
+    stats["scan_count"] += 1
+
+    name = t.get("name", "")
+    if name and name not in stats["names"]:
+        stats["names"].append(name)
+
+    site_id = t.get("site_id", "")
+    if site_id and site_id not in stats["site_ids"]:
+        stats["site_ids"].append(site_id)
+
+    task_stats = t.get("stats") or {}
+    new_assets = task_stats.get("change.newAssets", "")
+    if new_assets:
+        stats["new_assets_all_time"] += int(new_assets)
+
+    offline_assets = task_stats.get("change.offlineAssets", "")
+    if offline_assets:
+        stats["offline_assets_all_time"] += int(offline_assets)
+
+    total_assets = task_stats.get("change.totalAssets", "")
+    if total_assets:
+        total_assets = int(total_assets)
+        stats["total_assets_seen"] += total_assets
+        stats["max_assets_seen"] = max(stats["max_assets_seen"], total_assets)
+        stats["min_assets_seen"] = min(stats["min_assets_seen"], total_assets)
+
 
 def get_tasks():
+    """Builds the stats for every recurring task from one pass over the task list.
+
+    The recurring tasks and then all tasks are each fetched once, page by
+    page, and child tasks are matched to their recurring task by parent_id
+    locally - instead of a search per recurring task and a site lookup per
+    site per task.
+    """
     url = BASE_URL + "/org/tasks"
-    data = requests.get(url, headers=ORG_HEADERS, params={"search": "recur:t"})
-    recurring_tasks = data.json()
     task_stats = {}
-    for r in recurring_tasks:
-        if r["name"] not in ["Outlier calculation", "Query"]:
-            id = r["id"]
-            tasks_from_parent = requests.get(url, headers=ORG_HEADERS, params={
-                                             "search": f"parent_id:{id}"})
-            task_stats[id] = {
-                "names": [],
-                "site_ids": [],
-                "site_names": [],
-                "new_assets_all_time": 0,
-                "offline_assets_all_time": 0,
-                "total_assets_seen": 0,
-                "scan_count": len(tasks_from_parent.json()),
-                "average_assets_seen": 0,
-                "max_assets_seen": 0,
-                "min_assets_seen": 10000000000000
-            }
-            for t in tasks_from_parent.json():
-                name = t.get("name", "")
-                if name and name not in task_stats[id]["names"]:
-                    task_stats[id]["names"].append(name)
-
-                site_id = t.get("site_id", "")
-                if site_id and site_id not in task_stats[id]["site_ids"]:
-                    task_stats[id]["site_ids"].append(site_id)
-
-                new_assets = t.get("stats", "").get("change.newAssets", "")
-                if new_assets:
-                    task_stats[id]["new_assets_all_time"] += int(new_assets)
-
-                offline_assets = t.get("stats", "").get(
-                    "change.offlineAssets", "")
-                if offline_assets:
-                    task_stats[id]["offline_assets_all_time"] += int(
-                        offline_assets)
-
-                total_assets = t.get("stats", "").get("change.totalAssets", "")
-                if total_assets:
-                    task_stats[id]["total_assets_seen"] += int(total_assets)
-                    task_stats[id]["max_assets_seen"] = total_assets if total_assets > task_stats[
-                        id]["max_assets_seen"] else task_stats[id]["max_assets_seen"]
-                    task_stats[id]["min_assets_seen"] = total_assets if total_assets < task_stats[
-                        id]["min_assets_seen"] else task_stats[id]["min_assets_seen"]
-
-            task_stats[id]["average_assets_seen"] = round(
-                task_stats[id]["total_assets_seen"] / task_stats[id]["scan_count"])
-            for s in task_stats[id]["site_ids"]:
-                get_site_url = BASE_URL + f"/org/sites/{s}"
-                site_data = requests.get(get_site_url, headers=ORG_HEADERS)
-                site_name = site_data.json().get("name")
-                if site_name and site_name not in task_stats[id]["site_names"]:
-                    task_stats[id]["site_names"].append(site_name)
+    for r in CLIENT.iter_pages(url, headers=ORG_HEADERS, params={"search": "recur:t"}):
+        if r["name"] not in SKIP_TASK_NAMES:
+            task_stats[r["id"]] = new_task_stats()
+
+    for t in CLIENT.iter_pages(url, headers=ORG_HEADERS):
+        stats = task_stats.get(t.get("parent_id"))
+        if stats is not None:
+            add_task(stats, t)
+
+    sites = get_sites()
+    for stats in task_stats.values():
+        if stats["scan_count"]:
+            stats["average_assets_seen"] = round(stats["total_assets_seen"] / stats["scan_count"])
+        for s in stats["site_ids"]:
+            site_name = sites.get(s)
+            if site_name and site_name not in stats["site_names"]:
+                stats["site_names"].append(site_name)
 
     return task_stats
 
@@ -109,6 +140,8 @@ def main():
     writer.writerows(csv_output)
     scan_stats_csv.close()
 
+    CLIENT.stats.print()
+
 
 if __name__ == "__main__":
     main()
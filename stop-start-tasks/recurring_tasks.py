@@ -1,35 +1,11 @@
+import os
+import sys
 import json
 import datetime
-import requests
-from enum import Enum
 from tenacity import retry, stop_after_attempt, wait_fixed
 
-
-class RestRequest:
-    def _init_(self, method, url, params=None, data=None, headers=None):
-        self.method = method
-        self.url = url
-        self.params = params or {}
-        self.data = data or {}
-        self.headers = headers or {}
-
-    def execute(self):
-        response = requests.request(
-            self.method,
-            self.url,
-            params=self.params,
-            data=self.data,
-            headers=self.headers,
-        )
-        return response
-
-
-class HTTPMethod(Enum):
-    GET = "GET"
-    POST = "POST"
-    PUT = "PUT"
-    DELETE = "DELETE"
-    PATCH = "PATCH"
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.http import HTTPMethod, RestRequest
 
 
 TOKEN_ENDPOINT = "account/api/token"
@@ -1,18 +1,24 @@
-import requests
 import os
+import sys
 import json
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.http import RunZeroClient
+
 RUNZERO_ORG_TOKEN = os.environ["RUNZERO_ORG_TOKEN"]
 HEADERS = {"Authorization": f"Bearer {RUNZERO_ORG_TOKEN}"}
 BASE_URL = "https://console.runZero.com/api/v1.0"
 
+# pooled connections + retries on 429/5xx
+CLIENT = RunZeroClient(base_url=BASE_URL)
+
 PAUSE_SEARCH = "status:active recur:t"
 START_SEARCH = "status:paused recur:t"
 
 
 def get_tasks(search: str or None):
     url = BASE_URL + "/org/tasks"
-    tasks = requests.get(
+    tasks = CLIENT.get(
         url, headers=HEADERS, params={
             "search": search}
     )
@@ -21,7 +27,7 @@ def get_tasks(search: str or None):
 
 def pause_task(id: str):
     url = BASE_URL + f"/org/tasks/{id}"
-    pause = requests.patch(url, headers=HEADERS, json={"status": "paused"})
+    pause = CLIENT.patch(url, headers=HEADERS, json={"status": "paused"})
     if pause.status_code == 200:
         return True
     else:
@@ -31,7 +37,7 @@ def pause_task(id: str):
 
 def start_task(id: str):
     url = BASE_URL + f"/org/tasks/{id}"
-    pause = requests.patch(url, headers=HEADERS, json={"status": "active"})
+    pause = CLIENT.patch(url, headers=HEADERS, json={"status": "active"})
     if pause.status_code == 200:
         return True
     else:
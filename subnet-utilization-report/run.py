@@ -1,9 +1,14 @@
-import requests
 import json
 import os
+import sys
 import csv
 import ipaddress
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.export import stream_assets
+from common.http import RunZeroClient
+from common.subnets import IPSet, int_to_ipv4
+
 # DO NOT TOUCH UNLESS HARD CODING CREDENTIALS
 RUNZERO_ORG_TOKEN = os.environ["RUNZERO_ORG_TOKEN"]
 ORG_HEADERS = {"Authorization": f"Bearer {RUNZERO_ORG_TOKEN}"}
@@ -13,12 +18,18 @@ EXPORT_HEADERS = {"Authorization": f"Bearer {RUNZERO_EXPORT_TOKEN}"}
 # UPDATE IF SELF HOSTED
 BASE_URL = "https://console.runZero.com/api/v1.0"
 
+# pooled connections + retries on 429/5xx
+CLIENT = RunZeroClient(base_url=BASE_URL)
+
 # UPDATE TO MATCH SEARCH CRITERIA
 SEARCH = "alive:t"
 
-# UPDATE TO SELECT SUBNET SIZE - options are 8, 16, or 24
+# UPDATE TO SELECT SUBNET SIZE - e.g. 8, 16, or 24
 MASK = 24
 
+# site id -> name, filled from a single /org/sites call and shared by both reports
+SITE_NAMES = {}
+
 
 def write_to_csv(output: dict, filename: str, fieldnames: list):
     file = open(filename, "w")
@@ -31,6 +42,15 @@ def write_to_csv(output: dict, filename: str, fieldnames: list):
     file.close()
 
 
+def get_site_name(site_id: str):
+    if not SITE_NAMES:
+        sites = CLIENT.get(BASE_URL + "/org/sites", headers=ORG_HEADERS)
+        sites.raise_for_status()
+        for site in sites.json():
+            SITE_NAMES[site.get("id")] = site.get("name", "N/A")
+    return SITE_NAMES.get(site_id, "N/A")
+
+
 def write_unique_ip_to_csv(unique_ips: dict):
     # generate CSV friendly JSON
     csv_output = []
@@ -40,15 +60,15 @@ def write_unique_ip_to_csv(unique_ips: dict):
     csv_output_private = []
     csv_output_private_min = []
     for k in unique_ips.keys():
-        site = requests.get(BASE_URL + f"/org/sites/{k}", headers=ORG_HEADERS)
-        site_name = site.json().get("name", "N/A")
+        site_name = get_site_name(k)
+        addresses = unique_ips[k].addresses()
 
         # full count with list
         temp = {
             "site_id": k,
             "site_name": site_name,
-            "unique_ip_count": len(unique_ips[k]),
-            "unique_ip_list": unique_ips[k]
+            "unique_ip_count": len(addresses),
+            "unique_ip_list": addresses
         }
         csv_output.append(temp)
 
@@ -56,13 +76,16 @@ def write_unique_ip_to_csv(unique_ips: dict):
         temp_min = {
             "site_id": k,
             "site_name": site_name,
-            "unique_ip_count": len(unique_ips[k])
+            "unique_ip_count": len(addresses)
         }
         csv_output_min.append(temp_min)
 
         temp_public_list = []
-        for ip in unique_ips[k]:
-            if not ipaddress.ip_address(ip).is_private:
+        temp_private_list = []
+        for ip in addresses:
+            if ipaddress.ip_address(ip).is_private:
+                temp_private_list.append(ip)
+            else:
                 temp_public_list.append(ip)
 
         # full public count with list
@@ -84,11 +107,6 @@ def write_unique_ip_to_csv(unique_ips: dict):
         }
         csv_output_public_min.append(temp_public_min)
 
-        temp_private_list = []
-        for ip in unique_ips[k]:
-            if ipaddress.ip_address(ip).is_private:
-                temp_private_list.append(ip)
-
         # full private count with list
         temp_private = {
             "site_id": k,
@@ -168,91 +186,55 @@ def write_unique_ip_to_csv(unique_ips: dict):
 
 
 def write_subnet_utilization_to_csv(unique_ips: dict):
-    output = {}
-    ranges = []
-    for site in unique_ips.keys():
-
-        output[site] = {}
-
-        for ip in unique_ips[site]:
-            if type(ipaddress.ip_address(ip)) is ipaddress.IPv4Address:
-                if MASK == 24:
-                    temp = ".".join(ip.split(".")[0:3]) + ".0/24"
-                elif MASK == 16:
-                    temp = ".".join(ip.split(".")[0:2]) + ".0.0/16"
-                else:
-                    temp = ip.split(".")[0] + ".0.0.0/8"
-
-                if temp not in ranges:
-                    ranges.append(temp)
-
-        for subnet_range in ranges:
-            for ip in unique_ips[site]:
-                if type(ipaddress.ip_address(ip)) is ipaddress.IPv4Address:
-                    if ipaddress.ip_address(ip) in ipaddress.ip_network(subnet_range):
-                        if subnet_range in output[site]:
-                            output[site][subnet_range]["ips"].append(ip)
-                            output[site][subnet_range]["count"] += 1
-                        else:
-                            output[site][subnet_range] = {}
-                            output[site][subnet_range]["ips"] = []
-                            output[site][subnet_range]["ips"].append(ip)
-                            output[site][subnet_range]["count"] = 1
-
     csv_out = []
-    for k in output.keys():
-        site = requests.get(BASE_URL + f"/org/sites/{k}", headers=ORG_HEADERS)
-        site_name = site.json().get("name", "N/A")
-
-        for r in sorted(output[k]):
-            if MASK == 24:
-                utilization = output[k][r]["count"] / 256
-            elif MASK == 16:
-                utilization = output[k][r]["count"] / 65536
-            else:
-                utilization = output[k][r]["count"] / 16777216
+    for k in unique_ips.keys():
+        site_name = get_site_name(k)
 
+        # popcount of the site's bitmap per range - no per address work
+        counts = unique_ips[k].counts_by_prefix(MASK)
+        for network in sorted(counts):
+            utilization = counts[network] / 2 ** (32 - MASK)
             utilization = round(utilization * 100, 2)
 
             temp = {
                 "site_id": k,
                 "site_name": site_name,
-                "range": r,
-                "ip_count": output[k][r]["count"],
+                "range": f"{int_to_ipv4(network)}/{MASK}",
+                "ip_count": counts[network],
                 "utilization": str(utilization) + "%"
             }
             csv_out.append(temp)
 
-        write_to_csv(
-            output=csv_out,
-            filename="utilization_report.csv",
-            fieldnames=["site_id",
-                        "site_name",
-                        "range",
-                        "ip_count",
-                        "utilization"]
-        )
+    write_to_csv(
+        output=csv_out,
+        filename="utilization_report.csv",
+        fieldnames=["site_id",
+                    "site_name",
+                    "range",
+                    "ip_count",
+                    "utilization"]
+    )
 
 
 def get_unique_ips(assets: list):
+    """Unique addresses per site - IPv4 as a bitmap, IPv6 as a set."""
     unique_ips = {}
     for a in assets:
         site = a["site_id"]
-        addresses = a.get("addresses", []) + a.get("addresses_extra", [])
         if site not in unique_ips:
-            unique_ips[site] = []
-        for address in addresses:
-            if address not in unique_ips[site]:
-                unique_ips[site].append(address)
+            unique_ips[site] = IPSet()
+        unique_ips[site].update((a.get("addresses") or []) + (a.get("addresses_extra") or []))
     return unique_ips
 
 
 def get_assets():
-    url = BASE_URL + "/export/org/assets.json"
-    data = requests.get(url, headers=EXPORT_HEADERS, params={
-                        "search": SEARCH, "fields": "site_id,addresses,addresses_extra"})
-    assets = data.json()
-    return assets
+    return stream_assets(
+        RUNZERO_EXPORT_TOKEN,
+        search=SEARCH,
+        fields="site_id,addresses,addresses_extra",
+        base_url=BASE_URL,
+        session=CLIENT,
+    )
 
 
 def main():
@@ -261,6 +243,7 @@ def main():
     unique_ips = get_unique_ips(assets=assets)
     write_unique_ip_to_csv(unique_ips=unique_ips)
     write_subnet_utilization_to_csv(unique_ips=unique_ips)
+    CLIENT.stats.print()
 
 
 if __name__ == "__main__":
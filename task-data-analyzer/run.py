@@ -1,9 +1,20 @@
-import json
 import csv
 import os
 import re
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.files import detect_compression, expand_paths, open_compressed
+from common.taskdata import TASK_EXTENSIONS, parse_task_line, task_stem
+from common.taskindex import TaskIndex, compare_tasks, record_time, task_port
 
 TASK_LIST = ["homenet"]
+# pairs of task IDs (file names without extensions) to diff with --index, e.g.
+# [("scan-monday", "scan-tuesday")] - written to compare_<a>_<b>.csv
+COMPARE_LIST = []
 RESULTS_SUMMARY = []
 RESULTS_SUMMARY_FULL = []
 CHECK_IP_PORT = re.compile(
@@ -11,6 +22,10 @@ CHECK_IP_PORT = re.compile(
 CHECK_IP = re.compile(
     r"^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])$")
 
+# uncompressed task files are split into byte ranges of about this size, one per
+# worker job - compressed files can't be split, so each one is a single job
+CHUNK_BYTES = 64 * 1024 * 1024
+
 
 def write_to_csv(output: dict, filename: str, fieldnames: list):
     file = open(filename, "w")
@@ -23,59 +38,179 @@ def write_to_csv(output: dict, filename: str, fieldnames: list):
     file.close()
 
 
-def main(file, filename):
-
-    # make output directory for each task
-    if not os.path.exists(f"{filename.strip('.json')}-out"):
-        os.mkdir(f"{filename.strip('.json')}-out")
-
-    # handle task data and save key results for later processing
-    errors = {}
-    errors_csv_output = []
-    errors_csv_output_reduced = []
+def chunk_ranges(path: str, chunk_bytes: int = CHUNK_BYTES):
+    """Splits a file into (start, end) byte ranges - parse_chunk lines them up on newlines.
+
+    A gzip or zstd file comes back as a single (0, None) range for the whole stream.
+    """
+    if detect_compression(path) != "none":
+        return [(0, None)]
+    size = os.path.getsize(path)
+    return [(start, min(start + chunk_bytes, size)) for start in range(0, size, chunk_bytes)] or [(0, 0)]
+
+
+def read_range(path: str, start: int, end: int):
+    """Yields the lines that start inside [start, end) of a file, or every line when end is None.
+
+    A range that doesn't begin at 0 skips ahead to the first full line (the
+    line it lands in belongs to the range before), so every line is read by
+    exactly one worker. With end None the file is streamed through
+    open_compressed, so .gz and .zst task files work as they are.
+    """
+    if end is None:
+        with open_compressed(path) as file:
+            yield from file
+        return
+    with open(path, "rb") as file:
+        if start:
+            file.seek(start - 1)
+            file.readline()
+        position = file.tell()
+        while position < end:
+            line = file.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line
+
+
+def parse_chunk(path: str, start: int, end: int):
+    """Worker: parses one range of a task file and returns partial counters.
+
+    Returns (results, errors, lines, span, started, finished) where results is
+    {host: [ports]} and errors is {message: count}, both in first-seen order,
+    span is the (first, last) record ts of the lines that were parsed, and
+    started/finished are the wall clock times the chunk was parsed between.
+    """
+    started = time.time()
     results = {}
-    results_csv_output = []
-    for line in file:
-
-        # create dict
-        jline = json.loads(line.strip("@cee:"))
+    errors = {}
+    lines = 0
+    first = last = None
+    for line in read_range(path, start, end):
+        lines += 1
+
+        # only results, errors and snmp auth failures are counted - skip
+        # everything else (stats, status, config) without parsing it
+        if b"result" not in line and b"error" not in line and b"failedAuth" not in line:
+            continue
+        jline = parse_task_line(line)
+        ts = record_time(jline)
+        if ts is not None:
+            first = ts if first is None else min(first, ts)
+            last = ts if last is None else max(last, ts)
 
         # handle results
         if jline.get("type", "") == "result":
-            if jline.get("host", "") in results:
-                results[jline.get("host", "")]["ports"].append(
-                    jline.get("port", ""))
-                results[jline.get("host", "")]["port_count"] += 1
+            host = jline.get("host", "")
+            ports = results.get(host)
+            if ports is None:
+                results[host] = [jline.get("port", "")]
             else:
-                results[jline.get("host", "")] = {
-                    "ports": [jline.get("port", "")],
-                    "port_count": 1
-                }
+                ports.append(jline.get("port", ""))
 
         # handle errors
         if jline.get("level", "") == "error":
-            if jline["msg"] in errors:
-                errors[jline["msg"]] += 1
-            else:
-                errors[jline["msg"]] = 1
+            errors[jline["msg"]] = errors.get(jline["msg"], 0) + 1
 
         # handle SNMP auth errors
-
         if jline.get("info", "") and jline.get("info", "").get("snmp.failedAuth", ""):
             host = jline.get("host", "")
             failure = jline.get("info", "").get("snmp.failedAuth", "")
             error = f"snmp auth error: {host}:161 {failure}"
-            if error in errors:
-                errors[error] += 1
+            errors[error] = errors.get(error, 0) + 1
+    return results, errors, lines, (first, last), started, time.time()
+
+
+def submit_task_file(path: str, executor: ProcessPoolExecutor, chunk_bytes: int = CHUNK_BYTES):
+    """Queues every chunk of a task file on the pool and returns their futures in file order.
+
+    Submitting all the files before merging any keeps every worker busy even
+    when there are many small or compressed task files.
+    """
+    return [executor.submit(parse_chunk, path, start, end) for start, end in chunk_ranges(path, chunk_bytes)]
+
+
+def merge_chunks(futures: list):
+    """Merges the partial counters of one task file's chunks.
+
+    Chunks are merged in file order, so hosts, ports and errors come out in
+    the same order as reading the file top to bottom. Returns (results,
+    errors, lines, span, elapsed) - span is the (first, last) record ts and
+    elapsed is the wall time from the first chunk starting to the last one
+    finishing, which other files' chunks may overlap.
+    """
+    results = {}
+    errors = {}
+    lines = 0
+    first = last = None
+    started = finished = None
+    for future in futures:
+        chunk_results, chunk_errors, chunk_lines, chunk_span, chunk_started, chunk_finished = future.result()
+        if chunk_span[0] is not None:
+            first = chunk_span[0] if first is None else min(first, chunk_span[0])
+            last = chunk_span[1] if last is None else max(last, chunk_span[1])
+        started = chunk_started if started is None else min(started, chunk_started)
+        finished = chunk_finished if finished is None else max(finished, chunk_finished)
+        for host, ports in chunk_results.items():
+            if host in results:
+                results[host]["ports"].extend(ports)
+                results[host]["port_count"] += len(ports)
             else:
-                errors[error] = 1
+                results[host] = {"ports": ports, "port_count": len(ports)}
+        for error, count in chunk_errors.items():
+            errors[error] = errors.get(error, 0) + count
+        lines += chunk_lines
+    return results, errors, lines, (first, last), finished - started
+
+
+def index_summary(results: dict, errors: dict, lines: int, span: tuple):
+    """Turns a task file's merged counters into the summary TaskIndex.ingest stores.
+
+    The index is fed from what was already parsed rather than from
+    summarize_task, so indexing doesn't read the file a second time.
+    """
+    ports = {}
+    for host, result in results.items():
+        for port in result["ports"]:
+            key = (host, task_port(port))
+            ports[key] = ports.get(key, 0) + 1
+    return {
+        "started_at": span[0],
+        "finished_at": span[1],
+        "lines": lines,
+        "ports": ports,
+        "errors": errors,
+        "error_messages": {},
+    }
+
+
+def main(filename, futures, index=None):
+
+    # make output directory for each task - task.json.gz writes to task-out
+    out_dir = f"{task_stem(filename)}-out"
+    task = os.path.basename(task_stem(filename))
+    if not os.path.exists(out_dir):
+        os.mkdir(out_dir)
+
+    # handle task data and save key results for later processing
+    errors_csv_output = []
+    errors_csv_output_reduced = []
+    results_csv_output = []
+    results, errors, lines, span, elapsed = merge_chunks(futures)
+    print(
+        f"{filename}: {lines} lines in {elapsed:.1f}s ({lines / elapsed if elapsed else 0:.0f} lines/s), "
+        f"{len(results)} hosts, {sum(errors.values())} errors"
+    )
+    if index and index.ingest(filename, summary=index_summary(results, errors, lines, span)):
+        print(f"indexed {index.task_id(filename)}")
 
     # temporary dic for results
     results_summary = {
         "total_hosts": 0,
         "total_hosts_list": [],
         "total_ports": 0,
-        "unique_ports": [],
+        "unique_ports": set(),
         "unique_ports_count": 0,
     }
 
@@ -94,10 +229,8 @@ def main(file, filename):
         # add ports to total port count
         results_summary["total_ports"] += results[k]["port_count"]
 
-        # add port to list if it doesn"t exist yet
-        for p in results[k]["ports"]:
-            if p not in results_summary["unique_ports"]:
-                results_summary["unique_ports"].append(p)
+        # add ports to the set of unique ports
+        results_summary["unique_ports"].update(results[k]["ports"])
 
         # add host to list of hosts
         results_summary["total_hosts_list"].append(k)
@@ -110,7 +243,7 @@ def main(file, filename):
     # write results to CSV
     write_to_csv(
         output=results_csv_output,
-        filename=f"{filename.strip('.json')}-out/results.csv",
+        filename=f"{out_dir}/results.csv",
         fieldnames=[
             "host",
             "port_count",
@@ -120,7 +253,7 @@ def main(file, filename):
     # write summary to CSV
     write_to_csv(
         output=[results_summary],
-        filename=f"{filename.strip('.json')}-out/summary.csv",
+        filename=f"{out_dir}/summary.csv",
         fieldnames=[
             "total_hosts",
             "total_ports",
@@ -131,18 +264,19 @@ def main(file, filename):
 
     # save for global summary
     RESULTS_SUMMARY.append({
-        "task": filename,
+        "task": task,
         "total_hosts": results_summary["total_hosts"],
-        "total_ports": results_summary["unique_ports_count"],
+        "total_ports": results_summary["total_ports"],
         "unique_ports_count": results_summary["unique_ports_count"]
     })
 
     RESULTS_SUMMARY_FULL.append({
-        "task": filename,
+        "task": task,
         "total_hosts": results_summary["total_hosts"],
         "unique_ports_count": results_summary["unique_ports_count"],
         "total_hosts_list": results_summary["total_hosts_list"],
-        "total_ports": results_summary["unique_ports_count"],
+        "total_ports": results_summary["total_ports"],
+        "unique_ports": results_summary["unique_ports"],
     })
 
     # handle errors and write to CSVs
@@ -159,7 +293,7 @@ def main(file, filename):
         if "reconnected" in k.split():
             ips = list(filter(CHECK_IP_PORT.search, k.split()))
             if "reconnected" in errors_reduced_temp:
-                errors_reduced_temp["reconnected"]["hosts"] = errors_reduced_temp["reconnected"]["hosts"] + ips
+                errors_reduced_temp["reconnected"]["hosts"].extend(ips)
                 errors_reduced_temp["reconnected"]["count"] += errors[k]
             else:
                 errors_reduced_temp["reconnected"] = {
@@ -172,7 +306,7 @@ def main(file, filename):
         if "snmp" in k.split():
             ips = list(filter(CHECK_IP_PORT.search, k.split()))
             if "snmp" in errors_reduced_temp:
-                errors_reduced_temp["snmp"]["hosts"] = errors_reduced_temp["snmp"]["hosts"] + ips
+                errors_reduced_temp["snmp"]["hosts"].extend(ips)
                 errors_reduced_temp["snmp"]["count"] += errors[k]
             else:
                 errors_reduced_temp["snmp"] = {
@@ -183,7 +317,7 @@ def main(file, filename):
     # write errors to CSV
     write_to_csv(
         output=errors_csv_output,
-        filename=f"{filename.strip('.json')}-out/errors.csv",
+        filename=f"{out_dir}/errors.csv",
         fieldnames=[
             "error",
             "count"
@@ -204,7 +338,7 @@ def main(file, filename):
     # write errors reduced to CSV
     write_to_csv(
         output=errors_csv_output_reduced,
-        filename=f"{filename.strip('.json')}-out/errors_reduced.csv",
+        filename=f"{out_dir}/errors_reduced.csv",
         fieldnames=[
             "error",
             "count",
@@ -212,32 +346,174 @@ def main(file, filename):
 
         ])
 
+    return task, results, errors
 
-if __name__ == "__main__":
-    for f in TASK_LIST:
-        file = open(f)
-        main(file=file, filename=f)
 
-    # write global summary to CSV
-    write_to_csv(
-        output=RESULTS_SUMMARY,
-        filename=f"results_summary.csv",
-        fieldnames=[
-            "task",
-            "total_hosts",
-            "total_ports",
-            "unique_ports_count",
-        ])
+def combine_tasks(summaries: list):
+    """Builds the cross-task CSV rows from each task's (task, results, errors).
 
-    # write global full summary to CSV
-    write_to_csv(
-        output=RESULTS_SUMMARY_FULL,
-        filename=f"results_summary_full.csv",
-        fieldnames=[
-            "task",
-            "total_hosts",
-            "total_ports",
-            "unique_ports",
-            "unique_ports_count",
-            "total_hosts_list",
-        ])
+    Returns (errors, hosts) - errors has the total count of each error message
+    and the tasks it showed up in, most common first; hosts has every host
+    with the tasks it answered in and the ports it had open across all of them.
+    """
+    errors = {}
+    hosts = {}
+    for task, task_results, task_errors in summaries:
+        for error, count in task_errors.items():
+            combined = errors.setdefault(error, {"error": error, "count": 0, "tasks": []})
+            combined["count"] += count
+            combined["tasks"].append(task)
+        for host, result in task_results.items():
+            combined = hosts.setdefault(host, {"host": host, "tasks": [], "unique_ports": set()})
+            combined["tasks"].append(task)
+            combined["unique_ports"].update(result["ports"])
+
+    errors_output = []
+    for combined in errors.values():
+        combined["task_count"] = len(combined["tasks"])
+        errors_output.append(combined)
+    errors_output.sort(key=lambda d: d["count"], reverse=True)
+
+    hosts_output = []
+    for combined in hosts.values():
+        combined["task_count"] = len(combined["tasks"])
+        combined["unique_ports"] = sorted(combined["unique_ports"], key=str)
+        combined["unique_ports_count"] = len(combined["unique_ports"])
+        hosts_output.append(combined)
+    hosts_output.sort(key=lambda d: d["task_count"], reverse=True)
+    return errors_output, hosts_output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Summarizes runZero task data files - hosts, ports and errors per task"
+    )
+    parser.add_argument(
+        "tasks",
+        nargs="*",
+        default=TASK_LIST,
+        help="task data files, globs or directories - .gz and .zst work as is (default: TASK_LIST)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="worker processes to parse with (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--chunk-mb",
+        type=int,
+        default=CHUNK_BYTES // (1024 * 1024),
+        help="size of the byte ranges each worker parses (default: 64)",
+    )
+    parser.add_argument(
+        "--index",
+        metavar="tasks.db",
+        help="SQLite task index to add the tasks to and compare from",
+    )
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("TASK_A", "TASK_B"),
+        help="with --index, write the hosts and ports that changed between two task IDs (repeatable, adds to COMPARE_LIST)",
+    )
+    args = parser.parse_args()
+    compare = [tuple(pair) for pair in COMPARE_LIST] + [tuple(pair) for pair in args.compare]
+    if compare and not args.index:
+        parser.error("--compare and COMPARE_LIST need --index")
+
+    tasks = expand_paths(args.tasks, extensions=TASK_EXTENSIONS)
+    if not tasks and not args.index:
+        parser.error(f"no task files found in {' '.join(args.tasks)}")
+
+    started = time.time()
+    summaries = []
+    index = TaskIndex(args.index) if args.index else None
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        # queue every chunk of every file first so the pool works on several
+        # files at once, then merge them one file at a time in order
+        jobs = [
+            (f, submit_task_file(f, executor, chunk_bytes=args.chunk_mb * 1024 * 1024))
+            for f in tasks
+        ]
+        for f, futures in jobs:
+            summaries.append(main(filename=f, futures=futures, index=index))
+    print(f"{len(tasks)} task files in {time.time() - started:.1f}s")
+
+    # skipped when only comparing tasks that are already indexed
+    if summaries:
+        # write global summary to CSV
+        write_to_csv(
+            output=RESULTS_SUMMARY,
+            filename=f"results_summary.csv",
+            fieldnames=[
+                "task",
+                "total_hosts",
+                "total_ports",
+                "unique_ports_count",
+            ])
+
+        # write global full summary to CSV
+        write_to_csv(
+            output=RESULTS_SUMMARY_FULL,
+            filename=f"results_summary_full.csv",
+            fieldnames=[
+                "task",
+                "total_hosts",
+                "total_ports",
+                "unique_ports",
+                "unique_ports_count",
+                "total_hosts_list",
+            ])
+
+        # write cross-task summaries to CSV
+        errors_combined, results_combined = combine_tasks(summaries)
+        write_to_csv(
+            output=errors_combined,
+            filename="errors_combined.csv",
+            fieldnames=[
+                "error",
+                "count",
+                "task_count",
+                "tasks",
+            ])
+        write_to_csv(
+            output=results_combined,
+            filename="results_combined.csv",
+            fieldnames=[
+                "host",
+                "task_count",
+                "tasks",
+                "unique_ports_count",
+                "unique_ports",
+            ])
+
+    if index:
+        # every indexed task's errors, oldest task first, for trending
+        write_to_csv(
+            output=list(index.error_trend()),
+            filename="error_trend.csv",
+            fieldnames=[
+                "task_id",
+                "started_at",
+                "error",
+                "count",
+            ])
+
+        for task_a, task_b in compare:
+            try:
+                output = compare_tasks(index, task_a, task_b)
+            except KeyError as e:
+                print(f"skipping {task_a} vs {task_b}: {e.args[0]}")
+                continue
+            write_to_csv(
+                output=output,
+                filename=f"compare_{task_a}_{task_b}.csv",
+                fieldnames=[
+                    "change",
+                    "host",
+                    "port",
+                ])
+        index.close()
@@ -1,7 +1,17 @@
-import json
 import csv
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.files import expand_paths, open_compressed
+from common.taskdata import TASK_EXTENSIONS, parse_task_line, task_stem
+from common.taskindex import TaskIndex, compare_tasks, summarize_task
 
 TASK_LIST = ["task1", "task2"]
+# pairs of task IDs (file names without extensions) to diff with --index, e.g.
+# [("scan-monday", "scan-tuesday")] - written to compare_<a>_<b>.csv
 COMPARE_LIST = []
 
 
@@ -16,16 +26,25 @@ def write_to_csv(output: dict, filename: str, fieldnames: list):
     file.close()
 
 
-def main(file, filename):
+def count_errors(filename: str):
+    """Worker: counts each error-message in a task log, which may be gzip or zstd compressed."""
     errors = {}
+    with open_compressed(filename) as file:
+        for line in file:
+            # most lines aren't errors - skip them without parsing
+            if b"error-message" not in line:
+                continue
+            jline = parse_task_line(line)
+            if "error-message" in jline:
+                if jline["error-message"] in errors:
+                    errors[jline["error-message"]] += 1
+                else:
+                    errors[jline["error-message"]] = 1
+    return errors
+
+
+def main(errors, filename):
     csv_output = []
-    for line in file:
-        jline = json.loads(line.strip("@cee:"))
-        if "error-message" in jline:
-            if jline["error-message"] in errors:
-                errors[jline["error-message"]] += 1
-            else:
-                errors[jline["error-message"]] = 1
 
     for k in errors.keys():
         csv_output.append({
@@ -37,14 +56,130 @@ def main(file, filename):
 
     write_to_csv(
         output=csv_output,
-        filename=f"{filename.strip('.json')}_errors.csv",
+        filename=f"{task_stem(filename)}_errors.csv",
         fieldnames=[
             "error",
             "count"
         ])
 
 
+def combine_errors(task_errors: dict):
+    """Totals errors across task logs - rows of error, count, task_count and tasks, most common first."""
+    combined = {}
+    for task, errors in task_errors.items():
+        for error, count in errors.items():
+            row = combined.setdefault(error, {"error": error, "count": 0, "tasks": []})
+            row["count"] += count
+            row["tasks"].append(task)
+    for row in combined.values():
+        row["task_count"] = len(row["tasks"])
+    return sorted(combined.values(), key=lambda d: d["count"], reverse=True)
+
+
+def process_tasks(tasks: list, executor: ProcessPoolExecutor, index: TaskIndex = None):
+    """Yields (task log, error counts) in order, reading each file once in the pool.
+
+    With an index, logs that aren't indexed yet are summarized and added to
+    it, and their error counts come from the summary - the rest just have
+    their errors counted.
+    """
+    jobs = []
+    for f in tasks:
+        if index and index.needs_ingest(f):
+            jobs.append((f, True, executor.submit(summarize_task, f)))
+        else:
+            jobs.append((f, False, executor.submit(count_errors, f)))
+    for f, summarized, future in jobs:
+        if summarized:
+            summary = future.result()
+            index.ingest(f, summary=summary)
+            print(f"indexed {index.task_id(f)}")
+            yield f, summary["error_messages"]
+        else:
+            yield f, future.result()
+
+
 if __name__ == "__main__":
-    for f in TASK_LIST:
-        file = open(f)
-        main(file=file, filename=f)
+    parser = argparse.ArgumentParser(
+        description="Counts the errors in runZero task logs"
+    )
+    parser.add_argument(
+        "tasks",
+        nargs="*",
+        default=TASK_LIST,
+        help="task logs, globs or directories - .gz and .zst work as is (default: TASK_LIST)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="worker processes, one task log each (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--index",
+        metavar="tasks.db",
+        help="SQLite task index to add the tasks to - each task is only parsed once - and compare from",
+    )
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("TASK_A", "TASK_B"),
+        help="with --index, write the hosts and ports that changed between two task IDs (repeatable, adds to COMPARE_LIST)",
+    )
+    args = parser.parse_args()
+    compare = [tuple(pair) for pair in COMPARE_LIST] + [tuple(pair) for pair in args.compare]
+    if compare and not args.index:
+        parser.error("--compare and COMPARE_LIST need --index")
+
+    tasks = expand_paths(args.tasks, extensions=TASK_EXTENSIONS)
+    if not tasks and not args.index:
+        parser.error(f"no task logs found in {' '.join(args.tasks)}")
+
+    task_errors = {}
+    index = TaskIndex(args.index) if args.index else None
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for f, errors in process_tasks(tasks, executor, index):
+            main(errors=errors, filename=f)
+            task_errors[os.path.basename(task_stem(f))] = errors
+
+    # write the errors of every task log to one CSV
+    if task_errors:
+        write_to_csv(
+            output=combine_errors(task_errors),
+            filename="errors_summary.csv",
+            fieldnames=[
+                "error",
+                "count",
+                "task_count",
+                "tasks",
+            ])
+
+    if index:
+        # every indexed task's errors, oldest task first, for trending
+        write_to_csv(
+            output=list(index.error_trend()),
+            filename="error_trend.csv",
+            fieldnames=[
+                "task_id",
+                "started_at",
+                "error",
+                "count",
+            ])
+
+        for task_a, task_b in compare:
+            try:
+                output = compare_tasks(index, task_a, task_b)
+            except KeyError as e:
+                print(f"skipping {task_a} vs {task_b}: {e.args[0]}")
+                continue
+            write_to_csv(
+                output=output,
+                filename=f"compare_{task_a}_{task_b}.csv",
+                fieldnames=[
+                    "change",
+                    "host",
+                    "port",
+                ])
+        index.close()